@@ -0,0 +1,334 @@
+"""
+Summary:
+This module runs the summarization requests of a step (step1, step4 or step5) as one job of the Azure OpenAI Batch
+API instead of synchronous chat completions. Batch jobs use their own quota and a lower price, so the weekly
+preprocessing no longer competes with interactive workloads for the TPM quota of the deployment.
+
+A step builds the list of requests it is about to send, `BatchRunner.prefetch` sends the ones that are neither in
+the summary cache nor in a previous batch result as a batch job, waits for it and hands the results to the
+`llm_client.LLMClient`, so the step then runs as usual and gets every answer without a request. Requests the
+batch did not answer (errors, expired job), or all of them if the job can't be submitted or polled, are sent
+synchronously by the step, as before.
+
+Key functionalities:
+- **JSONL Batch File**: One line per request, with the cache key of the request (`summary_cache.cache_key`) as its
+  `custom_id`, so results are mapped back to requests (and to files) by key.
+- **Submit and Poll**: The file is uploaded, the batch created and its status polled every `--batch_poll_seconds`.
+- **Resume**: The id of the running batch is kept in `batch_state.json` and the downloaded results in
+  `batch_results.jsonl`, in `--batch_dir` (the summary cache folder by default). A step restarted after an
+  interruption resumes polling the running batch instead of submitting the requests again.
+- **Batch Deployment**: Azure OpenAI only runs batch jobs on Global-Batch deployments: `--batch_model` names it
+  (defaults to `--aoai_model`). Its answers are cached for the synchronous requests they replace.
+- **Endpoints**: The Azure OpenAI resource of the step (`--batch_api_version`), or any OpenAI-compatible server
+  with `--batch_base_url` (e.g. `tools/fake_openai_server.py` for tests), which defaults to `--llm_base_url` with
+  `--llm_backend openai`. The stub backend has no batch mode: its requests are answered locally anyway.
+
+Command-line Arguments (added with `add_batch_arguments`):
+- --batch_mode: "True" to prefetch the requests with a batch job.
+- --batch_dir: Persistent folder of the batch state (defaults to `--cache_dir`).
+- --batch_poll_seconds: Seconds between two status checks.
+- --batch_model: Deployment (model) of the batch jobs, e.g. a Global-Batch deployment.
+- --batch_base_url: OpenAI-compatible base URL used instead of the Azure OpenAI resource.
+- --batch_api_version: Azure OpenAI API version of the batch calls.
+"""
+
+import json
+import os
+import tempfile
+import time
+
+import openai
+from openai import AzureOpenAI, OpenAI
+
+from llm_backends import NO_API_KEY
+from sharding import resolve_shard, shard_file_name
+from summary_cache import cache_key
+
+BATCH_STATE_FILENAME = "batch_state.json"
+BATCH_REQUESTS_FILENAME = "batch_requests.jsonl"
+BATCH_RESULTS_FILENAME = "batch_results.jsonl"
+
+BATCH_API_VERSION = "2024-10-21"
+# request URL of the batch lines: Azure OpenAI routes by deployment (the "model" of the body)
+AZURE_BATCH_ENDPOINT = "/chat/completions"
+OPENAI_BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def add_batch_arguments(parser):
+    """
+    Function to add the batch mode arguments to a step's argument parser.
+
+    Args:
+    parser (argparse.ArgumentParser): The step's argument parser.
+    """
+    parser.add_argument("--batch_mode", type=str, default="False")
+    parser.add_argument("--batch_dir", type=str, default=None)
+    parser.add_argument("--batch_poll_seconds", type=float, default=60.0)
+    parser.add_argument("--batch_model", type=str, default=None)
+    parser.add_argument("--batch_base_url", type=str, default=None)
+    parser.add_argument(
+        "--batch_api_version", type=str, default=BATCH_API_VERSION
+    )
+
+
+class BatchRunner:
+    """
+    Batch job of the requests of a step, resumable from batch_dir.
+
+    Args:
+    llm (LLMClient): The client of the step, receiving the results.
+    client (OpenAI | AzureOpenAI): Client of the files and batches APIs.
+    endpoint (str): Request URL of the batch lines.
+    batch_dir (str): Persistent folder of the batch state.
+    shard (tuple): (shard index, number of shards); shards keep their own state files.
+    poll_seconds (float): Seconds between two status checks.
+    model (str): Deployment of the batch jobs (defaults to the model of llm).
+    """
+
+    def __init__(
+        self,
+        llm,
+        client,
+        endpoint: str,
+        batch_dir: str,
+        shard: tuple = (0, 1),
+        poll_seconds: float = 60.0,
+        model: str = None,
+    ):
+        self.llm = llm
+        self.client = client
+        self.endpoint = endpoint
+        self.poll_seconds = poll_seconds
+        self.model = model or llm.model
+        os.makedirs(batch_dir, exist_ok=True)
+        self.state_path, self.requests_path, self.results_path = (
+            os.path.join(batch_dir, shard_file_name(name, shard))
+            for name in (
+                BATCH_STATE_FILENAME,
+                BATCH_REQUESTS_FILENAME,
+                BATCH_RESULTS_FILENAME,
+            )
+        )
+
+    @classmethod
+    def from_args(cls, args, llm):
+        """Function to create a runner from the step's parsed arguments, or None without `--batch_mode True`"""
+        if args.batch_mode.lower() != "true":
+            return None
+        if args.llm_backend == "stub":
+            print("The stub backend answers locally: batch mode ignored.")
+            return None
+        if args.batch_base_url or args.llm_backend == "openai":
+            client = OpenAI(
+                base_url=args.batch_base_url or llm.endpoint,
+                api_key=llm.api_key or NO_API_KEY,
+                max_retries=args.max_retries,
+            )
+            endpoint = OPENAI_BATCH_ENDPOINT
+        else:
+            client = AzureOpenAI(
+                azure_endpoint=llm.endpoint,
+                api_key=llm.api_key,
+                api_version=args.batch_api_version,
+                max_retries=args.max_retries,
+            )
+            endpoint = AZURE_BATCH_ENDPOINT
+        batch_dir = args.batch_dir or args.cache_dir
+        if not batch_dir:
+            batch_dir = tempfile.mkdtemp(prefix="llm_batch_")
+            print(
+                f"No --batch_dir nor --cache_dir: an interrupted batch can't be resumed ({batch_dir})."
+            )
+        return cls(
+            llm,
+            client,
+            endpoint,
+            batch_dir,
+            resolve_shard(args),
+            args.batch_poll_seconds,
+            args.batch_model,
+        )
+
+    def prefetch(self, requests: list):
+        """
+        Function to get the results of requests with a batch job and hand them to the LLM client.
+
+        Args:
+        requests (list): (messages, params) of every request the step may send.
+        """
+        wanted = {}
+        for messages, params in requests:
+            key = cache_key(self.llm.cache_model, messages, params)
+            wanted.setdefault(key, (messages, params))
+        results = {
+            key: content
+            for key, content in self.read_results().items()
+            if key in wanted
+        }
+
+        try:
+            state = self.read_state()
+            if state is not None:
+                print(f"resuming batch {state['batch_id']}")
+                self.collect(state["batch_id"], results)
+
+            pending = [
+                key
+                for key in wanted
+                if key not in results
+                and (self.llm.cache is None or key not in self.llm.cache)
+            ]
+            print(
+                f"batch: {len(wanted)} requests, {len(results)} already answered, "
+                f"{len(wanted) - len(results) - len(pending)} cached, {len(pending)} to submit"
+            )
+            if pending:
+                self.collect(self.submit(pending, wanted), results)
+        except (openai.OpenAIError, RuntimeError) as e:
+            # e.g. no Global-Batch deployment: the step sends the requests itself
+            print(
+                f"batch job failed, unanswered requests are sent synchronously: "
+                f"{type(e).__name__}: {e}"
+            )
+            if isinstance(e, openai.NotFoundError):
+                # the saved batch (or its files) no longer exists: don't resume it again
+                self.drop_state()
+        self.llm.prefetch(results)
+
+    def submit(self, keys: list, wanted: dict) -> str:
+        """
+        Function to write, upload and submit the batch file of the given requests.
+
+        Args:
+        keys (list): Cache keys of the requests to submit.
+        wanted (dict): Cache key -> (messages, params).
+
+        Returns:
+        str: The batch id.
+        """
+        with open(self.requests_path, "w", encoding="utf-8") as f:
+            for key in keys:
+                messages, params = wanted[key]
+                line = {
+                    "custom_id": key,
+                    "method": "POST",
+                    "url": self.endpoint,
+                    "body": {
+                        "model": self.model,
+                        "messages": messages,
+                        **params,
+                    },
+                }
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+        with open(self.requests_path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        # Azure OpenAI validates the upload before it can be used
+        while input_file.status not in ("processed", "error"):
+            time.sleep(min(self.poll_seconds, 5))
+            input_file = self.client.files.retrieve(input_file.id)
+        if input_file.status == "error":
+            raise RuntimeError(
+                f"batch file {input_file.id} was rejected: {input_file.status_details}"
+            )
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=self.endpoint,
+            completion_window=COMPLETION_WINDOW,
+        )
+        self.write_state(
+            {
+                "batch_id": batch.id,
+                "input_file_id": input_file.id,
+                "requests": len(keys),
+            }
+        )
+        print(f"submitted batch {batch.id} with {len(keys)} requests")
+        return batch.id
+
+    def collect(self, batch_id: str, results: dict):
+        """
+        Function to wait for a batch and add its answers to results.
+
+        Args:
+        batch_id (str): The batch id.
+        results (dict): Cache key -> content, updated in place and saved to batch_results.jsonl.
+        """
+        while True:
+            batch = self.client.batches.retrieve(batch_id)
+            counts = batch.request_counts
+            print(
+                f"batch {batch_id}: {batch.status}"
+                + (
+                    f" ({counts.completed}/{counts.total} done, {counts.failed} failed)"
+                    if counts
+                    else ""
+                )
+            )
+            if batch.status in TERMINAL_STATUSES:
+                break
+            time.sleep(self.poll_seconds)
+
+        answered = 0
+        if batch.output_file_id:
+            output = self.client.files.content(batch.output_file_id).text
+            for line in output.splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                response = item.get("response") or {}
+                if response.get("status_code") != 200:
+                    continue
+                content = response["body"]["choices"][0]["message"]["content"]
+                if content:
+                    results[item["custom_id"]] = content
+                    answered += 1
+        print(
+            f"batch {batch_id} {batch.status}: {answered} answers, "
+            "unanswered requests are sent synchronously"
+        )
+        # results first: the state is only dropped once they are safe
+        self.write_results(results)
+        self.drop_state()
+
+    def read_state(self):
+        """Function to read the running batch, or None"""
+        if not os.path.exists(self.state_path):
+            return None
+        with open(self.state_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def drop_state(self):
+        """Function to forget the running batch"""
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+
+    def write_state(self, state: dict):
+        """Function to save the running batch"""
+        with open(self.state_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def read_results(self) -> dict:
+        """Function to read the saved batch results"""
+        results = {}
+        if os.path.exists(self.results_path):
+            with open(self.results_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    item = json.loads(line)
+                    results[item["custom_id"]] = item["content"]
+        return results
+
+    def write_results(self, results: dict):
+        """Function to save the batch results of the current requests"""
+        with open(self.results_path + ".tmp", "w", encoding="utf-8") as f:
+            for key, content in results.items():
+                f.write(
+                    json.dumps(
+                        {"custom_id": key, "content": content},
+                        ensure_ascii=False,
+                    )
+                    + "\n"
+                )
+        os.replace(self.results_path + ".tmp", self.results_path)
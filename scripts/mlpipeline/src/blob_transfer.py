@@ -0,0 +1,308 @@
+"""
+Summary:
+This module moves files between the pipeline and Azure Blob Storage with many requests in flight, instead of one
+blob at a time.
+
+Key functionalities:
+- **Pooled Client**: One `ContainerClient` per step, backed by a `requests` session whose connection pool is sized
+  for the number of workers, so every transfer reuses open connections.
+- **Concurrent Download**: Blobs are listed once (optionally filtered by `name_starts_with`) and downloaded on a
+  thread pool. Each blob is streamed to disk with `readinto` instead of being loaded into memory.
+- **Renaming on the Fly**: Downloaded files can get a new extension (e.g. `.md` -> `.txt` for GraphRAG) while they
+  are written, so no rename pass over the folder is needed afterwards.
+- **Concurrent Upload**: Files are uploaded on a thread pool. Files over `max_single_put_size` are sent as blocks of
+  `max_block_size`, `max_concurrency` blocks at a time, so large artifacts (e.g. GraphRAG parquet files) do not
+  become a serial tail.
+- **Progress**: Transfers report their throughput in MB/s.
+- **Delta Sync**: `sync_files` compares the MD5 of every local file with the `content_md5` of the blob and only
+  uploads new or changed files; blobs without a local file can optionally be deleted. Uploads always set
+  `content_md5`, which the service does not compute for files uploaded in blocks.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from azure.core.pipeline.transport import RequestsTransport
+from azure.storage.blob import BlobServiceClient, ContentSettings
+
+DEFAULT_MAX_WORKERS = 16
+
+# files larger than MAX_SINGLE_PUT_SIZE are uploaded in blocks of MAX_BLOCK_SIZE
+MAX_SINGLE_PUT_SIZE = 8 * 1024 * 1024
+MAX_BLOCK_SIZE = 8 * 1024 * 1024
+# parallel block uploads of one large file
+LARGE_FILE_CONCURRENCY = 4
+
+
+def connection_string(account_name: str, account_key: str) -> str:
+    """Function to build the connection string of a storage account"""
+    return (
+        f"DefaultEndpointsProtocol=https;AccountName={account_name};"
+        f"AccountKey={account_key};EndpointSuffix=core.windows.net"
+    )
+
+
+def create_container_client(
+    conn_str: str, container_name: str, max_workers=DEFAULT_MAX_WORKERS
+):
+    """
+    Function to create a container client whose connection pool can serve max_workers concurrent requests.
+
+    Args:
+    conn_str (str): The storage account connection string.
+    container_name (str): The container name.
+    max_workers (int): Number of threads that will share the client.
+
+    Returns:
+    ContainerClient: The container client.
+    """
+    # large files open up to LARGE_FILE_CONCURRENCY connections each
+    pool_size = max_workers * LARGE_FILE_CONCURRENCY
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    blob_service_client = BlobServiceClient.from_connection_string(
+        conn_str,
+        transport=RequestsTransport(session=session),
+        max_single_put_size=MAX_SINGLE_PUT_SIZE,
+        max_block_size=MAX_BLOCK_SIZE,
+    )
+    return blob_service_client.get_container_client(container_name)
+
+
+def ensure_container(container_client):
+    """Function to create the container if it doesn't exist"""
+    try:
+        container_client.create_container()
+    except Exception as e:
+        print(f"Container already exists or couldn't be created: {e}")
+
+
+class TransferProgress:
+    """Thread-safe byte counter printing the throughput of a transfer."""
+
+    def __init__(self, action: str, total_files: int, every: int = 1000):
+        self.action = action
+        self.total_files = total_files
+        self.every = every
+        self.files = 0
+        self.bytes = 0
+        self.start = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add(self, size: int):
+        with self.lock:
+            self.files += 1
+            self.bytes += size
+            if self.files % self.every == 0 or self.files == self.total_files:
+                self.report()
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.start, 1e-6)
+        print(
+            f"{self.action} {self.files}/{self.total_files} files, "
+            f"{self.bytes / 1024 / 1024:.1f} MB in {elapsed:.1f}s "
+            f"({self.bytes / 1024 / 1024 / elapsed:.1f} MB/s)"
+        )
+
+
+def _local_path(blob_name: str, local_folder: str, suffix: str, new_suffix):
+    if suffix and new_suffix is not None:
+        blob_name = blob_name[: -len(suffix)] + new_suffix
+    return os.path.join(local_folder, *blob_name.split("/"))
+
+
+def _download_blob(container_client, blob_name: str, file_path: str) -> int:
+    """Function to stream one blob to file_path, returning the number of bytes written"""
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_path = file_path + ".download"
+    with open(tmp_path, "wb") as f:
+        size = container_client.download_blob(blob_name).readinto(f)
+    os.replace(tmp_path, file_path)
+    return size
+
+
+def download_blobs(
+    container_client,
+    local_folder: str,
+    suffix: str = "",
+    new_suffix: str = None,
+    name_starts_with: str = None,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+) -> int:
+    """
+    Function to download the blobs of a container concurrently, streaming each one to disk.
+
+    Args:
+    container_client (ContainerClient): Client created with `create_container_client`.
+    local_folder (str): Folder to download to; blob paths are kept.
+    suffix (str): Only blobs whose name ends with suffix are downloaded (e.g. ".md").
+    new_suffix (str): Replaces suffix in the local file names (e.g. ".txt"), or None to keep the names.
+    name_starts_with (str): Optional blob name prefix to list.
+    max_workers (int): Number of concurrent downloads.
+
+    Returns:
+    int: The number of downloaded blobs.
+    """
+    blob_names = [
+        name
+        for name in container_client.list_blob_names(
+            name_starts_with=name_starts_with
+        )
+        if name.endswith(suffix)
+    ]
+    print(
+        f"downloading {len(blob_names)} blobs to {local_folder} "
+        f"with {max_workers} workers"
+    )
+    progress = TransferProgress("downloaded", len(blob_names))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [
+            pool.submit(
+                _download_blob,
+                container_client,
+                name,
+                _local_path(name, local_folder, suffix, new_suffix),
+            )
+            for name in blob_names
+        ]
+        for future in futures:
+            progress.add(future.result())
+    return len(blob_names)
+
+
+def file_md5(file_path: str) -> bytes:
+    """Function to compute the MD5 digest of a file, as stored in a blob's content_md5"""
+    md5 = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(MAX_BLOCK_SIZE), b""):
+            md5.update(block)
+    return md5.digest()
+
+
+def _upload_file(container_client, file_path: str, blob_name: str) -> int:
+    """Function to upload one file, returning its size"""
+    size = os.path.getsize(file_path)
+    content_settings = ContentSettings(content_md5=file_md5(file_path))
+    with open(file_path, "rb") as data:
+        container_client.upload_blob(
+            blob_name,
+            data,
+            overwrite=True,
+            length=size,
+            content_settings=content_settings,
+            max_concurrency=(
+                LARGE_FILE_CONCURRENCY if size > MAX_SINGLE_PUT_SIZE else 1
+            ),
+        )
+    return size
+
+
+def upload_files(
+    container_client, files: list, max_workers: int = DEFAULT_MAX_WORKERS
+) -> int:
+    """
+    Function to upload files concurrently.
+
+    Args:
+    container_client (ContainerClient): Client created with `create_container_client`.
+    files (list): `(local file path, blob name)` pairs.
+    max_workers (int): Number of concurrent uploads.
+
+    Returns:
+    int: The number of uploaded bytes.
+    """
+    print(f"uploading {len(files)} files with {max_workers} workers")
+    progress = TransferProgress("uploaded", len(files))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [
+            pool.submit(_upload_file, container_client, file_path, blob_name)
+            for file_path, blob_name in files
+        ]
+        for future in futures:
+            progress.add(future.result())
+    return progress.bytes
+
+
+def list_folder(folder_path: str, suffix: str = "", recursive: bool = True):
+    """
+    Function to list the files of a folder with the blob names that keep their relative paths.
+
+    Args:
+    folder_path (str): The folder to list.
+    suffix (str): Only files whose name ends with suffix are listed.
+    recursive (bool): Whether to include sub-folders.
+
+    Returns:
+    list: Sorted `(local file path, blob name)` pairs.
+    """
+    files = []
+    for root, _, file_names in os.walk(folder_path):
+        for file_name in file_names:
+            if file_name.endswith(suffix):
+                file_path = os.path.join(root, file_name)
+                blob_name = os.path.relpath(file_path, folder_path).replace(
+                    "\\", "/"
+                )
+                files.append((file_path, blob_name))
+        if not recursive:
+            break
+    return sorted(files, key=lambda item: item[1])
+
+
+def sync_files(
+    container_client,
+    files: list,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    delete_stale: bool = False,
+) -> dict:
+    """
+    Function to upload only the files whose content differs from the blob of the same name.
+
+    Args:
+    container_client (ContainerClient): Client created with `create_container_client`.
+    files (list): `(local file path, blob name)` pairs.
+    max_workers (int): Number of concurrent hash computations, uploads and deletions.
+    delete_stale (bool): Whether to delete the blobs that have no local file.
+
+    Returns:
+    dict: Numbers of "uploaded", "unchanged" and "deleted" blobs.
+    """
+    remote_md5 = {
+        blob.name: blob.content_settings.content_md5
+        for blob in container_client.list_blobs()
+    }
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        local_md5 = list(
+            pool.map(file_md5, [file_path for file_path, _ in files])
+        )
+    changed = [
+        (file_path, blob_name)
+        for (file_path, blob_name), md5 in zip(files, local_md5)
+        if not remote_md5.get(blob_name) or bytes(remote_md5[blob_name]) != md5
+    ]
+    print(
+        f"{len(changed)} of {len(files)} files are new or changed "
+        f"({len(files) - len(changed)} unchanged)"
+    )
+    upload_files(container_client, changed, max_workers)
+
+    stale = []
+    if delete_stale:
+        local_names = {blob_name for _, blob_name in files}
+        stale = sorted(name for name in remote_md5 if name not in local_names)
+        print(f"deleting {len(stale)} stale blobs")
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            list(pool.map(container_client.delete_blob, stale))
+    return {
+        "uploaded": len(changed),
+        "unchanged": len(files) - len(changed),
+        "deleted": len(stale),
+    }
@@ -0,0 +1,264 @@
+"""
+Summary:
+This module spreads the summarization requests of a step over several Azure OpenAI deployments (e.g. the same
+model deployed in several regions), so the throughput of a step is the sum of their TPM quotas instead of the quota
+of one deployment.
+
+Key functionalities:
+- **Deployment List**: `--aoai_endpoints` takes a JSON list (inline, or the path of a JSON file) of
+  `{"resource": ..., "model": ..., "api_key": ..., "weight": ...}`. Without it, the step uses the single
+  deployment of `--aoai_resource` / `--aoai_model` / `--aoai_apikey` as before. The deployments are expected to
+  serve the same model: summaries are cached under one model name. With `--llm_backend openai` (`llm_backends`),
+  entries give the `base_url` of an OpenAI-compatible server instead of a `resource`.
+- **Capacity Routing**: Each request goes to a deployment drawn with a probability proportional to its weight,
+  times its share of remaining tokens (`x-ratelimit-remaining-tokens` of its last response), divided by its
+  requests in flight.
+- **Out of Rotation**: A throttled (429) deployment is skipped until its `Retry-After` has passed. After
+  `failure_threshold` consecutive failures (429, timeouts, 5xx), a deployment is taken out of rotation for a cooldown
+  that doubles with every further failure. Once the cooldown has passed, a single probe request is let through and
+  a success brings the deployment back.
+- **Per-request Avoidance**: A request that failed on a deployment avoids it for its backoff delay and is retried on
+  another one right away; it only waits when no other deployment is available. With a single deployment this is
+  the backoff of `llm_client.LLMClient`.
+"""
+
+import json
+import os
+import random
+import threading
+import time
+
+# a remaining-tokens header older than this no longer tells the capacity of a deployment
+CAPACITY_MAX_AGE_SECONDS = 60.0
+# lowest capacity share, so a deployment with few remaining tokens is still tried
+MIN_CAPACITY = 0.05
+
+
+class Deployment:
+    """
+    One deployment of a `DeploymentPool`: an Azure OpenAI deployment, or a model of an OpenAI-compatible server.
+
+    Args:
+    resource (str): The Azure OpenAI resource name.
+    model (str): The deployment (or served model) name.
+    api_key (str): The API key of the resource.
+    weight (float): Relative share of the requests when every deployment has the same capacity.
+    base_url (str): Base URL of an OpenAI-compatible server, used instead of resource.
+    """
+
+    def __init__(
+        self,
+        resource: str,
+        model: str,
+        api_key: str,
+        weight: float = 1.0,
+        base_url: str = None,
+    ):
+        self.resource = resource
+        self.model = model
+        self.api_key = api_key
+        self.weight = weight
+        self.endpoint = base_url or f"https://{resource}.openai.azure.com/"
+        self.name = f"{base_url or resource}/{model}"
+        # clients, created by LLMClient
+        self.client = None
+        self.async_client = None
+
+        self.available_at = 0.0
+        self.consecutive_failures = 0
+        self.out_of_rotation = False
+        self.probing = False
+        self.in_flight = 0
+        self.remaining_tokens = None
+        self.max_remaining_tokens = 0
+        self.capacity_time = 0.0
+        self.requests = 0
+        self.failures = 0
+
+    def capacity(self, now: float) -> float:
+        """Function to get the share of its token quota the deployment had left at its last response"""
+        if (
+            self.remaining_tokens is None
+            or not self.max_remaining_tokens
+            or now - self.capacity_time > CAPACITY_MAX_AGE_SECONDS
+        ):
+            return 1.0
+        return max(
+            MIN_CAPACITY, self.remaining_tokens / self.max_remaining_tokens
+        )
+
+
+def parse_deployments(endpoints: str) -> list:
+    """
+    Function to read the `--aoai_endpoints` list.
+
+    Args:
+    endpoints (str): A JSON list, or the path of a JSON file holding it.
+
+    Returns:
+    list: The `Deployment`s.
+    """
+    if os.path.exists(endpoints):
+        with open(endpoints, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+    else:
+        entries = json.loads(endpoints)
+    deployments = [
+        Deployment(
+            entry.get("resource"),
+            entry["model"],
+            entry.get("api_key"),
+            float(entry.get("weight", 1.0)),
+            entry.get("base_url"),
+        )
+        for entry in entries
+    ]
+    if not deployments:
+        raise ValueError("--aoai_endpoints lists no deployment")
+    return deployments
+
+
+class DeploymentPool:
+    """
+    Deployments of a step, with capacity routing and a circuit breaker.
+
+    Args:
+    deployments (list): The `Deployment`s.
+    failure_threshold (int): Consecutive failures taking a deployment out of rotation.
+    cooldown (float): Seconds out of rotation after failure_threshold failures, doubled for every further failure.
+    max_cooldown (float): Upper bound of the cooldown in seconds.
+    """
+
+    def __init__(
+        self,
+        deployments: list,
+        failure_threshold: int = 3,
+        cooldown: float = 30.0,
+        max_cooldown: float = 600.0,
+    ):
+        self.deployments = deployments
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.lock = threading.Lock()
+
+    def acquire(self, avoid: dict) -> tuple:
+        """
+        Function to pick the deployment of the next attempt of a request.
+
+        Args:
+        avoid (dict): Deployment name -> time (`time.monotonic`) until which this request avoids it.
+
+        Returns:
+        tuple: (deployment, 0.0), or (None, seconds to wait before asking again).
+        """
+        with self.lock:
+            now = time.monotonic()
+            ready = [
+                deployment
+                for deployment in self.deployments
+                if deployment.available_at <= now
+                and not deployment.probing
+                and avoid.get(deployment.name, 0.0) <= now
+            ]
+            if not ready:
+                wait = min(
+                    max(
+                        deployment.available_at,
+                        avoid.get(deployment.name, 0.0),
+                        # a probe is in flight: look again shortly
+                        now + 1.0 if deployment.probing else 0.0,
+                    )
+                    for deployment in self.deployments
+                )
+                return None, max(0.0, wait - now)
+            deployment = random.choices(
+                ready,
+                [
+                    deployment.weight
+                    * deployment.capacity(now)
+                    / (1 + deployment.in_flight)
+                    for deployment in ready
+                ],
+            )[0]
+            if deployment.out_of_rotation:
+                deployment.probing = True
+            deployment.in_flight += 1
+            deployment.requests += 1
+            return deployment, 0.0
+
+    def succeeded(self, deployment: Deployment, headers):
+        """
+        Function to record a successful response.
+
+        Args:
+        deployment (Deployment): The deployment that answered.
+        headers (Mapping): The response headers, read for the remaining token quota.
+        """
+        with self.lock:
+            deployment.in_flight -= 1
+            deployment.probing = False
+            deployment.consecutive_failures = 0
+            if deployment.out_of_rotation:
+                deployment.out_of_rotation = False
+                print(f"{deployment.name} is back in rotation")
+            remaining = headers.get("x-ratelimit-remaining-tokens")
+            if remaining is not None:
+                try:
+                    deployment.remaining_tokens = int(remaining)
+                except ValueError:
+                    return
+                deployment.max_remaining_tokens = max(
+                    deployment.max_remaining_tokens,
+                    deployment.remaining_tokens,
+                )
+                deployment.capacity_time = time.monotonic()
+
+    def failed(self, deployment: Deployment, retry_after: float = None):
+        """
+        Function to record a throttled or failed attempt.
+
+        Args:
+        deployment (Deployment): The deployment that failed.
+        retry_after (float): Seconds the service asked to wait (429), if any.
+        """
+        with self.lock:
+            now = time.monotonic()
+            deployment.in_flight -= 1
+            deployment.probing = False
+            deployment.failures += 1
+            deployment.consecutive_failures += 1
+            if len(self.deployments) == 1:
+                # nowhere else to go: the request backs off by itself
+                return
+            if retry_after is not None:
+                deployment.available_at = max(
+                    deployment.available_at, now + retry_after
+                )
+            excess = deployment.consecutive_failures - self.failure_threshold
+            if excess >= 0:
+                cooldown = min(self.max_cooldown, self.cooldown * 2**excess)
+                deployment.available_at = max(
+                    deployment.available_at, now + cooldown
+                )
+                deployment.out_of_rotation = True
+                print(
+                    f"{deployment.name} out of rotation for {cooldown:.0f}s "
+                    f"after {deployment.consecutive_failures} consecutive failures"
+                )
+
+    def released(self, deployment: Deployment):
+        """Function to release a deployment after an error caused by the request itself"""
+        with self.lock:
+            deployment.in_flight -= 1
+            deployment.probing = False
+
+    def __len__(self):
+        return len(self.deployments)
+
+    def __str__(self):
+        return ", ".join(
+            f"{deployment.name}: requests={deployment.requests} failures={deployment.failures}"
+            + (" (out of rotation)" if deployment.out_of_rotation else "")
+            for deployment in self.deployments
+        )
@@ -0,0 +1,250 @@
+"""
+Summary:
+This module summarizes small or trivial Markdown sections locally, on the CPU, so step4 / step5 (and the fused
+runner) only send substantive sections to Azure OpenAI. A section made of a heading and a couple of lines, or of
+tables and lists of links, gains little from a model call but costs a full round trip.
+
+Key functionalities:
+- **Selection**: A section is summarized locally when it has at most `--extractive_max_tokens` tokens, or when its
+  prose density (share of its characters in prose, as opposed to headings, tables, code, links and markup) is
+  below `--extractive_min_prose`. Both are disabled by default (0), so every section goes to the model.
+- **Heading plus Lead Sentence**: The local summary is the first heading followed by the first sentence of prose. A
+  section without prose is described by its heading and the first labels of its lists, tables and links; a section
+  with none of these keeps the summary of its document, as a failed request does.
+- **Statistics**: Sections summarized locally are counted as `local_summaries` in the LLM stats of the step
+  (`llm_client.LLMStats`): each one is a call saved.
+
+Command-line Arguments (added with `add_extractive_arguments`):
+- --extractive_max_tokens: Sections of at most this many tokens are summarized locally (0: disabled).
+- --extractive_min_prose: Sections with a lower prose density (0.0 - 1.0) are summarized locally (0: disabled).
+"""
+
+import re
+
+from pipeline_stages import count_tokens
+
+# lines of prose have at least this many words (or characters, for text without spaces)
+PROSE_MIN_WORDS = 5
+PROSE_MIN_CHARS = 20
+# a lead sentence is cut after this many words
+LEAD_MAX_WORDS = 40
+# labels listed for a section without prose
+MAX_LABELS = 3
+
+# PATH / SUMMARIZE statements of the pipeline (step1, step4) are not part of the content
+META_PATTERN = re.compile(r"^(?:# )?(?:PATH|SUMMARIZE): ")
+FENCE_PATTERN = re.compile(r"^\s*(```|~~~)")
+HEADING_PATTERN = re.compile(r"^\s{0,3}#{1,6}\s+(.*?)\s*#*\s*$")
+TABLE_PATTERN = re.compile(r"^\s*\|")
+LIST_MARKER_PATTERN = re.compile(r"^\s*(?:[-*+]|\d+[.)])\s+")
+IMAGE_PATTERN = re.compile(r"!\[[^\]]*\]\([^)]*\)")
+LINK_PATTERN = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+URL_PATTERN = re.compile(r"<?https?://\S+>?")
+HTML_TAG_PATTERN = re.compile(r"<[^>]+>")
+EMPHASIS_PATTERN = re.compile(r"[*_`~]+")
+SENTENCE_END_PATTERN = re.compile(r"(?<=[.!?。！？])\s+|(?<=[。！？])")
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def add_extractive_arguments(parser):
+    """
+    Function to add the local summarizer arguments to a step's argument parser.
+
+    Args:
+    parser (argparse.ArgumentParser): The step's argument parser.
+    """
+    parser.add_argument(
+        "--extractive_max_tokens",
+        type=int,
+        default=0,
+        help="sections of at most this many tokens are summarized locally (0 = disabled)",
+    )
+    parser.add_argument(
+        "--extractive_min_prose",
+        type=float,
+        default=0.0,
+        help="sections with a lower share of prose are summarized locally (0 = disabled)",
+    )
+
+
+def plain_text(line: str, keep_links: bool) -> str:
+    """Function to strip the Markdown markup of a line, keeping (or dropping) the labels of its links"""
+    text = IMAGE_PATTERN.sub("", line)
+    text = LINK_PATTERN.sub(r"\1" if keep_links else "", text)
+    text = URL_PATTERN.sub("", text)
+    text = HTML_TAG_PATTERN.sub("", text)
+    text = LIST_MARKER_PATTERN.sub("", text)
+    text = EMPHASIS_PATTERN.sub("", text)
+    return " ".join(text.split())
+
+
+def is_prose(text: str) -> bool:
+    """Function to tell whether the plain text of a line reads as prose"""
+    return (
+        len(WORD_PATTERN.findall(text)) >= PROSE_MIN_WORDS
+        or len(text) >= PROSE_MIN_CHARS
+    )
+
+
+def classify_lines(md_content: str):
+    """
+    Function to sort the lines of a Markdown section.
+
+    Args:
+    md_content (str): The section.
+
+    Returns:
+    iterator: (kind, line) with kind "heading", "code", "table", "prose" or "other" (lists, links, short lines),
+    blank lines excluded.
+    """
+    in_code = False
+    for line in md_content.splitlines():
+        if FENCE_PATTERN.match(line):
+            in_code = not in_code
+            yield "code", line
+        elif in_code:
+            yield "code", line
+        elif not line.strip() or META_PATTERN.match(line):
+            continue
+        elif HEADING_PATTERN.match(line):
+            yield "heading", line
+        elif TABLE_PATTERN.match(line):
+            yield "table", line
+        elif is_prose(plain_text(line, keep_links=False)):
+            yield "prose", line
+        else:
+            yield "other", line
+
+
+def prose_density(md_content: str) -> float:
+    """
+    Function to compute the share of the characters of a section that are prose.
+
+    Args:
+    md_content (str): The section.
+
+    Returns:
+    float: Characters of prose text (without links and markup) over non-blank characters, 0.0 - 1.0.
+    """
+    prose = total = 0
+    for kind, line in classify_lines(md_content):
+        total += len(line.strip())
+        if kind == "prose":
+            prose += len(plain_text(line, keep_links=False))
+    return prose / total if total else 0.0
+
+
+def lead_sentence(text: str) -> str:
+    """Function to get the first sentence of a paragraph, cut after LEAD_MAX_WORDS words"""
+    sentence = SENTENCE_END_PATTERN.split(text, maxsplit=1)[0].strip()
+    words = sentence.split(" ")
+    if len(words) > LEAD_MAX_WORDS:
+        sentence = " ".join(words[:LEAD_MAX_WORDS])
+    return sentence
+
+
+def labels_of(kind: str, line: str) -> list:
+    """Function to get the labels of a list item, table row or line of links"""
+    if kind == "table":
+        cells = [plain_text(cell, keep_links=True) for cell in line.split("|")]
+        # separator rows (|---|:--:|) have no label
+        return [
+            cell for cell in cells[:2] if cell and not set(cell) <= set("-: ")
+        ][:1]
+    links = [
+        plain_text(label, keep_links=True)
+        for label in LINK_PATTERN.findall(line)
+    ]
+    if links:
+        return [label for label in links if label]
+    text = plain_text(line, keep_links=True)
+    return [text] if text else []
+
+
+def extractive_summary(md_content: str, fallback: str) -> str:
+    """
+    Function to summarize a section with its heading and its lead sentence.
+
+    Args:
+    md_content (str): The section.
+    fallback (str): Summary used when the section has neither heading, prose nor labels (the document summary).
+
+    Returns:
+    str: One sentence.
+    """
+    heading = lead = None
+    labels = []
+    for kind, line in classify_lines(md_content):
+        if kind == "heading":
+            if heading is None:
+                heading = plain_text(
+                    HEADING_PATTERN.match(line).group(1).lstrip("# "),
+                    keep_links=True,
+                )
+        elif kind == "prose":
+            lead = lead_sentence(plain_text(line, keep_links=True))
+            break
+        elif kind in ("table", "other") and len(labels) < MAX_LABELS:
+            labels += labels_of(kind, line)
+    if lead is None and labels:
+        lead = ", ".join(labels[:MAX_LABELS])
+    parts = [part for part in (heading, lead) if part]
+    if not parts:
+        return fallback
+    summary = ": ".join(parts)
+    if summary[-1] not in ".!?。！？":
+        summary += "."
+    return summary
+
+
+class ExtractiveSummarizer:
+    """
+    Local summarizer of the sections that are too small or too little prose to be worth a model call.
+
+    Args:
+    max_tokens (int): Sections of at most this many tokens are summarized locally (0: disabled).
+    min_prose (float): Sections with a lower prose density are summarized locally (0: disabled).
+    """
+
+    def __init__(self, max_tokens: int = 0, min_prose: float = 0.0):
+        self.max_tokens = max_tokens
+        self.min_prose = min_prose
+
+    @classmethod
+    def from_args(cls, args):
+        """Function to create a summarizer from the step's parsed arguments"""
+        return cls(args.extractive_max_tokens, args.extractive_min_prose)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_tokens > 0 or self.min_prose > 0
+
+    def hash_parts(self) -> tuple:
+        """Function to get the settings a section's output depends on, for `manifest.content_hash`"""
+        if not self.enabled:
+            # disabled: the manifests of previous runs stay valid
+            return ()
+        return (f"extractive:{self.max_tokens}:{self.min_prose}",)
+
+    def is_trivial(self, md_content: str) -> bool:
+        """Function to tell whether a section is summarized locally"""
+        if self.max_tokens > 0 and count_tokens(md_content) <= self.max_tokens:
+            return True
+        return (
+            self.min_prose > 0 and prose_density(md_content) < self.min_prose
+        )
+
+    def summarize(self, md_content: str, fallback: str):
+        """
+        Function to summarize a section locally if it is trivial.
+
+        Args:
+        md_content (str): The section.
+        fallback (str): Summary of the section's document, used for sections without any text.
+
+        Returns:
+        str | None: The local summary, or None if the section goes to the model.
+        """
+        if not self.enabled or not self.is_trivial(md_content):
+            return None
+        return extractive_summary(md_content, fallback)
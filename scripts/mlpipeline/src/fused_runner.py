@@ -0,0 +1,412 @@
+"""
+Summary:
+This script runs steps 1 to 7 in a single process: the documents flow through the step logic in memory instead of
+being written to a folder by every step and listed and read back by the next one. It is meant for fast local
+iterations, and as a single AML job (`fused.yaml`) replacing the step1 to step7 jobs.
+
+Key functionalities:
+- **Streaming Stages**: Every step is a generator stage taking one item and yielding the items of the next stage:
+  documents (step1 summary), sections (step2 split), re-summarized sections (step4), chunks (step5 split) and
+  re-summarized chunks (step5). Stages run on their own threads and are connected by bounded queues
+  (`--queue_size`), so the summary of one document overlaps with the splitting, chunking, filtering and token
+  counting of the others, and memory stays bounded.
+- **Same Files as the Steps**: The per-document logic, the prompts and the file names come from `pipeline_stages`,
+  shared with the step scripts, so the output folder holds the files step6 would keep and the analysis folder the
+  report of step7 (plus the `summaries.csv` of step2). Summaries cached by the steps (`--cache_dir`) are reused.
+- **Written Once**: The final files are filtered by token count (`pipeline_stages.keep_for_index`) in memory and
+  written once, by the main thread. `.md` files of a previous run that were not produced again are removed.
+- **Concurrent Requests**: Each LLM stage runs `--concurrency` threads sharing one `llm_client.LLMClient`, which
+  retries throttled requests; the job fails when more than `--max_failure_rate` of the requests failed.
+
+Differences from the step jobs:
+- Every document is processed on every run (no manifest); point `--cache_dir` to a persistent folder so unchanged
+  documents are answered by the summary cache.
+- No sharding, no TPM / RPM limiter and no upload: step9 publishes the output folder, as it does for step6.
+
+Command-line Arguments:
+- --aoai_resource / --aoai_apikey / --aoai_model: The Azure OpenAI resource, API key and deployment.
+- --fused_input: The folder containing the Markdown documents (gitpull output).
+- --fused_output: The folder receiving the files to index (step6 output).
+- --analysis_output: The folder receiving `summaries.csv`, `token_count.csv` and the plots (step7 output).
+- --concurrency: Number of threads (requests in flight) of each LLM stage.
+- --queue_size: Number of items buffered between two stages.
+- --chunk_overlap: Tokens repeated from the end of the previous chunk (step5).
+- --extractive_max_tokens / --extractive_min_prose: Sections and chunks summarized locally (`extractive_summary`).
+- --llm_backend / --llm_base_url: Backend of the requests: Azure OpenAI, an OpenAI-compatible server or a stub.
+- --aoai_endpoints / --max_retries / --request_timeout / --max_failure_rate / --cache_dir / --cache_max_mb: Shared
+  client settings.
+"""
+
+import argparse
+import csv
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from extractive_summary import ExtractiveSummarizer, add_extractive_arguments
+from llm_client import LLMClient, LLMError, add_llm_arguments
+from pipeline_stages import (
+    CHUNK_SUMMARY_PROMPT,
+    DOCUMENT_SUMMARY_PROMPT,
+    RESUMMARY_PARAMS,
+    SECTION_SUMMARY_PROMPT,
+    add_document_info,
+    chunk_document,
+    chunk_file_name,
+    chunk_output,
+    count_tokens,
+    document_messages,
+    keep_for_index,
+    resummary_messages,
+    section_file_name,
+    section_output,
+    split_document,
+    summarized_file_name,
+)
+from token_report import plot_boxplot, plot_histogram, save_to_csv
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--aoai_resource", type=str)
+parser.add_argument("--aoai_apikey", type=str)
+parser.add_argument("--aoai_model", type=str)
+parser.add_argument("--fused_input", type=str)
+parser.add_argument("--fused_output", type=str)
+parser.add_argument("--analysis_output", type=str)
+parser.add_argument("--concurrency", type=int, default=8)
+parser.add_argument("--queue_size", type=int, default=64)
+parser.add_argument("--chunk_overlap", type=int, default=0)
+add_llm_arguments(parser)
+add_extractive_arguments(parser)
+
+# end of stream, forwarded from stage to stage
+DONE = object()
+
+# a document (step1 output) or a section / chunk (step2, step4 and step5 files) in flight
+Document = namedtuple("Document", ["name", "content"])
+Section = namedtuple("Section", ["name", "content", "path", "summary"])
+# a file to index: goes straight to the writer
+FinalFile = namedtuple("FinalFile", ["name", "content"])
+
+
+class FusedPipeline:
+    """
+    Generator stages of steps 1 to 7 sharing one LLM client.
+
+    Args:
+    llm (LLMClient): The shared client.
+    text_to_remove (str): String deleted from the documents (step1).
+    chunk_overlap (int): Tokens repeated from the end of the previous chunk (step5).
+    extractive (ExtractiveSummarizer): Optional local summarizer of trivial sections and chunks (step4 / step5).
+    """
+
+    def __init__(
+        self,
+        llm: LLMClient,
+        text_to_remove: str,
+        chunk_overlap=0,
+        extractive: ExtractiveSummarizer = None,
+    ):
+        self.llm = llm
+        self.text_to_remove = text_to_remove
+        self.chunk_overlap = chunk_overlap
+        self.extractive = extractive or ExtractiveSummarizer()
+        # [Filename, PATH, Summary] rows of summaries.csv (step2)
+        self.summaries = []
+        self.skipped_calls = 0
+
+    def summarize_document(self, file_path: str):
+        """step1: summarize a document and add the PATH / SUMMARIZE header"""
+        with open(file_path, "r", encoding="utf-8") as f:
+            content = f.read()
+        print(f"==========summarizing {file_path}============")
+        try:
+            summary = self.llm.complete(
+                document_messages(DOCUMENT_SUMMARY_PROMPT, content)
+            )
+        except LLMError as e:
+            print(f"summarization failed: {e}")
+            summary = ""
+        yield Document(
+            os.path.basename(file_path),
+            add_document_info(
+                file_path, content, summary, self.text_to_remove
+            ),
+        )
+
+    def split(self, document: Document):
+        """step2: split a document into sections and collect its summary"""
+        sections, path_info, summary = split_document(document.content)
+        if summary is None:
+            # no summaries.csv row: step4 would not find the sections either
+            print(f"no SUMMARIZE statement in {document.name}, skipped")
+            return
+        base_name = os.path.splitext(document.name)[0]
+        self.summaries.append([base_name, path_info, summary])
+        for idx, section in enumerate(sections):
+            yield Section(
+                section_file_name(base_name, idx), section, path_info, summary
+            )
+
+    def resummarize(self, system_prompt_msg: str, section: Section) -> str:
+        """Function to re-summarize a section or chunk, keeping the document summary if the request fails"""
+        local_summary = self.extractive.summarize(
+            section.content, section.summary
+        )
+        if local_summary is not None:
+            self.llm.stats.count(local_summaries=1)
+            return local_summary
+        try:
+            return self.llm.complete(
+                resummary_messages(
+                    system_prompt_msg, section.content, section.summary
+                ),
+                **RESUMMARY_PARAMS,
+            )
+        except LLMError as e:
+            print(f"re-summarization failed, keeping original summary: {e}")
+            return section.summary
+
+    def summarize_section(self, section: Section):
+        """step4: re-summarize a section"""
+        print(f"processing <{section.name}> ・・・")
+        summarized_content = self.resummarize(SECTION_SUMMARY_PROMPT, section)
+        yield section._replace(
+            name=summarized_file_name(section.name),
+            content=section_output(
+                summarized_content, section.content, section.path
+            ),
+        )
+
+    def chunk(self, section: Section):
+        """step5 split: pass a step4 output on to the writer and chunk it if it is too large"""
+        # step6 keeps the step4 outputs as well as the chunks (if they fit)
+        yield FinalFile(section.name, section.content)
+        base_name = os.path.splitext(section.name)[0]
+        for i, chunk in enumerate(
+            chunk_document(section.content, self.chunk_overlap)
+        ):
+            chunk_name = chunk_file_name(base_name, i)
+            if "# PATH:" in chunk:
+                # written as it is by step5: no summary needed
+                self.skipped_calls += 1
+                yield FinalFile(summarized_file_name(chunk_name), chunk)
+            else:
+                yield section._replace(name=chunk_name, content=chunk)
+
+    def summarize_chunk(self, chunk: Section):
+        """step5: re-summarize a chunk"""
+        print(f"processing <{chunk.name}> ・・・")
+        summarized_content = self.resummarize(CHUNK_SUMMARY_PROMPT, chunk)
+        yield FinalFile(
+            summarized_file_name(chunk.name),
+            chunk_output(summarized_content, chunk.content, chunk.path),
+        )
+
+
+def start_stage(
+    name: str,
+    stage,
+    inbox: queue.Queue,
+    outbox: queue.Queue,
+    final: queue.Queue,
+    threads: int,
+    errors: list,
+):
+    """
+    Function to run a generator stage on threads, from inbox to outbox.
+
+    Args:
+    name (str): Stage name used in the thread names and error messages.
+    stage (callable): Generator function taking one item.
+    inbox (queue.Queue): Items to process, closed by DONE.
+    outbox (queue.Queue): Items for the next stage; receives DONE once every thread is done.
+    final (queue.Queue): Queue of the writer, receiving the FinalFile items.
+    threads (int): Number of threads.
+    errors (list): Receives (stage name, item name, exception) for every item that raised.
+    """
+    running = [threads]
+    lock = threading.Lock()
+
+    def work():
+        while True:
+            item = inbox.get()
+            if item is DONE:
+                # let the other threads of the stage see it too
+                inbox.put(DONE)
+                break
+            try:
+                for result in stage(item):
+                    (final if isinstance(result, FinalFile) else outbox).put(
+                        result
+                    )
+            except Exception as e:
+                # keep draining the queue, so the stages upstream don't block
+                item_name = getattr(item, "name", item)
+                print(f"{name} failed on {item_name}: {e!r}")
+                errors.append((name, item_name, e))
+        with lock:
+            running[0] -= 1
+            if running[0] == 0:
+                outbox.put(DONE)
+
+    for i in range(threads):
+        threading.Thread(target=work, name=f"{name}-{i}", daemon=True).start()
+
+
+def feed(items: list, outbox: queue.Queue):
+    """Function to put items, then DONE, into outbox from a thread"""
+
+    def work():
+        for item in items:
+            outbox.put(item)
+        outbox.put(DONE)
+
+    threading.Thread(target=work, name="feed", daemon=True).start()
+
+
+def write_final_files(final: queue.Queue, dst_folder: str) -> list:
+    """
+    Function to write the final files that step6 would keep, as they arrive.
+
+    Args:
+    final (queue.Queue): FinalFile items, closed by DONE.
+    dst_folder (str): The output folder.
+
+    Returns:
+    list: (file name, token count) of the written files.
+    """
+    data = []
+    while True:
+        item = final.get()
+        if item is DONE:
+            return data
+        token_count = count_tokens(item.content)
+        if not keep_for_index(token_count):
+            print(f"{item.name} has {token_count} tokens, not indexed.")
+            continue
+        with open(
+            os.path.join(dst_folder, item.name), "w", encoding="utf-8"
+        ) as f:
+            f.write(item.content)
+        data.append((item.name, token_count))
+
+
+def remove_stale_files(dst_folder: str, written: set):
+    """Function to delete the .md files of dst_folder that were not written by this run"""
+    stale = [
+        name
+        for name in os.listdir(dst_folder)
+        if name.endswith(".md") and name not in written
+    ]
+    for name in stale:
+        os.remove(os.path.join(dst_folder, name))
+    print(f"removed {len(stale)} files of a previous run")
+
+
+def run_pipeline(
+    pipeline: FusedPipeline,
+    md_files: list,
+    dst_folder: str,
+    concurrency: int,
+    queue_size: int,
+) -> list:
+    """
+    Function to stream md_files through the stages of steps 1 to 5 and write the files to index.
+
+    Args:
+    pipeline (FusedPipeline): The stages.
+    md_files (list): The source Markdown files.
+    dst_folder (str): The output folder.
+    concurrency (int): Number of threads of each LLM stage.
+    queue_size (int): Number of items buffered between two stages.
+
+    Returns:
+    list: (file name, token count) of the written files.
+    """
+    stages = [
+        ("step1", pipeline.summarize_document, concurrency),
+        ("step2", pipeline.split, 1),
+        ("step4", pipeline.summarize_section, concurrency),
+        ("step5-split", pipeline.chunk, 1),
+        ("step5", pipeline.summarize_chunk, concurrency),
+    ]
+    queues = [queue.Queue(queue_size) for _ in range(len(stages) + 1)]
+    final = queues[-1]
+    errors = []
+    feed(md_files, queues[0])
+    for (name, stage, threads), inbox, outbox in zip(
+        stages, queues, queues[1:]
+    ):
+        start_stage(name, stage, inbox, outbox, final, threads, errors)
+    data = write_final_files(final, dst_folder)
+    if errors:
+        name, item_name, error = errors[0]
+        raise RuntimeError(
+            f"{len(errors)} items failed, first in {name}: {item_name}"
+        ) from error
+    return data
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    print("Hello...\nI'm fused_runner :-)")
+    start = time.perf_counter()
+    src_folder = args.fused_input
+    dst_folder = args.fused_output
+    analysis_output_folder = args.analysis_output
+    os.makedirs(dst_folder, exist_ok=True)
+    os.makedirs(analysis_output_folder, exist_ok=True)
+
+    md_files = sorted(
+        os.path.join(root, file)
+        for root, _, files in os.walk(src_folder)
+        for file in files
+        if file.endswith(".md")
+    )
+    print(f"{len(md_files)} md files in {src_folder}")
+
+    llm = LLMClient.from_args(args)
+    pipeline = FusedPipeline(
+        llm,
+        # extract parent directory name, as step1 does
+        os.path.dirname(args.fused_input),
+        args.chunk_overlap,
+        ExtractiveSummarizer.from_args(args),
+    )
+    data = run_pipeline(
+        pipeline, md_files, dst_folder, args.concurrency, args.queue_size
+    )
+    remove_stale_files(dst_folder, {name for name, _ in data})
+    print(
+        f"Skipped {pipeline.skipped_calls} LLM calls for chunks that already have a PATH header."
+    )
+
+    # step2 summaries.csv and step7 token report
+    with open(
+        f"{analysis_output_folder}/summaries.csv",
+        "w",
+        newline="",
+        encoding="utf-8",
+    ) as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["Filename", "PATH", "Summary"])
+        writer.writerows(sorted(pipeline.summaries))
+    data.sort()
+    save_to_csv(data, f"{analysis_output_folder}/token_count.csv")
+    if data:
+        token_counts = [count for _, count in data]
+        plot_histogram(
+            token_counts, f"{analysis_output_folder}/token_hist.png"
+        )
+        plot_boxplot(
+            token_counts, f"{analysis_output_folder}/token_boxplot.png"
+        )
+
+    llm.close()
+    llm.report_and_check(args.max_failure_rate)
+    end = time.perf_counter()
+    print(
+        f"{len(data)} files written to {dst_folder}. End: {end - start:.3f} s."
+    )
@@ -0,0 +1,315 @@
+"""
+Summary:
+This script pulls the documentation folder to index (sparse checkout of one folder of a git repository) and tells
+the downstream steps whether it changed since the last published index.
+
+Key functionalities:
+- **Remote Head Check**: The head commit of the branch is read with `git ls-remote`. When it is the commit of the
+  indexed source, nothing is fetched at all.
+- **Shallow Partial Fetch**: Otherwise only the head commit is fetched (`--depth 1`) without file contents
+  (`--filter=blob:none`); the sparse checkout then downloads the blobs of the indexed folder only, instead of every
+  blob in the history of the repository.
+- **Cached Repository**: With `--repo_cache`, the `.git` folder is restored from and saved to a single archive in a
+  persistent folder, so a run only fetches the objects that are new since the previous one.
+- **Changed Files**: The files of the folder added (A), modified (M) or deleted (D) since the indexed commit are
+  written to `<source_status>/changed_files.tsv`. Only trees are compared, so no old file contents are needed.
+  Without an indexed commit, or when it can't be fetched any more, every file is listed as added.
+- **Skip Marker**: The git tree id of the folder is compared with the indexed one, so commits that only touch other
+  folders don't trigger a run (the indexed commit is moved forward in that case). The source is described in
+  `<source_status>/source.json`; an `unchanged` marker is added next to it when the source did not change. Every step
+  exits right away when the marker is present, so the previously published index is left in place. step9 records
+  `source.json` as indexed once the new index is published.
+
+Command-line Arguments:
+- --git_url: The git repository URL.
+- --sparse_checkout_folder: The folder of the repository to index.
+- --branch: The branch to pull.
+- --work_dir: Local folder for the checkout.
+- --source_state: The persistent state folder holding `indexed_source.json`.
+- --repo_cache: Optional persistent folder holding the archived `.git` folder between runs.
+- --gitpull_output: The output folder receiving the pulled folder.
+- --source_status: The output folder receiving `source.json` and the `unchanged` marker.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import tarfile
+
+from source_state import (
+    CHANGED_FILES_FILENAME,
+    INDEXED_SOURCE_FILENAME,
+    SOURCE_FILENAME,
+    UNCHANGED_MARKER,
+    read_source,
+    same_source,
+    write_changed_files,
+    write_source,
+)
+
+REPO_ARCHIVE_FILENAME = "gitrepo.tar"
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--git_url", type=str)
+parser.add_argument("--sparse_checkout_folder", type=str)
+parser.add_argument("--branch", type=str, default="main")
+parser.add_argument("--work_dir", type=str, default="/mnt/azureml/gitrepo")
+parser.add_argument("--source_state", type=str, default=None)
+parser.add_argument("--repo_cache", type=str, default=None)
+parser.add_argument("--gitpull_output", type=str)
+parser.add_argument("--source_status", type=str)
+
+
+def git(*git_args, cwd=None) -> str:
+    """Function to run a git command, returning its standard output"""
+    print(f"git {' '.join(git_args)}")
+    return subprocess.run(
+        ["git", *git_args],
+        cwd=cwd,
+        check=True,
+        stdout=subprocess.PIPE,
+        text=True,
+    ).stdout.strip()
+
+
+def remote_head(git_url: str, branch: str):
+    """
+    Function to read the head commit of a remote branch without fetching anything.
+
+    Args:
+    git_url (str): The git repository URL.
+    branch (str): The branch name.
+
+    Returns:
+    str | None: The commit id, or None if it couldn't be read.
+    """
+    try:
+        output = git("ls-remote", git_url, f"refs/heads/{branch}")
+    except subprocess.CalledProcessError as e:
+        print(f"Couldn't read the remote head: {e}")
+        return None
+    return output.split()[0] if output else None
+
+
+def restore_repository(cache_dir: str, work_dir: str):
+    """Function to extract the archived .git folder of the previous run into work_dir"""
+    archive_path = os.path.join(cache_dir, REPO_ARCHIVE_FILENAME)
+    if os.path.exists(os.path.join(work_dir, ".git")):
+        return
+    if not os.path.exists(archive_path):
+        print(f"No cached repository in {cache_dir}, fetching from scratch.")
+        return
+    os.makedirs(work_dir, exist_ok=True)
+    with tarfile.open(archive_path) as archive:
+        if hasattr(tarfile, "data_filter"):
+            archive.extractall(work_dir, filter="data")
+        else:
+            archive.extractall(work_dir)
+    print(f"Restored the cached repository from {archive_path}.")
+
+
+def save_repository(work_dir: str, cache_dir: str):
+    """Function to archive the .git folder of work_dir for the next run"""
+    os.makedirs(cache_dir, exist_ok=True)
+    archive_path = os.path.join(cache_dir, REPO_ARCHIVE_FILENAME)
+    tmp_path = archive_path + ".tmp"
+    with tarfile.open(tmp_path, "w") as archive:
+        archive.add(os.path.join(work_dir, ".git"), arcname=".git")
+    os.replace(tmp_path, archive_path)
+    print(
+        f"Saved the repository to {archive_path} "
+        f"({os.path.getsize(archive_path) / 1024 / 1024:.1f} MB)."
+    )
+
+
+def shallow_fetch(
+    git_url: str, folder: str, branch: str, work_dir: str
+) -> dict:
+    """
+    Function to fetch the head of a branch without history nor file contents, and check out one folder.
+
+    Args:
+    git_url (str): The git repository URL.
+    folder (str): The folder to check out.
+    branch (str): The branch to fetch.
+    work_dir (str): Local folder for the checkout (may hold a restored repository).
+
+    Returns:
+    dict: The commit and the tree id of the folder.
+    """
+    if not os.path.exists(os.path.join(work_dir, ".git")):
+        os.makedirs(work_dir, exist_ok=True)
+        git("init", cwd=work_dir)
+        git("remote", "add", "origin", git_url, cwd=work_dir)
+    git("remote", "set-url", "origin", git_url, cwd=work_dir)
+    git("sparse-checkout", "set", folder, cwd=work_dir)
+    git(
+        "fetch",
+        "--depth",
+        "1",
+        "--filter=blob:none",
+        "origin",
+        branch,
+        cwd=work_dir,
+    )
+    # downloads the missing blobs of the sparse folder only
+    git("checkout", "--force", "-B", branch, "FETCH_HEAD", cwd=work_dir)
+    return {
+        "commit": git("rev-parse", "HEAD", cwd=work_dir),
+        "tree": git("rev-parse", f"HEAD:{folder}", cwd=work_dir),
+    }
+
+
+def has_commit(work_dir: str, commit: str) -> bool:
+    """Function to check whether a commit and its trees are in the local repository"""
+    try:
+        git("cat-file", "-e", f"{commit}^{{tree}}", cwd=work_dir)
+        return True
+    except subprocess.CalledProcessError:
+        return False
+
+
+def changed_files(
+    work_dir: str, folder: str, old_commit: str, new_commit: str
+):
+    """
+    Function to list the files of folder changed between two commits.
+
+    Args:
+    work_dir (str): Local folder of the repository.
+    folder (str): The indexed folder.
+    old_commit (str): The indexed commit, or None.
+    new_commit (str): The fetched commit.
+
+    Returns:
+    list: `(status, path)` pairs, status being "A", "M" or "D".
+    """
+    if old_commit and not has_commit(work_dir, old_commit):
+        try:
+            git(
+                "fetch",
+                "--depth",
+                "1",
+                "--filter=blob:none",
+                "origin",
+                old_commit,
+                cwd=work_dir,
+            )
+        except subprocess.CalledProcessError as e:
+            print(f"Couldn't fetch the indexed commit {old_commit}: {e}")
+    if not old_commit or not has_commit(work_dir, old_commit):
+        # no base to compare with: everything is new
+        output = git(
+            "ls-tree",
+            "-r",
+            "--name-only",
+            new_commit,
+            "--",
+            folder,
+            cwd=work_dir,
+        )
+        return [("A", path) for path in output.splitlines()]
+    # tree to tree comparison: no blob is needed
+    output = git(
+        "diff",
+        "--name-status",
+        "--no-renames",
+        old_commit,
+        new_commit,
+        "--",
+        folder,
+        cwd=work_dir,
+    )
+    return [tuple(line.split("\t", 1)) for line in output.splitlines()]
+
+
+def mark_unchanged(status_dir: str, reason: str):
+    """Function to add the skip marker for the downstream steps"""
+    with open(
+        os.path.join(status_dir, UNCHANGED_MARKER), "w", encoding="utf-8"
+    ) as f:
+        f.write(reason + "\n")
+    print(f"{reason}: the downstream steps will be skipped.")
+
+
+def pull_source(
+    git_url: str,
+    folder: str,
+    branch: str,
+    work_dir: str,
+    state_dir: str,
+    output_dir: str,
+    status_dir: str,
+    cache_dir: str = None,
+):
+    """
+    Function to pull the source folder into output_dir unless it is the indexed one.
+
+    Args:
+    git_url (str): The git repository URL.
+    folder (str): The folder to index.
+    branch (str): The branch to pull.
+    work_dir (str): Local folder for the checkout.
+    state_dir (str): The persistent state folder, or None to always run.
+    output_dir (str): The output folder receiving the pulled folder.
+    status_dir (str): The output folder receiving `source.json`, `changed_files.tsv` and the skip marker.
+    cache_dir (str): The persistent folder of the cached repository, or None.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(status_dir, exist_ok=True)
+    indexed = (
+        read_source(os.path.join(state_dir, INDEXED_SOURCE_FILENAME))
+        if state_dir
+        else None
+    )
+    print(f"indexed source: {indexed}")
+    source = {"git_url": git_url, "branch": branch, "folder": folder}
+    status_path = os.path.join(status_dir, SOURCE_FILENAME)
+
+    source["commit"] = remote_head(git_url, branch)
+    if same_source(source, indexed, "commit"):
+        write_source(status_path, indexed)
+        mark_unchanged(status_dir, f"{branch} is still at {source['commit']}")
+        return
+
+    if cache_dir:
+        restore_repository(cache_dir, work_dir)
+    source.update(shallow_fetch(git_url, folder, branch, work_dir))
+    write_source(status_path, source)
+    # the indexed commit is only a base for the same repository, branch and folder
+    base_commit = (
+        indexed.get("commit")
+        if same_source(source, indexed, "folder")
+        else None
+    )
+    changes = changed_files(work_dir, folder, base_commit, source["commit"])
+    write_changed_files(
+        os.path.join(status_dir, CHANGED_FILES_FILENAME), changes
+    )
+    if cache_dir:
+        save_repository(work_dir, cache_dir)
+    if same_source(source, indexed, "tree"):
+        # the published index is the one of this commit too: next run can stop at ls-remote
+        write_source(os.path.join(state_dir, INDEXED_SOURCE_FILENAME), source)
+        mark_unchanged(
+            status_dir, f"{folder} is unchanged at {source['commit']}"
+        )
+        return
+    print(f"source changed: {source}")
+    shutil.move(os.path.join(work_dir, folder), output_dir)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    print("Hello...\nI'm gitpull :-)")
+    pull_source(
+        args.git_url,
+        args.sparse_checkout_folder,
+        args.branch,
+        args.work_dir,
+        args.source_state,
+        args.gitpull_output,
+        args.source_status,
+        args.repo_cache,
+    )
@@ -0,0 +1,261 @@
+"""
+Summary:
+This script restores the GraphRAG LLM cache of the previous run before `graphrag.index` and saves it afterwards, so
+unchanged chunks hit GraphRAG's own cache (entity extraction, description summaries, community reports, embeddings)
+instead of being sent to the LLM again every run.
+
+The cache is kept as a single tar archive in a persistent folder, e.g. a fixed datastore path mounted with
+`rw_mount`. Only the archive goes through the mount: it is extracted to a folder on the local disk of the node, and
+`cache.base_dir` of the GraphRAG settings is pointed there, so the tens of thousands of small cache files are never
+read or written through blobfuse.
+
+Key functionalities:
+- **Restore**: Extracts `graphrag_cache.tar` into the local cache folder and sets `cache.base_dir` of the settings
+  file (`--settings`) to it.
+- **Index**: Runs `graphrag.index` with the remaining arguments and records the cache files it reads or writes
+  (GraphRAG's file storage is wrapped), in `graphrag_cache_used.txt` next to the cache folder. Blobfuse and
+  relatime mounts don't keep access times, so the use of a file is not taken from its atime. The wrapper is
+  written against the GraphRAG version pinned in step8.yaml (`GRAPHRAG_VERSION`); the step fails before indexing
+  if the storage class it wraps is not there.
+- **Save**: Stamps the files used in this run with the current time (their modification time, kept by the archive,
+  is the last run that used them), deletes the files unused for the longest while the cache is over `--max_mb`,
+  and writes the archive back atomically. Without a list of used files (the index action failed), files are
+  pruned by the modification times alone.
+
+Command-line Arguments:
+- --action: "restore", "index" or "save".
+- --cache_dir: The local GraphRAG cache folder.
+- --state_dir: The persistent folder holding the archive.
+- --settings: The GraphRAG settings file whose cache folder is set (restore).
+- --max_mb: Size limit of the saved cache in MB.
+- Other arguments (index): passed to `graphrag.index`, e.g. `--root`.
+"""
+
+import argparse
+import os
+import runpy
+import sys
+import tarfile
+import time
+
+import yaml
+
+# GraphRAG version of the storage wrapper of run_index, installed by step8.yaml
+GRAPHRAG_VERSION = "0.3.6"
+ARCHIVE_FILENAME = "graphrag_cache.tar"
+USED_FILENAME = "graphrag_cache_used.txt"
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--action", type=str, choices=["restore", "index", "save"])
+parser.add_argument("--cache_dir", type=str)
+parser.add_argument("--state_dir", type=str)
+parser.add_argument("--settings", type=str, default=None)
+parser.add_argument("--max_mb", type=int, default=4096)
+
+
+def list_cache_files(cache_dir: str) -> list:
+    """Function to list the files of the cache folder"""
+    return [
+        os.path.join(root, file_name)
+        for root, _, file_names in os.walk(cache_dir)
+        for file_name in file_names
+    ]
+
+
+def used_file_path(cache_dir: str) -> str:
+    """Function to get the path of the list of cache files used in this run"""
+    return os.path.join(
+        os.path.dirname(os.path.abspath(cache_dir)), USED_FILENAME
+    )
+
+
+def set_cache_base_dir(settings_path: str, cache_dir: str):
+    """
+    Function to point the cache of the GraphRAG settings to cache_dir.
+
+    Args:
+    settings_path (str): The GraphRAG settings file (settings.yaml).
+    cache_dir (str): The local GraphRAG cache folder.
+    """
+    with open(settings_path, "r", encoding="utf-8") as f:
+        settings = yaml.safe_load(f)
+    settings.setdefault("cache", {})
+    settings["cache"]["type"] = "file"
+    # absolute: GraphRAG resolves base_dir against the root folder
+    settings["cache"]["base_dir"] = os.path.abspath(cache_dir)
+    with open(settings_path, "w", encoding="utf-8") as f:
+        yaml.safe_dump(settings, f, sort_keys=False, allow_unicode=True)
+    print(f"GraphRAG cache of {settings_path} set to {cache_dir}.")
+
+
+def restore_cache(cache_dir: str, state_dir: str, settings_path: str = None):
+    """
+    Function to extract the archived cache into cache_dir.
+
+    Args:
+    cache_dir (str): The local GraphRAG cache folder.
+    state_dir (str): The persistent folder holding the archive.
+    settings_path (str): The GraphRAG settings file pointed to cache_dir, if given.
+    """
+    archive_path = os.path.join(state_dir, ARCHIVE_FILENAME)
+    os.makedirs(cache_dir, exist_ok=True)
+    if settings_path:
+        set_cache_base_dir(settings_path, cache_dir)
+    if not os.path.exists(archive_path):
+        print(f"No GraphRAG cache in {state_dir}, indexing starts cold.")
+        return
+    with tarfile.open(archive_path) as archive:
+        if hasattr(tarfile, "data_filter"):
+            archive.extractall(cache_dir, filter="data")
+        else:
+            archive.extractall(cache_dir)
+    print(
+        f"Restored {len(list_cache_files(cache_dir))} GraphRAG cache files from {archive_path}."
+    )
+
+
+def file_storage_class(cache_root: str):
+    """
+    Function to import the file storage class of GraphRAG and check that it can be wrapped.
+
+    Args:
+    cache_root (str): The absolute local GraphRAG cache folder.
+
+    Returns:
+    type: `FilePipelineStorage`.
+
+    Raises:
+    RuntimeError: The installed GraphRAG is not the one the wrapper was written against.
+    """
+    try:
+        from graphrag.index.storage.file_pipeline_storage import (
+            FilePipelineStorage,
+        )
+    except ImportError as e:
+        raise RuntimeError(
+            f"graphrag.index.storage.file_pipeline_storage not found: the cache use can't be "
+            f"tracked, install graphrag=={GRAPHRAG_VERSION}"
+        ) from e
+    if (
+        not callable(getattr(FilePipelineStorage, "get", None))
+        or not callable(getattr(FilePipelineStorage, "set", None))
+        or getattr(FilePipelineStorage(cache_root), "_root_dir", None)
+        != cache_root
+    ):
+        raise RuntimeError(
+            "FilePipelineStorage has no get / set / _root_dir: the cache use can't be tracked, "
+            f"install graphrag=={GRAPHRAG_VERSION}"
+        )
+    return FilePipelineStorage
+
+
+def run_index(cache_dir: str, index_args: list) -> int:
+    """
+    Function to run `graphrag.index` and record the cache files it reads or writes.
+
+    Args:
+    cache_dir (str): The local GraphRAG cache folder.
+    index_args (list): Arguments of `graphrag.index`.
+
+    Returns:
+    int: The exit status of the indexing.
+    """
+    cache_root = os.path.abspath(cache_dir)
+    used = set()
+    if os.path.exists(used_file_path(cache_dir)):
+        os.remove(used_file_path(cache_dir))
+    storage_class = file_storage_class(cache_root)
+    original_get = storage_class.get
+    original_set = storage_class.set
+
+    def track(storage, key: str):
+        path = os.path.abspath(os.path.join(storage._root_dir, key))
+        if path.startswith(cache_root + os.sep):
+            used.add(os.path.relpath(path, cache_root))
+
+    async def tracked_get(self, key, *args, **kwargs):
+        track(self, key)
+        return await original_get(self, key, *args, **kwargs)
+
+    async def tracked_set(self, key, *args, **kwargs):
+        track(self, key)
+        return await original_set(self, key, *args, **kwargs)
+
+    storage_class.get = tracked_get
+    storage_class.set = tracked_set
+
+    sys.argv = ["graphrag.index", *index_args]
+    status = 0
+    try:
+        runpy.run_module("graphrag.index", run_name="__main__", alter_sys=True)
+    except SystemExit as e:
+        status = e.code if isinstance(e.code, int) else int(bool(e.code))
+    finally:
+        with open(used_file_path(cache_dir), "w", encoding="utf-8") as f:
+            f.writelines(f"{name}\n" for name in sorted(used))
+        print(f"GraphRAG used {len(used)} cache files.")
+    return status
+
+
+def read_used(cache_dir: str) -> set:
+    """Function to read the cache files used in this run, as paths relative to cache_dir"""
+    path = used_file_path(cache_dir)
+    if not os.path.exists(path):
+        print(
+            f"WARNING: no {USED_FILENAME}, the cache use of this run is unknown: "
+            "pruning by the last use recorded in the archive"
+        )
+        return set()
+    with open(path, "r", encoding="utf-8") as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+
+def save_cache(cache_dir: str, state_dir: str, max_bytes: int):
+    """
+    Function to prune the cache to max_bytes (files unused for the longest first) and archive it to state_dir.
+
+    Args:
+    cache_dir (str): The local GraphRAG cache folder.
+    state_dir (str): The persistent folder holding the archive.
+    max_bytes (int): Size limit of the saved cache.
+    """
+    used = read_used(cache_dir)
+    now = time.time()
+    entries = []
+    for file_path in list_cache_files(cache_dir):
+        if os.path.relpath(file_path, cache_dir) in used:
+            # keep the last use in the archive, as the modification time
+            os.utime(file_path, (now, now))
+        stat = os.stat(file_path)
+        entries.append((stat.st_mtime, stat.st_size, file_path))
+
+    total_bytes = sum(size for _, size, _ in entries)
+    pruned = 0
+    for _, size, file_path in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        os.remove(file_path)
+        total_bytes -= size
+        pruned += 1
+
+    os.makedirs(state_dir, exist_ok=True)
+    archive_path = os.path.join(state_dir, ARCHIVE_FILENAME)
+    tmp_path = archive_path + ".tmp"
+    with tarfile.open(tmp_path, "w") as archive:
+        archive.add(cache_dir, arcname=".")
+    os.replace(tmp_path, archive_path)
+    print(
+        f"Saved {len(entries) - pruned} GraphRAG cache files "
+        f"({len(used)} used in this run, {total_bytes / 1024 / 1024:.1f} MB, "
+        f"{pruned} pruned) to {archive_path}."
+    )
+
+
+if __name__ == "__main__":
+    args, index_args = parser.parse_known_args()
+    if args.action == "restore":
+        restore_cache(args.cache_dir, args.state_dir, args.settings)
+    elif args.action == "index":
+        sys.exit(run_index(args.cache_dir, index_args))
+    else:
+        save_cache(args.cache_dir, args.state_dir, args.max_mb * 1024 * 1024)
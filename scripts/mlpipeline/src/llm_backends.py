@@ -0,0 +1,166 @@
+"""
+Summary:
+This module provides the backends an `llm_client.LLMClient` sends its chat completions to, selected per step with
+`--llm_backend`. The retries, statistics, cache and deployment pool of the client are the same for every backend.
+
+Key functionalities:
+- **azure** (default): Azure OpenAI deployments (`--aoai_resource` / `--aoai_model`, or `--aoai_endpoints`).
+- **openai**: Any OpenAI-compatible server at `--llm_base_url` (e.g. a llama.cpp or vLLM server on the cluster);
+  `--aoai_model` is the model name served there and `--aoai_apikey` is optional. `--aoai_endpoints` entries may
+  give a `base_url` instead of a `resource` to spread requests over several servers.
+- **stub**: A deterministic local answer built from the request (no network, no key), to benchmark or test the
+  pipeline end to end without an external service. Its answers are not JSON, so batched step4 requests
+  (`section_batches`) fall back to one request per section.
+- **Cache Isolation**: Results of the openai and stub backends are cached under their own model name
+  (`cache_model`), so they never answer requests of another backend.
+"""
+
+import hashlib
+import re
+from types import SimpleNamespace
+
+from openai import AsyncAzureOpenAI, AsyncOpenAI, AzureOpenAI, OpenAI
+
+API_VERSION = "2024-02-01"
+BACKENDS = ("azure", "openai", "stub")
+# API key sent to OpenAI-compatible servers that don't check it
+NO_API_KEY = "none"
+# words of the request repeated in a stub answer
+STUB_WORDS = 12
+
+
+class AzureBackend:
+    """Azure OpenAI deployments"""
+
+    name = "azure"
+
+    def cache_model(self, model: str) -> str:
+        return model
+
+    def client(self, deployment, timeout: float) -> AzureOpenAI:
+        # retries are handled by LLMClient so they can be counted and honor Retry-After
+        return AzureOpenAI(
+            azure_endpoint=deployment.endpoint,
+            api_key=deployment.api_key,
+            api_version=API_VERSION,
+            max_retries=0,
+            timeout=timeout,
+        )
+
+    def async_client(self, deployment, timeout: float) -> AsyncAzureOpenAI:
+        return AsyncAzureOpenAI(
+            azure_endpoint=deployment.endpoint,
+            api_key=deployment.api_key,
+            api_version=API_VERSION,
+            max_retries=0,
+            timeout=timeout,
+        )
+
+
+class OpenAICompatibleBackend:
+    """OpenAI-compatible servers, the deployment endpoint being their base URL"""
+
+    name = "openai"
+
+    def cache_model(self, model: str) -> str:
+        return f"{self.name}:{model}"
+
+    def client(self, deployment, timeout: float) -> OpenAI:
+        return OpenAI(
+            base_url=deployment.endpoint,
+            api_key=deployment.api_key or NO_API_KEY,
+            max_retries=0,
+            timeout=timeout,
+        )
+
+    def async_client(self, deployment, timeout: float) -> AsyncOpenAI:
+        return AsyncOpenAI(
+            base_url=deployment.endpoint,
+            api_key=deployment.api_key or NO_API_KEY,
+            max_retries=0,
+            timeout=timeout,
+        )
+
+
+def stub_answer(messages: list) -> str:
+    """
+    Function to build the deterministic answer of the stub backend.
+
+    Args:
+    messages (list): Chat messages of the request.
+
+    Returns:
+    str: One sentence made of a digest and the first words of the last message.
+    """
+    content = messages[-1]["content"]
+    digest = hashlib.sha256(content.encode("utf-8")).hexdigest()[:8]
+    # words only: markup of the request would end up in the Markdown outputs
+    words = " ".join(re.findall(r"\w+", content)[:STUB_WORDS])
+    return f"Stub summary {digest} of {len(content)} characters: {words}"
+
+
+class StubResponse:
+    """Raw response of the stub backend, shaped like the one of `with_raw_response`"""
+
+    def __init__(self, messages: list):
+        self.headers = {}
+        self.content = stub_answer(messages)
+
+    def parse(self):
+        message = SimpleNamespace(content=self.content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class StubClient:
+    """Client of the stub backend, answering `chat.completions.with_raw_response.create`"""
+
+    def __init__(self, asynchronous: bool):
+        def create(messages: list, **params):
+            return StubResponse(messages)
+
+        async def acreate(messages: list, **params):
+            return StubResponse(messages)
+
+        raw = SimpleNamespace(create=acreate if asynchronous else create)
+        self.chat = SimpleNamespace(
+            completions=SimpleNamespace(with_raw_response=raw)
+        )
+
+    async def close(self):
+        pass
+
+
+class StubBackend:
+    """Deterministic answers computed locally"""
+
+    name = "stub"
+
+    def cache_model(self, model: str) -> str:
+        return f"{self.name}:{model}"
+
+    def client(self, deployment, timeout: float) -> StubClient:
+        return StubClient(asynchronous=False)
+
+    def async_client(self, deployment, timeout: float) -> StubClient:
+        return StubClient(asynchronous=True)
+
+
+def create_backend(name: str):
+    """
+    Function to create the backend of a step.
+
+    Args:
+    name (str): One of BACKENDS.
+
+    Returns:
+    AzureBackend | OpenAICompatibleBackend | StubBackend: The backend.
+    """
+    if name == "azure":
+        return AzureBackend()
+    if name == "openai":
+        return OpenAICompatibleBackend()
+    if name == "stub":
+        return StubBackend()
+    raise ValueError(
+        f"unknown LLM backend {name!r}, expected one of {BACKENDS}"
+    )
@@ -0,0 +1,484 @@
+"""
+Summary:
+This module provides the chat client shared by the summarization steps (step1, step4 and step5). Requests go to
+Azure OpenAI by default, or to another backend selected with `--llm_backend` (`llm_backends`).
+
+A single `LLMClient` is created per step and reused for every request, so the underlying HTTP connection
+pool (and its TLS sessions) is shared instead of being rebuilt for each summary.
+
+Key functionalities:
+- **Connection Reuse**: One sync / asyncio client of the backend per deployment and process, created lazily.
+- **Several Deployments**: With `--aoai_endpoints`, requests are spread over several deployments by remaining
+  capacity, and throttled or failing deployments are taken out of rotation until they recover (`deployment_pool`).
+- **Retry with Backoff**: Throttling (429), timeouts, connection errors and 5xx responses are retried with
+  exponential backoff and full jitter. `Retry-After` / `retry-after-ms` headers sent by Azure take precedence.
+- **Per-call Timeouts**: Every request is sent with `--request_timeout` seconds.
+- **Statistics**: Requests, retries, throttled responses, time spent waiting and failures are counted, so heavy
+  throttling shows up as a slowdown in the step log instead of silently degraded summaries.
+- **Thread Safety**: `complete` may be called from several threads (`fused_runner.py`): the client is created once
+  and the counters and the cache are updated under locks.
+- **Summary Cache**: With `--cache_dir`, results are looked up in / stored to a `summary_cache.SummaryCache`
+  keyed by model, messages and decoding parameters, so unchanged documents cost nothing on re-runs. The shards of
+  a sharded step (`sharding`) each keep their own cache file.
+- **Batch Results**: `prefetch` hands the results of a batch job (`batch_api`) to the client, which returns them
+  instead of sending the matching requests.
+- **Failure Threshold**: `report_and_check` fails the step when the share of failed requests exceeds `--max_failure_rate`.
+
+Command-line Arguments (added with `add_llm_arguments`):
+- --llm_backend: "azure" (default), "openai" (OpenAI-compatible server at `--llm_base_url`) or "stub".
+- --llm_base_url: Base URL of the OpenAI-compatible server of the openai backend.
+- --aoai_endpoints: JSON list (or JSON file) of deployments `{"resource", "model", "api_key", "weight"}` used
+  instead of `--aoai_resource` / `--aoai_model` / `--aoai_apikey`.
+- --max_retries: Retries per request before it counts as a failure.
+- --request_timeout: Timeout in seconds for each request.
+- --max_failure_rate: Share of failed requests tolerated before the step exits with an error.
+- --cache_dir: Folder of the persistent summary cache (disabled if omitted).
+- --cache_max_mb: Size limit of the summary cache in MB.
+"""
+
+import asyncio
+import datetime
+import email.utils
+import random
+import sys
+import threading
+import time
+
+import openai
+
+from deployment_pool import Deployment, DeploymentPool, parse_deployments
+from llm_backends import BACKENDS, AzureBackend, create_backend
+from sharding import resolve_shard
+from summary_cache import SummaryCache, cache_key
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+class LLMError(Exception):
+    """Raised when a request still fails after all retries."""
+
+
+class LLMStats:
+    """Counters of the requests sent through an `LLMClient` (updated with `count`, safe across threads)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failures = 0
+        self.wait_seconds = 0.0
+        self.cache_hits = 0
+        self.batch_hits = 0
+        # sections summarized by `extractive_summary` instead of a request
+        self.local_summaries = 0
+
+    def count(self, **increments):
+        """Function to add increments (e.g. requests=1) to the counters"""
+        with self._lock:
+            for name, value in increments.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    @property
+    def failure_rate(self) -> float:
+        return self.failures / self.requests if self.requests else 0.0
+
+    def __str__(self):
+        return (
+            f"requests={self.requests} retries={self.retries} "
+            f"throttled={self.throttled} failures={self.failures} "
+            f"backoff_wait={self.wait_seconds:.1f}s cache_hits={self.cache_hits} "
+            f"batch_hits={self.batch_hits} local_summaries={self.local_summaries}"
+        )
+
+
+def add_llm_arguments(parser):
+    """
+    Function to add the retry / timeout arguments shared by the summarization steps.
+
+    Args:
+    parser (argparse.ArgumentParser): The step's argument parser.
+    """
+    parser.add_argument(
+        "--llm_backend", type=str, default="azure", choices=BACKENDS
+    )
+    parser.add_argument("--llm_base_url", type=str, default=None)
+    parser.add_argument("--aoai_endpoints", type=str, default=None)
+    parser.add_argument("--max_retries", type=int, default=6)
+    parser.add_argument("--request_timeout", type=float, default=60.0)
+    parser.add_argument("--max_failure_rate", type=float, default=0.01)
+    parser.add_argument("--cache_dir", type=str, default=None)
+    parser.add_argument("--cache_max_mb", type=int, default=1024)
+
+
+def retry_after_seconds(error: Exception):
+    """
+    Function to read the wait time requested by the service from an API error.
+
+    Args:
+    error (Exception): The error raised by the openai client.
+
+    Returns:
+    float | None: Seconds to wait, or None if the response carries no Retry-After header.
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    if headers.get("retry-after-ms"):
+        try:
+            return max(0.0, float(headers["retry-after-ms"]) / 1000)
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    # Retry-After may also be an HTTP date
+    try:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        # malformed header: fall back to the client's own backoff
+        return None
+    if retry_at.tzinfo is None:
+        # HTTP dates are GMT
+        retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class LLMClient:
+    """
+    Chat client with connection reuse, retries and statistics.
+
+    Args:
+    resource (str): The Azure OpenAI resource name.
+    api_key (str): The API key of the resource.
+    model (str): The deployment name used for chat completions.
+    max_retries (int): Retries per request before it counts as a failure.
+    timeout (float): Timeout in seconds for each request.
+    backoff_base (float): First backoff interval in seconds.
+    backoff_max (float): Upper bound of a single backoff interval in seconds.
+    cache (SummaryCache): Optional persistent cache of results.
+    deployments (list): Optional `deployment_pool.Deployment`s used instead of resource / api_key / model.
+    backend (AzureBackend | OpenAICompatibleBackend | StubBackend): Backend of the requests (Azure OpenAI by default).
+    """
+
+    def __init__(
+        self,
+        resource: str,
+        api_key: str,
+        model: str,
+        max_retries: int = 6,
+        timeout: float = 60.0,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+        cache: SummaryCache = None,
+        deployments: list = None,
+        backend=None,
+    ):
+        self.backend = backend or AzureBackend()
+        if not deployments:
+            deployments = [Deployment(resource, model, api_key)]
+        self.pool = DeploymentPool(deployments)
+        # the first deployment also serves the batch jobs (`batch_api`)
+        self.endpoint = deployments[0].endpoint
+        self.api_key = deployments[0].api_key
+        self.model = model or deployments[0].model
+        # cache keys use one model name, whichever deployment answers
+        self.cache_model = self.backend.cache_model(self.model)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.cache = cache
+        self.stats = LLMStats()
+        # results of a batch job (`batch_api.BatchRunner.prefetch`), by cache key
+        self.prefetched = {}
+        self._client_lock = threading.Lock()
+
+    @classmethod
+    def from_args(cls, args):
+        """Function to create a client from the step's parsed arguments"""
+        if (
+            args.llm_backend == "openai"
+            and not args.llm_base_url
+            and not args.aoai_endpoints
+        ):
+            raise ValueError("--llm_backend openai needs --llm_base_url")
+        return cls(
+            resource=args.aoai_resource,
+            api_key=args.aoai_apikey,
+            model=args.aoai_model,
+            max_retries=args.max_retries,
+            timeout=args.request_timeout,
+            cache=(
+                SummaryCache(
+                    args.cache_dir,
+                    args.cache_max_mb * 1024 * 1024,
+                    # shards of a step share cache_dir: one file each
+                    resolve_shard(args),
+                )
+                if args.cache_dir
+                else None
+            ),
+            deployments=(
+                parse_deployments(args.aoai_endpoints)
+                if args.aoai_endpoints
+                else [
+                    Deployment(
+                        args.aoai_resource,
+                        args.aoai_model,
+                        args.aoai_apikey,
+                        base_url=args.llm_base_url,
+                    )
+                ]
+            ),
+            backend=create_backend(args.llm_backend),
+        )
+
+    def client_for(self, deployment: Deployment):
+        """Function to get the client of a deployment"""
+        # several threads of the fused runner share the clients
+        with self._client_lock:
+            if deployment.client is None:
+                deployment.client = self.backend.client(
+                    deployment, self.timeout
+                )
+        return deployment.client
+
+    def async_client_for(self, deployment: Deployment):
+        """Function to get the asyncio client of a deployment"""
+        if deployment.async_client is None:
+            deployment.async_client = self.backend.async_client(
+                deployment, self.timeout
+            )
+        return deployment.async_client
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        """Function to compute the wait before the next attempt"""
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            delay = retry_after
+        else:
+            delay = random.uniform(
+                0, min(self.backoff_max, self.backoff_base * 2**attempt)
+            )
+        self.stats.count(retries=1)
+        return delay
+
+    def _acquire(self, avoid: dict):
+        """Function to get a deployment for the next attempt, or (None, seconds to wait)"""
+        deployment, wait = self.pool.acquire(avoid)
+        if deployment is None:
+            self.stats.count(wait_seconds=wait)
+        return deployment, wait
+
+    def _attempt_failed(
+        self,
+        deployment: Deployment,
+        attempt: int,
+        error: Exception,
+        avoid: dict,
+    ):
+        """
+        Function to record a failed attempt on a deployment.
+
+        Args:
+        deployment (Deployment): The deployment of the attempt.
+        attempt (int): Number of failed attempts of the request before this one.
+        error (Exception): The error raised by the openai client.
+        avoid (dict): Deployments the request avoids, updated in place.
+
+        Returns:
+        LLMError | None: The error to raise, or None to retry.
+        """
+        if not isinstance(error, RETRYABLE_ERRORS):
+            self.pool.released(deployment)
+            return self._failed(error)
+        throttled = isinstance(error, openai.RateLimitError)
+        if throttled:
+            self.stats.count(throttled=1)
+        self.pool.failed(
+            deployment, retry_after_seconds(error) if throttled else None
+        )
+        if attempt == self.max_retries:
+            return self._failed(error)
+        avoid[deployment.name] = time.monotonic() + self._backoff(
+            attempt, error
+        )
+        return None
+
+    def _attempt_succeeded(self, deployment: Deployment, raw, key: str) -> str:
+        """Function to record a response and return its content"""
+        self.pool.succeeded(deployment, raw.headers)
+        response = raw.parse()
+        return self._cache_put(key, response.choices[0].message.content or "")
+
+    def _cache_key(self, messages: list, params: dict):
+        if self.cache is None and not self.prefetched:
+            return None
+        return cache_key(self.cache_model, messages, params)
+
+    def _cache_get(self, key: str):
+        if key is None:
+            return None
+        if key in self.prefetched:
+            self.stats.count(batch_hits=1)
+            return self.prefetched[key]
+        if self.cache is None:
+            return None
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.stats.count(cache_hits=1)
+        return cached
+
+    def _cache_put(self, key: str, content: str) -> str:
+        if key is not None and content and self.cache is not None:
+            self.cache.put(key, content)
+        return content
+
+    def prefetch(self, results: dict):
+        """
+        Function to serve results obtained out of band (e.g. by a batch job) to the next requests.
+
+        Args:
+        results (dict): Cache key (`summary_cache.cache_key`) -> content.
+        """
+        self.prefetched.update(results)
+        if self.cache is not None:
+            for key, content in results.items():
+                self.cache.put(key, content)
+
+    def _failed(self, error: Exception) -> LLMError:
+        self.stats.count(failures=1)
+        return LLMError(f"{type(error).__name__}: {error}")
+
+    def complete(self, messages: list, **params) -> str:
+        """
+        Function to send a chat completion, retrying throttled and transient failures.
+
+        Args:
+        messages (list): Chat messages.
+        params: Extra parameters for `chat.completions.create` (e.g. temperature, max_tokens).
+
+        Returns:
+        str: The content of the first choice.
+
+        Raises:
+        LLMError: If the request failed after all retries or with a non-retryable error.
+        """
+        key = self._cache_key(messages, params)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+        self.stats.count(requests=1)
+        avoid = {}
+        attempt = 0
+        while True:
+            deployment, wait = self._acquire(avoid)
+            if deployment is None:
+                time.sleep(wait)
+                continue
+            try:
+                # raw response: its headers tell the remaining capacity of the deployment
+                raw = self.client_for(
+                    deployment
+                ).chat.completions.with_raw_response.create(
+                    model=deployment.model,
+                    messages=messages,
+                    timeout=self.timeout,
+                    **params,
+                )
+            except openai.OpenAIError as e:
+                error = self._attempt_failed(deployment, attempt, e, avoid)
+                if error is not None:
+                    raise error
+                attempt += 1
+                continue
+            return self._attempt_succeeded(deployment, raw, key)
+
+    async def acomplete(
+        self, messages: list, limiter=None, token_count: int = 0, **params
+    ) -> str:
+        """
+        asyncio version of `complete`.
+
+        Args:
+        messages (list): Chat messages.
+        limiter (RateLimiter): Optional TPM / RPM limiter acquired before every attempt.
+        token_count (int): Estimated tokens of the request, used by the limiter.
+        params: Extra parameters for `chat.completions.create`.
+
+        Returns:
+        str: The content of the first choice.
+
+        Raises:
+        LLMError: If the request failed after all retries or with a non-retryable error.
+        """
+        key = self._cache_key(messages, params)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+        self.stats.count(requests=1)
+        avoid = {}
+        attempt = 0
+        while True:
+            deployment, wait = self._acquire(avoid)
+            if deployment is None:
+                await asyncio.sleep(wait)
+                continue
+            if limiter is not None:
+                await limiter.acquire(token_count)
+            try:
+                raw = await self.async_client_for(
+                    deployment
+                ).chat.completions.with_raw_response.create(
+                    model=deployment.model,
+                    messages=messages,
+                    timeout=self.timeout,
+                    **params,
+                )
+            except openai.OpenAIError as e:
+                error = self._attempt_failed(deployment, attempt, e, avoid)
+                if error is not None:
+                    raise error
+                attempt += 1
+                continue
+            return self._attempt_succeeded(deployment, raw, key)
+
+    async def aclose(self):
+        for deployment in self.pool.deployments:
+            if deployment.async_client is not None:
+                await deployment.async_client.close()
+                deployment.async_client = None
+
+    def close(self):
+        """Function to persist the summary cache, if any"""
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+    def report_and_check(self, max_failure_rate: float):
+        """
+        Function to print the request statistics and exit with an error if too many requests failed.
+
+        Args:
+        max_failure_rate (float): Share of failed requests tolerated (0.0 - 1.0).
+        """
+        print(f"LLM stats: {self.stats}")
+        if len(self.pool) > 1:
+            print(f"LLM deployments: {self.pool}")
+        if self.stats.failure_rate > max_failure_rate:
+            print(
+                f"{self.stats.failures}/{self.stats.requests} LLM requests failed "
+                f"(failure rate {self.stats.failure_rate:.1%} > {max_failure_rate:.1%})."
+            )
+            sys.exit(1)
@@ -0,0 +1,167 @@
+"""
+Summary:
+This module keeps a per-document manifest in the output folder of a step, so that a re-run only processes the
+documents that were added or modified since the previous run.
+
+For every source (a document or section, identified by its file name) the manifest records a content hash and the
+names of the output files derived from it. The output folders are persistent between runs (fixed datastore paths in
+pipeline.yaml), so outputs of unchanged sources are reused as they are.
+
+Key functionalities:
+- **Change Detection**: `is_current` tells whether a source has the same hash as in the previous run and all its
+  outputs still exist. The hash should cover everything the outputs depend on (content, prompt, summary, limits).
+- **Output Tracking**: `record` replaces the entry of a source after its outputs were written; `discard` deletes the
+  outputs of a source before it is processed again, so outputs that are no longer produced don't linger.
+- **Deletions**: `remove_stale` deletes the outputs of the sources that were not seen in this run.
+- **Storage**: `manifest.json`, written atomically. Deleting it forces a full rebuild of the step.
+- **Shards**: A sharded step keeps one manifest per shard (`sharding.shard_file_name`). After a change of the number
+  of shards, each shard takes over the entries of its sources from the manifests of the previous layout, so their
+  outputs are reused (or removed, for deleted sources) instead of being rebuilt and orphaned.
+"""
+
+import hashlib
+import json
+import os
+
+from sharding import (
+    in_shard,
+    previous_layout_files,
+    remove_previous_layouts,
+    shard_file_name,
+)
+
+MANIFEST_FILENAME = "manifest.json"
+
+
+def content_hash(*parts: str) -> str:
+    """
+    Function to hash the inputs a source's outputs depend on.
+
+    Args:
+    parts (str): Content, prompt, summary, ...
+
+    Returns:
+    str: Hex SHA-256 digest.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class Manifest:
+    """
+    Content hashes and output files of the sources processed by one step.
+
+    Args:
+    output_folder (str): The (persistent) output folder of the step; output names are relative to it.
+    shard (tuple): (shard index, number of shards) of the step; shards keep their own manifest file.
+    source_key (callable): Maps a source name to its document key (`sharding.in_shard`), to take over entries of
+    manifests written with another number of shards.
+    """
+
+    def __init__(
+        self,
+        output_folder: str,
+        shard: tuple = (0, 1),
+        source_key=None,
+    ):
+        self.output_folder = output_folder
+        self.shard = shard
+        self.path = os.path.join(
+            output_folder, shard_file_name(MANIFEST_FILENAME, shard)
+        )
+        self.entries = self.read(self.path)
+        for path in previous_layout_files(
+            output_folder, MANIFEST_FILENAME, shard
+        ):
+            # sources of this shard recorded with another number of shards
+            taken = 0
+            for key, entry in self.read(path).items():
+                owner = source_key(key) if source_key else key
+                if key not in self.entries and in_shard(owner or key, shard):
+                    self.entries[key] = entry
+                    taken += 1
+            print(f"manifest {path}: took over {taken} sources")
+        self.seen = set()
+        self.reused = 0
+        self.updated = 0
+        self.deleted = 0
+        print(f"manifest {self.path}: {len(self.entries)} sources")
+
+    @staticmethod
+    def read(path: str) -> dict:
+        """Function to read the entries of a manifest file, {} if it doesn't exist"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def is_current(self, key: str, digest: str) -> bool:
+        """
+        Function to check whether the outputs of a source can be reused.
+
+        Args:
+        key (str): The source name.
+        digest (str): The `content_hash` of the source in this run.
+
+        Returns:
+        bool: True if the hash did not change and all recorded outputs exist.
+        """
+        self.seen.add(key)
+        entry = self.entries.get(key)
+        current = (
+            entry is not None
+            and entry["hash"] == digest
+            and all(
+                os.path.exists(os.path.join(self.output_folder, output))
+                for output in entry["outputs"]
+            )
+        )
+        if current:
+            self.reused += 1
+        return current
+
+    def discard(self, key: str):
+        """Function to delete the recorded outputs of a source and forget it"""
+        entry = self.entries.pop(key, None)
+        for output in entry["outputs"] if entry else []:
+            output_path = os.path.join(self.output_folder, output)
+            if os.path.exists(output_path):
+                os.remove(output_path)
+
+    def record(self, key: str, digest: str, outputs: list, **extra):
+        """
+        Function to record the outputs written for a source.
+
+        Args:
+        key (str): The source name.
+        digest (str): The `content_hash` of the source.
+        outputs (list): Output file names, relative to the output folder.
+        extra: Additional values to keep with the entry (e.g. the summary of the document).
+        """
+        self.seen.add(key)
+        self.entries[key] = {"hash": digest, "outputs": outputs, **extra}
+        self.updated += 1
+
+    def remove_stale(self):
+        """Function to delete the outputs of the sources that were not seen in this run"""
+        for key in sorted(set(self.entries) - self.seen):
+            self.discard(key)
+            self.deleted += 1
+
+    def save(self):
+        """Function to write the manifest back to the output folder"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        remove_previous_layouts(
+            self.output_folder, MANIFEST_FILENAME, self.shard
+        )
+        print(
+            f"manifest saved: reused={self.reused} updated={self.updated} "
+            f"deleted={self.deleted}"
+        )
@@ -0,0 +1,251 @@
+"""
+Summary:
+This module splits a Markdown document into chunks of at most `max_tokens` tokens for step5. Every chunk is an
+exact substring of the document (only the surrounding whitespace is stripped), and consecutive chunks can
+optionally overlap by a number of tokens.
+
+Key functionalities:
+- **Break Points**: The document is only cut at candidate breaks, by order of preference: paragraph starts and
+  headings, then sentence ends and list items, then other line starts (e.g. inside a code block that does not
+  fit in one chunk), and finally at a token when a single line is longer than a chunk. Paragraphs, code and
+  HTML blocks come from `md_parser`, so code blocks are kept whole whenever they fit.
+- **Tokenize Once**: The text between two consecutive candidate breaks is encoded once. Chunk sizes are read
+  from a prefix sum over these segment counts (token offsets of the breaks) instead of re-encoding sentences
+  and separators for every chunk.
+- **Overlap**: With `overlap_tokens`, a chunk starts with the last whole segments of the previous chunk that
+  fit in the overlap.
+"""
+
+import bisect
+import re
+
+from md_parser import paragraphs, scan_lines
+from md_splitter import ENCODING_NAME, get_encoding
+
+# break levels, the lower the better
+PARAGRAPH_BREAK = 0
+SENTENCE_BREAK = 1
+LINE_BREAK = 2
+TOKEN_BREAK = 3
+
+# the position after the punctuation is a pre-tokenization boundary when a space follows
+SENTENCE_END_PATTERN = re.compile(r"[.!?](?=[ \t]+\S)")
+LIST_ITEM_PATTERN = re.compile(r"[ \t]*(?:[-*+]|\d+[.)])[ \t]")
+
+
+def find_breaks(text: str) -> dict:
+    """
+    Function to find the candidate chunk breaks of a Markdown document.
+
+    Args:
+    text (str): The Markdown document.
+
+    Returns:
+    dict: Offset -> break level of every candidate break strictly inside the document.
+    """
+    breaks = {}
+
+    def add(position, level):
+        if (
+            0 < position < len(text)
+            and breaks.get(position, level + 1) > level
+        ):
+            breaks[position] = level
+
+    lines = scan_lines(text)
+    for paragraph in paragraphs(text, lines):
+        add(paragraph.start, PARAGRAPH_BREAK)
+        if paragraph.kind == "text":
+            for match in SENTENCE_END_PATTERN.finditer(
+                text, paragraph.start, paragraph.end
+            ):
+                add(match.end(), SENTENCE_BREAK)
+    for line in lines:
+        if line.kind == "heading":
+            add(line.start, PARAGRAPH_BREAK)
+        elif line.kind == "text" and LIST_ITEM_PATTERN.match(text, line.start):
+            add(line.start, SENTENCE_BREAK)
+        elif line.kind != "blank":
+            add(line.start, LINE_BREAK)
+    return breaks
+
+
+class DocumentSegments:
+    """
+    Token counts of the segments between the candidate breaks of one document.
+
+    Segments longer than `max_segment_tokens` are cut at token offsets, so any chunk size down to
+    `max_segment_tokens` can be served.
+
+    Args:
+    text (str): The Markdown document.
+    max_segment_tokens (int): The maximum number of tokens of a segment.
+    encoding_name (str): The tiktoken encoding name.
+    """
+
+    def __init__(
+        self,
+        text: str,
+        max_segment_tokens: int = 512,
+        encoding_name: str = ENCODING_NAME,
+    ):
+        encoding = get_encoding(encoding_name)
+        breaks = find_breaks(text)
+        self.text = text
+        self.encoding = encoding
+        self.positions = [0]
+        self.levels = [PARAGRAPH_BREAK]
+        self.cumulative_tokens = [0]
+
+        start = 0
+        for end in sorted(breaks) + [len(text)]:
+            tokens = encoding.encode_ordinary(text[start:end])
+            if len(tokens) > max_segment_tokens:
+                # a single line longer than a chunk: cut it at token offsets
+                start = self._cut_tokens(
+                    encoding, start, end, tokens, max_segment_tokens
+                )
+                tokens = encoding.encode_ordinary(text[start:end])
+            self._append(end, breaks.get(end, PARAGRAPH_BREAK), len(tokens))
+            start = end
+
+    def _cut_tokens(
+        self,
+        encoding,
+        start: int,
+        end: int,
+        tokens: list,
+        max_segment_tokens: int,
+    ) -> int:
+        """
+        Function to cut a segment longer than max_segment_tokens at token offsets.
+
+        BPE is not prefix-stable: a piece cut inside a pre-tokenization piece (e.g. a line of Japanese text without
+        spaces) can encode to more tokens than it had in the whole segment, so every piece is counted on its own
+        and cut shorter if needed.
+
+        Returns:
+        int: Start of the last piece, which is left to the caller.
+        """
+        _, offsets = encoding.decode_with_offsets(tokens)
+        piece_start, done = start, 0
+        while len(tokens) - done > max_segment_tokens or (
+            len(encoding.encode_ordinary(self.text[piece_start:end]))
+            > max_segment_tokens
+        ):
+            cut = min(done + max_segment_tokens, len(tokens) - 1)
+            count = 0
+            while cut > done:
+                position = start + offsets[cut]
+                if position > piece_start:
+                    count = len(
+                        encoding.encode_ordinary(
+                            self.text[piece_start:position]
+                        )
+                    )
+                    if count <= max_segment_tokens:
+                        break
+                cut -= 1
+            if cut <= done:
+                # no token offset to cut at: keep the rest whole
+                break
+            self._append(position, TOKEN_BREAK, count)
+            piece_start, done = position, cut
+        return piece_start
+
+    def _append(self, position: int, level: int, tokens: int):
+        self.positions.append(position)
+        self.levels.append(level)
+        self.cumulative_tokens.append(self.cumulative_tokens[-1] + tokens)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.cumulative_tokens[-1]
+
+    def _best_break(self, first: int, limit: int, max_tokens: int) -> int:
+        """Function to pick the break ending a chunk that starts at break first"""
+        candidates = range(first + 1, limit + 1)
+        # prefer the breaks that fill at least half of the chunk
+        filled = [
+            i
+            for i in candidates
+            if self.cumulative_tokens[i] - self.cumulative_tokens[first]
+            >= max_tokens // 2
+        ] or list(candidates)
+        best_level = min(self.levels[i] for i in filled)
+        return max(i for i in filled if self.levels[i] == best_level)
+
+    def _fits(self, first: int, end: int, chunk: str, max_tokens: int):
+        """Function to check the size of a chunk joining pieces cut at token offsets, whose counts don't add up"""
+        if TOKEN_BREAK not in self.levels[first : end + 1]:
+            return True
+        return len(self.encoding.encode_ordinary(chunk)) <= max_tokens
+
+    def chunks(self, max_tokens: int = 512, overlap_tokens: int = 0) -> list:
+        """
+        Function to split the document into chunks of no more than max_tokens tokens.
+
+        Args:
+        max_tokens (int): The maximum number of tokens of a chunk (not below `max_segment_tokens`).
+        overlap_tokens (int): Tokens repeated from the end of the previous chunk (at most half a chunk).
+
+        Returns:
+        list: The chunks, as stripped substrings of the document.
+        """
+        overlap_tokens = min(overlap_tokens, max_tokens // 2)
+        last = len(self.positions) - 1
+        result = []
+        first = 0
+        while first < last:
+            limit = (
+                bisect.bisect_right(
+                    self.cumulative_tokens,
+                    self.cumulative_tokens[first] + max_tokens,
+                )
+                - 1
+            )
+            if limit >= last:
+                end = last
+            else:
+                end = self._best_break(
+                    first, max(limit, first + 1), max_tokens
+                )
+            chunk = self.text[self.positions[first] : self.positions[end]]
+            while end > first + 1 and not self._fits(
+                first, end, chunk, max_tokens
+            ):
+                end = self._best_break(first, end - 1, max_tokens)
+                chunk = self.text[self.positions[first] : self.positions[end]]
+            if chunk.strip():
+                result.append(chunk.strip())
+            if end == last:
+                break
+            next_first = bisect.bisect_left(
+                self.cumulative_tokens,
+                self.cumulative_tokens[end] - overlap_tokens,
+            )
+            first = min(max(next_first, first + 1), end)
+        return result
+
+
+def chunk_text(
+    text: str,
+    max_tokens: int = 512,
+    overlap_tokens: int = 0,
+    encoding_name: str = ENCODING_NAME,
+) -> list:
+    """
+    Function to split a Markdown document into chunks of no more than max_tokens tokens.
+
+    Args:
+    text (str): The Markdown document.
+    max_tokens (int): The maximum number of tokens of a chunk.
+    overlap_tokens (int): Tokens repeated from the end of the previous chunk.
+    encoding_name (str): The tiktoken encoding name.
+
+    Returns:
+    list: The chunks, as stripped substrings of the document.
+    """
+    return DocumentSegments(text, max_tokens, encoding_name).chunks(
+        max_tokens, overlap_tokens
+    )
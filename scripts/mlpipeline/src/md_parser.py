@@ -0,0 +1,173 @@
+"""
+Summary:
+This module is a small single-pass Markdown block scanner used to find the real structure of a document before it
+is split into sections (step2 via `md_splitter`) or chunks (step5 via `md_chunker`).
+
+Splitting with a plain `(?m)^# ` regex treats shell comments such as `# install deps` inside code fences as
+top-level headings and slices code blocks into many tiny bogus sections. The scanner classifies every line once,
+so headings inside code or HTML blocks are ignored.
+
+Key functionalities:
+- **Fenced Code**: ``` and ~~~ fences (indented up to 3 spaces); a fence is closed by a fence of the same character
+  that is at least as long. An unclosed fence runs to the end of the document.
+- **Indented Code**: Lines indented by 4+ spaces (or a tab) that do not continue a paragraph.
+- **HTML Blocks**: `<script>`, `<pre>`, `<style>`, `<textarea>` and `<!-- -->` blocks (until their closing tag),
+  and blocks opened by a block-level tag such as `<div>` or `<table>` (until the next blank line).
+- **Headings**: ATX headings written as `#` … `######` followed by a space at the start of a line, outside the blocks above.
+- **Paragraphs**: Runs of non-blank lines; code and HTML blocks are kept whole even if they contain blank lines.
+"""
+
+import re
+from collections import namedtuple
+
+# kind: "blank", "heading", "fence", "indented_code", "html" or "text"
+Line = namedtuple("Line", ["start", "end", "kind", "level"])
+
+# (start, end, kind) of a run of non-blank lines; kind is "code", "html" or "text"
+Paragraph = namedtuple("Paragraph", ["start", "end", "kind"])
+
+LINE_PATTERN = re.compile(r"[^\n]*\n|[^\n]+")
+FENCE_OPEN_PATTERN = re.compile(r"^ {0,3}(`{3,}(?!.*`)|~{3,})")
+HEADING_PATTERN = re.compile(r"^(#{1,6}) ")
+HTML_RAW_PATTERN = re.compile(
+    r"^ {0,3}<(script|pre|style|textarea)(\s|>|$)", re.I
+)
+HTML_RAW_END_PATTERN = re.compile(r"</(script|pre|style|textarea)>", re.I)
+HTML_BLOCK_TAGS = (
+    "address|article|aside|blockquote|body|caption|center|col|colgroup|dd|details|dialog|dir|div|dl|dt|"
+    "fieldset|figcaption|figure|footer|form|h1|h2|h3|h4|h5|h6|head|header|hr|html|iframe|legend|li|link|"
+    "main|menu|nav|ol|p|section|summary|table|tbody|td|tfoot|th|thead|title|tr|ul|video"
+)
+HTML_BLOCK_PATTERN = re.compile(
+    rf"^ {{0,3}}</?({HTML_BLOCK_TAGS})(\s|/?>|$)", re.I
+)
+
+
+def _is_blank(line: str) -> bool:
+    return not line.strip()
+
+
+def _is_indented(line: str) -> bool:
+    return line.startswith("    ") or line.startswith("\t")
+
+
+def scan_lines(text: str) -> list:
+    """
+    Function to classify every line of a Markdown document in a single pass.
+
+    Args:
+    text (str): The Markdown document.
+
+    Returns:
+    list: A list of `Line(start, end, kind, level)`; `end` includes the line break and `level` is the number of
+    `#` of a heading (0 for other lines).
+    """
+    lines = []
+    fence = None  # (character, length) of the open code fence
+    html_end = None  # pattern closing the open HTML block, or "blank"
+    previous_kind = "blank"
+    start = 0
+    for match in LINE_PATTERN.finditer(text):
+        raw_line = match.group()
+        end = start + len(raw_line)
+        line = raw_line.rstrip("\r\n")
+        kind, level = "text", 0
+
+        if fence is not None:
+            kind = "fence"
+            stripped = line.strip()
+            if (
+                len(line) - len(line.lstrip(" ")) <= 3
+                and stripped.startswith(fence[0] * fence[1])
+                and stripped == fence[0] * len(stripped)
+            ):
+                fence = None
+        elif html_end is not None:
+            if html_end == "blank" and _is_blank(line):
+                html_end = None
+                kind = "blank"
+            else:
+                kind = "html"
+                if html_end != "blank" and html_end.search(line):
+                    html_end = None
+        elif _is_blank(line):
+            kind = "blank"
+        elif FENCE_OPEN_PATTERN.match(line):
+            marker = FENCE_OPEN_PATTERN.match(line).group(1)
+            fence = (marker[0], len(marker))
+            kind = "fence"
+        elif _is_indented(line) and previous_kind in (
+            "blank",
+            "heading",
+            "indented_code",
+        ):
+            kind = "indented_code"
+        elif HEADING_PATTERN.match(line):
+            kind, level = "heading", len(HEADING_PATTERN.match(line).group(1))
+        elif HTML_RAW_PATTERN.match(line):
+            kind = "html"
+            if not HTML_RAW_END_PATTERN.search(line):
+                html_end = HTML_RAW_END_PATTERN
+        elif line.lstrip(" ").startswith("<!--"):
+            kind = "html"
+            if "-->" not in line:
+                html_end = re.compile("-->")
+        elif HTML_BLOCK_PATTERN.match(line):
+            kind = "html"
+            html_end = "blank"
+
+        lines.append(Line(start, end, kind, level))
+        previous_kind = kind
+        start = end
+    return lines
+
+
+def heading_starts(lines: list, level: int) -> list:
+    """
+    Function to get the offsets of the headings of one level.
+
+    Args:
+    lines (list): The result of `scan_lines`.
+    level (int): The heading level (1 for `# `, 2 for `## `, ...).
+
+    Returns:
+    list: Sorted start offsets of the heading lines.
+    """
+    return [
+        line.start
+        for line in lines
+        if line.kind == "heading" and line.level == level
+    ]
+
+
+def paragraphs(text: str, lines: list) -> list:
+    """
+    Function to group lines into paragraphs separated by blank lines, keeping code and HTML blocks whole.
+
+    Args:
+    text (str): The Markdown document.
+    lines (list): The result of `scan_lines(text)`.
+
+    Returns:
+    list: A list of `Paragraph(start, end, kind)`; `end` excludes the trailing line break.
+    """
+    result = []
+    current = None
+    for line in lines:
+        if line.kind == "blank":
+            current = None
+            continue
+        block_kind = {
+            "fence": "code",
+            "indented_code": "code",
+            "html": "html",
+        }.get(line.kind, "text")
+        if current is None:
+            current = [line.start, line.end, block_kind]
+            result.append(current)
+        else:
+            current[1] = line.end
+    return [
+        Paragraph(start, start + len(text[start:end].rstrip("\r\n")), kind)
+        for start, end, kind in result
+    ]
@@ -0,0 +1,207 @@
+"""
+Summary:
+This module splits Markdown documents into sections of at most `max_tokens` tokens, following the heading levels
+`#`, `##` and `###`. It is used by step2.
+
+The splitting rules are the ones of the original `process_sections`:
+1. The document is split at top-level headings (`# `) and the delimiter is added back to every section.
+   Headings are found with `md_parser`, so `# ` lines inside fenced / indented code and HTML blocks are not
+   treated as headings.
+2. A section over the limit is split at `## `; the sub-sections are used if all of them fit.
+3. Otherwise every sub-section over the limit is split at `### `; those pieces are used if all of them fit,
+   else the sub-section is kept as is.
+
+Key functionalities:
+- **Tokenize Once**: Each document is encoded a single time, line by line. Section token counts are computed
+  from a prefix sum over the line counts instead of re-encoding every candidate section at every heading level.
+- **Exact Counts**: Heading lines start after a newline followed by a non-space character, which is always a
+  boundary of the tokenizer's pre-tokenization, so token counts add up across such positions. Only the first
+  line of a section (where the removed `## ` delimiter changes the text) is encoded again.
+- **Cached Encoding**: `tiktoken.get_encoding` is called once per process.
+"""
+
+import bisect
+import functools
+import re
+
+import tiktoken
+
+from md_parser import heading_starts, scan_lines
+
+ENCODING_NAME = "cl100k_base"
+
+# a line start followed by a non-space character is a pre-tokenization boundary
+TOKEN_BOUNDARY_PATTERN = re.compile(r"\n(?=\S)")
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(encoding_name: str = ENCODING_NAME):
+    """Function to get a tiktoken encoding, loaded once per process"""
+    return tiktoken.get_encoding(encoding_name)
+
+
+def count_tokens(text: str, encoding_name: str = ENCODING_NAME) -> int:
+    """
+    Function to count the number of tokens in a text.
+
+    Args:
+    text (str): The text to count tokens in.
+    encoding_name (str): The tiktoken encoding name.
+
+    Returns:
+    int: The number of tokens.
+    """
+    # same result as encode(text, disallowed_special=()), without the special token scan
+    return len(get_encoding(encoding_name).encode_ordinary(text))
+
+
+class DocumentTokens:
+    """
+    Token counts of sections of one document, computed from a single encoding of the document.
+
+    The document is encoded line by line (at pre-tokenization boundaries, so the counts add up to the count of
+    the whole document) and a prefix sum over the lines gives the token count between any two line starts.
+
+    A section is described as `(prefix, start, end)`: the text `prefix + content[start:end]`.
+
+    Args:
+    content (str): The whole document.
+    encoding_name (str): The tiktoken encoding name.
+    """
+
+    def __init__(self, content: str, encoding_name: str = ENCODING_NAME):
+        self.content = content
+        self.encoding = get_encoding(encoding_name)
+        lines = scan_lines(content)
+        self.headings = {
+            level: heading_starts(lines, level) for level in (1, 2, 3)
+        }
+        self.boundaries = (
+            [0]
+            + [m.end() for m in TOKEN_BOUNDARY_PATTERN.finditer(content)]
+            + [len(content)]
+        )
+        self.cumulative_tokens = [0]
+        for line_start, line_end in zip(self.boundaries, self.boundaries[1:]):
+            self.cumulative_tokens.append(
+                self.cumulative_tokens[-1]
+                + len(
+                    self.encoding.encode_ordinary(content[line_start:line_end])
+                )
+            )
+
+    def count(self, prefix: str, start: int, end: int) -> int:
+        """
+        Function to count the tokens of `prefix + content[start:end]`.
+
+        `end` must be the end of the document or the start of a heading line.
+        """
+        # first boundary strictly inside the section: everything before it is re-encoded
+        i = bisect.bisect_right(self.boundaries, start)
+        if i >= len(self.boundaries) or self.boundaries[i] >= end:
+            return len(
+                self.encoding.encode_ordinary(prefix + self.content[start:end])
+            )
+        head = len(
+            self.encoding.encode_ordinary(
+                prefix + self.content[start : self.boundaries[i]]
+            )
+        )
+        j = bisect.bisect_left(self.boundaries, end)
+        return head + self.cumulative_tokens[j] - self.cumulative_tokens[i]
+
+    def text(self, section: tuple) -> str:
+        prefix, start, end = section
+        return prefix + self.content[start:end]
+
+    def split(self, section: tuple, delimiter: str) -> list:
+        """
+        Function to split a section at the headings written with delimiter, removing the delimiter.
+
+        Args:
+        section (tuple): `(prefix, start, end)` of the section to split.
+        delimiter (str): The delimiter (e.g., '#', '##', '###').
+
+        Returns:
+        list: A list of `(prefix, start, end)` sections.
+        """
+        prefix, start, end = section
+        headings = self.headings[len(delimiter)]
+        marker_length = len(delimiter) + 1
+
+        pieces = []
+        piece_prefix, piece_start = prefix, start
+        for heading in headings[
+            bisect.bisect_left(headings, start) : bisect.bisect_left(
+                headings, end
+            )
+        ]:
+            # a heading at the very start can only split a section without prefix
+            if heading == start and prefix:
+                continue
+            pieces.append((piece_prefix, piece_start, heading))
+            piece_prefix, piece_start = "", heading + marker_length
+        pieces.append((piece_prefix, piece_start, end))
+        return pieces
+
+
+def process_sections(doc: DocumentTokens, sections: list, max_tokens=512):
+    """
+    Function to split sections so that each section contains no more than max_tokens tokens.
+
+    Args:
+    doc (DocumentTokens): Token counts of the document the sections belong to.
+    sections (list): A list of `(prefix, start, end)` sections.
+    max_tokens (int): The maximum number of tokens.
+
+    Returns:
+    list: A list of `(prefix, start, end)` sections.
+    """
+    processed_sections = []
+    for section in sections:
+        if doc.count(*section) <= max_tokens:
+            processed_sections.append(section)
+            continue
+        # First try to split by `##`
+        sub_sections = doc.split(section, "##")
+        sub_counts = [doc.count(*sub) for sub in sub_sections]
+        if all(count <= max_tokens for count in sub_counts):
+            processed_sections.extend(sub_sections)
+            continue
+        # If still not within limit, try splitting by `###`
+        for sub_section, sub_count in zip(sub_sections, sub_counts):
+            if sub_count <= max_tokens:
+                processed_sections.append(sub_section)
+                continue
+            deeper_sub_sections = doc.split(sub_section, "###")
+            if all(
+                doc.count(*deep) <= max_tokens for deep in deeper_sub_sections
+            ):
+                processed_sections.extend(deeper_sub_sections)
+            else:
+                # If still not within limit, add it as is
+                processed_sections.append(sub_section)
+    return processed_sections
+
+
+def split_markdown(content: str, max_tokens=512) -> list:
+    """
+    Function to split a Markdown document into sections of no more than max_tokens tokens.
+
+    Args:
+    content (str): The Markdown document.
+    max_tokens (int): The maximum number of tokens.
+
+    Returns:
+    list: A list of section strings.
+    """
+    doc = DocumentTokens(content)
+    # Split by the top-level header and add the delimiter back to each section
+    sections = [
+        ("# ", start, end)
+        for _, start, end in doc.split(("", 0, len(content)), "#")
+    ]
+    return [
+        doc.text(section)
+        for section in process_sections(doc, sections, max_tokens)
+    ]
@@ -0,0 +1,222 @@
+"""
+Summary:
+This module holds the per-document logic of steps 1 to 7 (prompts, output formats, splitting, chunking and the
+token filter), so that the step scripts and the fused runner (`fused_runner.py`) produce the same files.
+
+The functions work on strings and never read or write files: the step scripts pass the contents of their input
+folders, the fused runner passes the results of the previous stage directly.
+
+Key functionalities:
+- **step1**: `DOCUMENT_SUMMARY_PROMPT`, `document_messages` and `add_document_info` (PATH / SUMMARIZE header).
+- **step2**: `split_document` (sections without the header, PATH and summary of the document).
+- **step4 / step5**: `SECTION_SUMMARY_PROMPT`, `CHUNK_SUMMARY_PROMPT`, `resummary_messages`, `section_output` and
+  `chunk_output`; `chunk_document` cuts files over `SPLIT_THRESHOLD_TOKENS` into `CHUNK_TOKENS` chunks.
+- **step6 / step7**: `count_tokens` and `keep_for_index` (files under 40 or over 1000 tokens are not indexed).
+
+The prompt strings are kept byte for byte as the steps used to define them, so cached summaries stay valid.
+"""
+
+import os
+import re
+
+from md_chunker import DocumentSegments
+from md_splitter import get_encoding, split_markdown
+
+DOCUMENT_SUMMARY_PROMPT = """
+    You are an AI assistant designed to summarize the content of Markdown files.
+    Your task is to provide a concise summary of the provided Markdown file content in a way that is understandable to beginners, within 300 characters.
+    Extract the key points and ensure that the overall summary conveys the main idea.
+
+    ### Instructions:
+    1. Clearly state the subject and purpose of the file.
+    2. Concisely explain the main features or functionalities.
+    3. Include troubleshooting points and important considerations for the user.
+    4. Mention important links or references if necessary.
+    """
+
+SECTION_SUMMARY_PROMPT = """
+    Summarize the content of the provided Markdown file.
+    Based on the Original Summary, explain in English what the provided Markdown is describing.
+    Ensure that the Response is concise and contains only one sentence!
+    """
+
+CHUNK_SUMMARY_PROMPT = """
+        Summarize the content of the provided Markdown file.
+        Based on the Original Summary, explain in English what the provided Markdown is describing.
+        Ensure that the Response is concise and contains only one sentence!
+        """
+
+# decoding parameters of the step4 / step5 re-summaries
+RESUMMARY_PARAMS = {"temperature": 0, "max_tokens": 100}
+
+SPECIAL_TOKENS = {
+    "<|endofprompt|>",
+    "<|endoftext|>",
+    "<|fim_prefix|>",
+    "<|fim_suffix|>",
+    "<|fim_middle|>",
+}
+
+# step2 section size
+SECTION_TOKENS = 512
+# step5: files over SPLIT_THRESHOLD_TOKENS are chunked into CHUNK_TOKENS pieces
+SPLIT_THRESHOLD_TOKENS = 1000
+CHUNK_TOKENS = 512
+# step6: files outside [MIN_INDEX_TOKENS, MAX_INDEX_TOKENS] are not indexed
+MIN_INDEX_TOKENS = 40
+MAX_INDEX_TOKENS = 1000
+
+
+def document_messages(system_prompt_msg: str, md_content: str) -> list:
+    """Function to build the chat messages used to summarize md_content"""
+    return [
+        {"role": "system", "content": system_prompt_msg},
+        {
+            "role": "user",
+            "content": f"Summarize the following Markdown data: {md_content}",
+        },
+    ]
+
+
+def remove_text(content: str, text_to_remove: str) -> str:
+    """Function to delete text_to_remove from content"""
+    return content.replace(text_to_remove, "")
+
+
+def replace_special_tokens(text: str) -> str:
+    """Function to replace special tokens with empty strings"""
+    for token in SPECIAL_TOKENS:
+        text = text.replace(token, "")
+    return text
+
+
+def add_document_info(
+    file_name: str, content: str, summary: str, text_to_remove: str
+) -> str:
+    """
+    Function to build the step1 output of a document: PATH and SUMMARIZE header, then the content.
+
+    Args:
+    file_name (str): The document file name.
+    content (str): The document content.
+    summary (str): The document summary.
+    text_to_remove (str): String deleted from the result.
+
+    Returns:
+    str: The step1 output.
+    """
+    path_info = f"PATH: {os.path.basename(file_name)}\n"
+    summarize_info = f"SUMMARIZE: {summary}\n"
+    new_content = remove_text(
+        path_info + summarize_info + content, text_to_remove
+    )
+    return replace_special_tokens(new_content)
+
+
+def remove_summaries_and_paths(content: str) -> str:
+    """Function to remove the SUMMARIZE and # PATH: lines from a section"""
+    content = re.sub(r"^SUMMARIZE: .*$", "", content, flags=re.MULTILINE)
+    content = re.sub(r"^# PATH: .*$", "", content, flags=re.MULTILINE)
+    return content
+
+
+def split_document(content: str, max_tokens: int = SECTION_TOKENS) -> tuple:
+    """
+    Function to split a step1 output into sections and extract its PATH and SUMMARIZE statements.
+
+    Args:
+    content (str): The step1 output of a document.
+    max_tokens (int): The maximum number of tokens of a section.
+
+    Returns:
+    tuple: (list of non-empty sections without SUMMARIZE / # PATH: lines, PATH information, summary or None).
+    """
+    sections = split_markdown(content, max_tokens)
+
+    # The step1 header ends up as "# PATH: ..." / "SUMMARIZE: ..." at the top of the first section
+    header = sections[0] if sections else ""
+    path_match = re.search(r"^# PATH: (.*)$", header, re.MULTILINE)
+    path_info = path_match.group(1).strip() if path_match else "No PATH info"
+    summary_match = re.search(r"^SUMMARIZE: (.*)$", header, re.MULTILINE)
+    summary = summary_match.group(1).strip() if summary_match else None
+
+    cleaned_sections = [
+        cleaned
+        for cleaned in map(remove_summaries_and_paths, sections)
+        if cleaned.strip()
+    ]
+    return cleaned_sections, path_info, summary
+
+
+def section_file_name(base_name: str, index: int) -> str:
+    """Function to name the index-th (from 0) step2 section of a document"""
+    return f"{base_name}_part_{index + 1}.md"
+
+
+def resummary_messages(
+    system_prompt_msg: str, md_content: str, summary: str
+) -> list:
+    """Function to build the step4 / step5 chat messages re-summarizing md_content with the document summary"""
+    user_msg = f"""
+        // Original Summary: {summary}
+
+        // Provided Markdown Content: {md_content}
+        """
+    return [
+        {"role": "system", "content": system_prompt_msg},
+        {"role": "user", "content": user_msg},
+    ]
+
+
+def summarized_file_name(file_name: str) -> str:
+    """Function to name the step4 / step5 output of a section or chunk"""
+    return os.path.splitext(file_name)[0] + "_summarized.md"
+
+
+def section_output(summarized_content: str, md_content: str, path: str) -> str:
+    """Function to build the step4 output of a section"""
+    if "# PATH:" in md_content:
+        return summarized_content + "\n\n" + md_content
+    return (
+        summarized_content + "\n\n" + f"# PATH: {path}" + "\n\n" + md_content
+    )
+
+
+def chunk_output(summarized_content: str, md_content: str, path: str) -> str:
+    """Function to build the step5 output of a chunk"""
+    return (
+        summarized_content + "\n\n" + f"# PATH: {path}" + "\n\n" + md_content
+    )
+
+
+def chunk_document(content: str, overlap_tokens: int = 0) -> list:
+    """
+    Function to chunk a step4 output if it exceeds SPLIT_THRESHOLD_TOKENS.
+
+    Args:
+    content (str): The step4 output.
+    overlap_tokens (int): Tokens repeated from the end of the previous chunk.
+
+    Returns:
+    list: The chunks, or an empty list if the file does not need splitting.
+    """
+    # one tokenization per file, for both the size check and the chunks
+    segments = DocumentSegments(content, CHUNK_TOKENS)
+    if segments.total_tokens <= SPLIT_THRESHOLD_TOKENS:
+        return []
+    return segments.chunks(CHUNK_TOKENS, overlap_tokens)
+
+
+def chunk_file_name(base_name: str, index: int) -> str:
+    """Function to name the index-th (from 0) step5 chunk of a step4 output"""
+    return f"{base_name}_part{index + 1}.md"
+
+
+def count_tokens(text: str, encoding_name: str = "cl100k_base") -> int:
+    """Function to count tokens"""
+    return len(get_encoding(encoding_name).encode(text, disallowed_special=()))
+
+
+def keep_for_index(token_count: int) -> bool:
+    """Function to tell whether step6 keeps a file: larger files were chunked, smaller ones are likely noise"""
+    return MIN_INDEX_TOKENS <= token_count <= MAX_INDEX_TOKENS
@@ -0,0 +1,87 @@
+"""
+Summary:
+This module provides an asyncio token bucket used to keep Azure OpenAI calls within the
+tokens-per-minute (TPM) and requests-per-minute (RPM) quota of a deployment.
+
+Key functionalities:
+- `TokenBucket`: a continuously refilled bucket that callers `acquire` an amount from before sending a request.
+- `RateLimiter`: combines a TPM bucket and an RPM bucket so a single `acquire` call respects both quotas.
+
+A limit of 0 (or less) disables the corresponding bucket.
+"""
+
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Asyncio token bucket refilled continuously at `per_minute / 60` units per second.
+
+    Args:
+    per_minute (float): Bucket capacity and refill amount per minute. 0 disables the bucket.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.available = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(
+            self.capacity, self.available + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    async def acquire(self, amount: float = 1.0):
+        """
+        Function to wait until `amount` units are available and take them from the bucket.
+        Requests larger than the bucket capacity are clamped to the capacity so they can still be sent.
+
+        Args:
+        amount (float): The number of units (tokens or requests) to take.
+        """
+        if not self.enabled:
+            return
+        amount = min(float(amount), self.capacity)
+        # the lock keeps waiters in FIFO order so large requests are not starved
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.available >= amount:
+                    self.available -= amount
+                    return
+                await asyncio.sleep((amount - self.available) / self.rate)
+
+
+class RateLimiter:
+    """
+    Rate limiter enforcing both a tokens-per-minute and a requests-per-minute quota.
+
+    Args:
+    tokens_per_minute (float): TPM quota. 0 disables the token limit.
+    requests_per_minute (float): RPM quota. 0 disables the request limit.
+    """
+
+    def __init__(
+        self, tokens_per_minute: float = 0, requests_per_minute: float = 0
+    ):
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.requests = TokenBucket(requests_per_minute)
+
+    async def acquire(self, token_count: int):
+        """
+        Function to wait until one request carrying `token_count` tokens fits in both quotas.
+
+        Args:
+        token_count (int): Estimated tokens consumed by the request (prompt + completion).
+        """
+        await self.requests.acquire(1)
+        await self.tokens.acquire(token_count)
@@ -0,0 +1,129 @@
+"""
+Summary:
+This module packs several sections of the same source document into one step4 re-summary request, which answers
+with one sentence per section as JSON. The system prompt and the summary of the document are sent once per batch
+instead of once per section, so a document split into n sections costs about n / `--batch_sections` requests.
+
+Key functionalities:
+- **Packing**: `pack_batches` groups consecutive sections of one document, up to a number of sections and a token
+  budget for their contents. A section over the budget is sent alone.
+- **Prompt**: `batch_resummary_messages` numbers the sections after a single `// Original Summary`, and
+  `batch_params` scales `max_tokens` with the number of sections.
+- **Validation**: `parse_batch_summaries` accepts `{"summaries": [{"id": <n>, "summary": "<sentence>"}]}` (code
+  fences around it are tolerated) and returns None for every section without a valid, non-empty sentence, so the
+  caller can fall back to a single-section request for these sections only.
+"""
+
+import json
+import re
+
+from pipeline_stages import RESUMMARY_PARAMS
+
+BATCH_SECTION_SUMMARY_PROMPT = """
+    Summarize the content of each provided Markdown section.
+    Based on the Original Summary, explain in English what each section is describing.
+    Ensure that each summary is concise and contains only one sentence!
+    Respond with a JSON object only, with one entry per section, in this format:
+    {"summaries": [{"id": <section number>, "summary": "<one sentence>"}]}
+    """
+
+# completion tokens of the JSON structure around the sentences
+BATCH_OVERHEAD_TOKENS = 50
+
+CODE_FENCE_PATTERN = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+def pack_batches(items, key_of, tokens_of, max_items: int, max_tokens: int):
+    """
+    Function to group consecutive items of the same key into batches.
+
+    Args:
+    items (iterable): The items, with the items of one key next to each other.
+    key_of (callable): Item -> source document key; a batch never mixes keys.
+    tokens_of (callable): Item -> tokens of its content.
+    max_items (int): Maximum number of items of a batch.
+    max_tokens (int): Token budget of the contents of a batch.
+
+    Returns:
+    iterator: Lists of items.
+    """
+    batch, batch_key, batch_tokens = [], None, 0
+    for item in items:
+        key = key_of(item)
+        tokens = tokens_of(item) if max_items > 1 else 0
+        if batch and (
+            key != batch_key
+            or len(batch) >= max_items
+            or batch_tokens + tokens > max_tokens
+        ):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(item)
+        batch_key = key
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def batch_resummary_messages(
+    system_prompt_msg: str, sections: list, summary: str
+) -> list:
+    """Function to build the chat messages re-summarizing several sections of a document at once"""
+    numbered = "\n\n".join(
+        f"        // Section {i}:\n{section}"
+        for i, section in enumerate(sections, start=1)
+    )
+    user_msg = f"""
+        // Original Summary: {summary}
+
+        // Provided Markdown Sections:
+{numbered}
+        """
+    return [
+        {"role": "system", "content": system_prompt_msg},
+        {"role": "user", "content": user_msg},
+    ]
+
+
+def batch_params(count: int) -> dict:
+    """Function to get the decoding parameters of a batch of count sections"""
+    return {
+        **RESUMMARY_PARAMS,
+        "max_tokens": RESUMMARY_PARAMS["max_tokens"] * count
+        + BATCH_OVERHEAD_TOKENS,
+    }
+
+
+def parse_batch_summaries(response: str, count: int) -> list:
+    """
+    Function to read the sentences of a batched response.
+
+    Args:
+    response (str): The content of the response.
+    count (int): Number of sections of the batch.
+
+    Returns:
+    list: One sentence per section, None for the sections without a valid answer.
+    """
+    summaries = [None] * count
+    try:
+        data = json.loads(CODE_FENCE_PATTERN.sub("", response.strip()))
+    except ValueError:
+        return summaries
+    entries = data.get("summaries") if isinstance(data, dict) else None
+    if not isinstance(entries, list):
+        return summaries
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        index = entry.get("id")
+        summary = entry.get("summary")
+        if (
+            isinstance(index, int)
+            and not isinstance(index, bool)
+            and 1 <= index <= count
+            and isinstance(summary, str)
+            and summary.strip()
+        ):
+            summaries[index - 1] = summary.strip()
+    return summaries
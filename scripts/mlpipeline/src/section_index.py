@@ -0,0 +1,60 @@
+"""
+Summary:
+This module joins split section files back to the source document they were cut from, so step4 and step5 can
+look up the document summary (`summaries.csv`, keyed by source file name) of each section in O(1).
+
+Section files follow the naming produced by the pipeline:
+- step2 sections: `<source>_part_<n>.md`
+- step5 chunks of step4 output: `<source>_part_<n>_summarized_part<i>.md`
+
+The source key is recovered exactly from this naming, instead of testing whether a summary key is a substring
+of the file name (which matched e.g. "overview" against "overview-advanced_part_1.md").
+"""
+
+import os
+import re
+
+SECTION_FILE_PATTERN = re.compile(
+    r"^(?P<source>.+)_part_\d+(?:_summarized_part\d+)?\.md$"
+)
+
+
+def section_source_key(file_name: str):
+    """
+    Function to get the source document key of a section file name.
+
+    Args:
+    file_name (str): The section file name (e.g. "overview_part_3.md").
+
+    Returns:
+    str | None: The source key (e.g. "overview"), or None if the name does not follow the section naming.
+    """
+    match = SECTION_FILE_PATTERN.match(file_name)
+    return match.group("source") if match else None
+
+
+def index_sections(folder: str, summaries: dict) -> dict:
+    """
+    Function to map every section file in folder to the summary entry of its source document in one pass.
+
+    Args:
+    folder (str): The folder containing the section files.
+    summaries (dict): Summary entries keyed by source file name (see `read_summaries_csv`).
+
+    Returns:
+    dict: Section file name -> summary entry, in file name order. Files without a summary are left out.
+    """
+    index = {}
+    unmatched = 0
+    for file_name in sorted(os.listdir(folder)):
+        if not file_name.endswith(".md"):
+            continue
+        summary = summaries.get(section_source_key(file_name))
+        if summary is None:
+            unmatched += 1
+            continue
+        index[file_name] = summary
+    print(
+        f"indexed {len(index)} section files in {folder} ({unmatched} without summary)"
+    )
+    return index
@@ -0,0 +1,176 @@
+"""
+Summary:
+This module splits the documents of the LLM-bound steps (step1, step4 and step5) between several nodes, so a
+step can be scaled out instead of being capped by one process.
+
+Key functionalities:
+- **Shard Arguments**: `--shard_index` / `--num_shards`. When they are not given, they are taken from the
+  environment of a multi-node AML command job (`RANK` / `WORLD_SIZE` of a PyTorch distribution, or the
+  `OMPI_COMM_WORLD_*` variables of an MPI distribution), so every node of the job picks its own shard.
+- **Hash Partitioning**: A document belongs to shard `sha256(key) % num_shards`. The key is the source document
+  name, so all the sections and chunks of a document land in the same shard in every step, and a document stays in
+  its shard from one run to the next.
+- **Per-shard State**: Shards write disjoint files into the same (shared) output folder. Files that every shard
+  would write (the manifest, the LLM cache, temporary folders) get a `_shard<i>of<n>` suffix, so no merge is
+  needed: the output folder is complete once every shard is done.
+- **Changing the Number of Shards**: The files of the previous layout (`layout_files`) are read by the shards of the
+  new one, which take over their entries (`manifest.Manifest`, `summary_cache.SummaryCache`). The previous files
+  are deleted once every shard of the new layout has written its own (`remove_previous_layouts`).
+"""
+
+import hashlib
+import os
+import re
+
+# (rank, world size) environment variables of the AML distributions
+SHARD_ENVIRONMENT = [
+    ("RANK", "WORLD_SIZE"),
+    ("OMPI_COMM_WORLD_RANK", "OMPI_COMM_WORLD_SIZE"),
+]
+
+
+def add_shard_arguments(parser):
+    """
+    Function to add the `--shard_index` / `--num_shards` arguments to a step's argument parser.
+
+    Args:
+    parser (argparse.ArgumentParser): The step's argument parser.
+    """
+    parser.add_argument("--shard_index", type=int, default=None)
+    parser.add_argument("--num_shards", type=int, default=None)
+
+
+def resolve_shard(args) -> tuple:
+    """
+    Function to get the shard processed by this process.
+
+    Args:
+    args (argparse.Namespace): The parsed arguments of the step.
+
+    Returns:
+    tuple: (shard index, number of shards); (0, 1) when the step is not sharded.
+    """
+    index = getattr(args, "shard_index", None)
+    count = getattr(args, "num_shards", None)
+    if index is None and count is None:
+        for rank_name, size_name in SHARD_ENVIRONMENT:
+            if rank_name in os.environ and size_name in os.environ:
+                index = int(os.environ[rank_name])
+                count = int(os.environ[size_name])
+                break
+    index = index or 0
+    count = count or 1
+    if not 0 <= index < count:
+        raise ValueError(f"shard index {index} is not in [0, {count})")
+    return index, count
+
+
+def shard_of(key: str, num_shards: int) -> int:
+    """Function to get the shard of a document key"""
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    return int(digest[:16], 16) % num_shards
+
+
+def in_shard(key: str, shard: tuple) -> bool:
+    """
+    Function to check whether a document belongs to a shard.
+
+    Args:
+    key (str): The source document key (file name without extension).
+    shard (tuple): (shard index, number of shards) from `resolve_shard`.
+
+    Returns:
+    bool: True if the document is processed by this shard.
+    """
+    index, count = shard
+    return count == 1 or shard_of(key, count) == index
+
+
+def shard_file_name(file_name: str, shard: tuple) -> str:
+    """
+    Function to make the name of a per-shard file or folder.
+
+    Args:
+    file_name (str): The name used without sharding (e.g. "manifest.json").
+    shard (tuple): (shard index, number of shards) from `resolve_shard`.
+
+    Returns:
+    str: file_name unchanged for a single shard, else e.g. "manifest_shard0of4.json".
+    """
+    index, count = shard
+    if count == 1:
+        return file_name
+    base, ext = os.path.splitext(file_name)
+    return f"{base}_shard{index}of{count}{ext}"
+
+
+def layout_files(folder: str, file_name: str) -> dict:
+    """
+    Function to find the per-shard files of file_name in a folder, whatever the number of shards they were written with.
+
+    Args:
+    folder (str): The folder shared by the shards.
+    file_name (str): The name used without sharding (e.g. "manifest.json").
+
+    Returns:
+    dict: (shard index, number of shards) -> file path.
+    """
+    if not os.path.isdir(folder):
+        return {}
+    base, ext = os.path.splitext(file_name)
+    pattern = re.compile(
+        rf"{re.escape(base)}(?:_shard(\d+)of(\d+))?{re.escape(ext)}"
+    )
+    files = {}
+    for name in os.listdir(folder):
+        match = pattern.fullmatch(name)
+        if match:
+            shard = (
+                (int(match.group(1)), int(match.group(2)))
+                if match.group(1)
+                else (0, 1)
+            )
+            files[shard] = os.path.join(folder, name)
+    return files
+
+
+def previous_layout_files(folder: str, file_name: str, shard: tuple) -> list:
+    """
+    Function to find the per-shard files of file_name written with another number of shards.
+
+    Args:
+    folder (str): The folder shared by the shards.
+    file_name (str): The name used without sharding.
+    shard (tuple): (shard index, number of shards) from `resolve_shard`.
+
+    Returns:
+    list: Paths of the files of the previous layouts.
+    """
+    return sorted(
+        path
+        for (_, count), path in layout_files(folder, file_name).items()
+        if count != shard[1]
+    )
+
+
+def remove_previous_layouts(folder: str, file_name: str, shard: tuple):
+    """
+    Function to delete the files of previous layouts once every shard of the current layout has written its own
+    file, so their entries have all been taken over.
+
+    Args:
+    folder (str): The folder shared by the shards.
+    file_name (str): The name used without sharding.
+    shard (tuple): (shard index, number of shards) from `resolve_shard`.
+    """
+    files = layout_files(folder, file_name)
+    count = shard[1]
+    if not all((index, count) in files for index in range(count)):
+        return
+    for path in previous_layout_files(folder, file_name, shard):
+        try:
+            os.remove(path)
+            print(f"removed {path} of a previous number of shards")
+        except FileNotFoundError:
+            # removed by another shard
+            pass
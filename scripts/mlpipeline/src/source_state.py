@@ -0,0 +1,113 @@
+"""
+Summary:
+This module keeps track of the documentation source the published index was built from, so a run whose source did
+not change can be skipped.
+
+The gitpull stage describes the source it pulled (git URL, branch, folder, commit and the git tree id of the folder)
+in `source.json` of its `source_status` output, and adds an `unchanged` marker file when it matches the source of the
+last published index. Every step exits right away when the marker is present. step9 copies `source.json` to
+`indexed_source.json` in the persistent `source_state` folder once the index has been published.
+
+Key functionalities:
+- **Source Description**: `read_source` / `write_source` for the JSON files.
+- **Comparison**: `same_source` tells whether the folder tree (or, before any fetch, the commit) is the indexed one.
+- **Changed Files**: `write_changed_files` lists the files changed since the indexed commit (`changed_files.tsv`).
+- **Recording**: `record_indexed_source` marks the current source as indexed, after a successful publish only.
+"""
+
+import json
+import os
+import shutil
+
+SOURCE_FILENAME = "source.json"
+INDEXED_SOURCE_FILENAME = "indexed_source.json"
+CHANGED_FILES_FILENAME = "changed_files.tsv"
+UNCHANGED_MARKER = "unchanged"
+
+
+def read_source(file_path: str):
+    """
+    Function to read a source description.
+
+    Args:
+    file_path (str): Path of a `source.json` / `indexed_source.json` file.
+
+    Returns:
+    dict | None: The source description, or None if the file does not exist.
+    """
+    if not os.path.exists(file_path):
+        return None
+    with open(file_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_source(file_path: str, source: dict):
+    """Function to write a source description"""
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "w", encoding="utf-8") as f:
+        json.dump(source, f, indent=2, sort_keys=True)
+
+
+def write_changed_files(file_path: str, changes: list):
+    """
+    Function to write the changed files of the source, one `<status>\t<path>` line per file.
+
+    Args:
+    file_path (str): Path of the `changed_files.tsv` file.
+    changes (list): `(status, path)` pairs, status being "A", "M" or "D".
+    """
+    with open(file_path, "w", encoding="utf-8") as f:
+        for status, path in changes:
+            f.write(f"{status}\t{path}\n")
+    counts = {
+        status: sum(1 for change in changes if change[0] == status)
+        for status in ("A", "M", "D")
+    }
+    print(
+        f"{len(changes)} changed files since the indexed commit "
+        f"(added={counts['A']} modified={counts['M']} deleted={counts['D']})"
+    )
+
+
+def same_source(source: dict, indexed: dict, key: str) -> bool:
+    """
+    Function to compare a source with the indexed one.
+
+    Args:
+    source (dict): The source of this run.
+    indexed (dict): The indexed source, or None.
+    key (str): "commit" (nothing changed in the repository) or "tree" (nothing changed in the folder).
+
+    Returns:
+    bool: True if both come from the same repository, branch and folder and have the same key.
+    """
+    return (
+        indexed is not None
+        and all(
+            source.get(name) == indexed.get(name)
+            for name in ("git_url", "branch", "folder")
+        )
+        and source.get(key) is not None
+        and source.get(key) == indexed.get(key)
+    )
+
+
+def record_indexed_source(status_dir: str, state_dir: str):
+    """
+    Function to record the source of this run as indexed.
+
+    Args:
+    status_dir (str): The `source_status` output of the gitpull stage.
+    state_dir (str): The persistent state folder.
+    """
+    status_path = os.path.join(status_dir, SOURCE_FILENAME)
+    if not os.path.exists(status_path):
+        print(f"No {SOURCE_FILENAME} in {status_dir}, nothing to record.")
+        return
+    os.makedirs(state_dir, exist_ok=True)
+    state_path = os.path.join(state_dir, INDEXED_SOURCE_FILENAME)
+    shutil.copyfile(status_path, state_path + ".tmp")
+    os.replace(state_path + ".tmp", state_path)
+    print(
+        f"Recorded the indexed source in {state_path}: {read_source(state_path)}"
+    )
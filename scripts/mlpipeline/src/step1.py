@@ -12,13 +12,45 @@ Key functionalities:
 - Summarizing Markdown files using an AI model.
 - Copying files to a new folder with additional information (file name, summary).
 - Removing specific text from the file content during copying.
+- Optional asyncio mode (`--concurrency` > 1) that keeps several chat completions in flight,
+  throttled by a tokens-per-minute / requests-per-minute token bucket (`--tpm`, `--rpm`),
+  and writes each output file as soon as its summary completes.
+- Requests go through the shared `llm_client.LLMClient` (connection reuse, retries honoring Retry-After,
+  per-call timeouts); the step fails when more than `--max_failure_rate` of the requests failed.
+- Sharding: `--shard_index` / `--num_shards` (or the rank of a multi-node job) restricts the step to the documents
+  of one shard (`sharding`), so the step can run on several nodes writing to the same output folder.
+- Batch mode: with `--batch_mode True`, the summaries of the selected files are requested with one job of the
+  Azure OpenAI Batch API first (`batch_api`), which resumes a running job after an interruption.
+- Backends: `--llm_backend openai --llm_base_url URL` sends the requests to an OpenAI-compatible server (e.g.
+  llama.cpp or vLLM on the cluster) and `--llm_backend stub` answers them locally (`llm_backends`).
+- Incremental runs: the output folder is persistent and keeps a `manifest.Manifest`, so only new or modified
+  files are summarized again and the outputs of deleted files are removed. Files whose summary failed are
+  not recorded and are retried on the next run.
 """
 
 import argparse
+import asyncio
 import os
 import time
 
-from openai import AzureOpenAI
+import tiktoken
+
+from batch_api import BatchRunner, add_batch_arguments
+from llm_client import LLMClient, LLMError, add_llm_arguments
+from manifest import Manifest, content_hash
+from pipeline_stages import (
+    DOCUMENT_SUMMARY_PROMPT,
+    add_document_info,
+    document_messages,
+    remove_text,
+    replace_special_tokens,
+)
+from rate_limiter import RateLimiter
+from sharding import (
+    add_shard_arguments,
+    in_shard,
+    resolve_shard,
+)
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--aoai_resource", type=str)
@@ -26,6 +58,24 @@ parser.add_argument("--aoai_apikey", type=str)
 parser.add_argument("--aoai_model", type=str)
 parser.add_argument("--step1_input", type=str)
 parser.add_argument("--step1_output", type=str)
+parser.add_argument(
+    "--concurrency",
+    type=int,
+    default=1,
+    help="number of chat completions kept in flight (1 = sequential)",
+)
+parser.add_argument(
+    "--tpm", type=int, default=0, help="tokens per minute quota (0 = no limit)"
+)
+parser.add_argument(
+    "--rpm",
+    type=int,
+    default=0,
+    help="requests per minute quota (0 = no limit)",
+)
+add_llm_arguments(parser)
+add_batch_arguments(parser)
+add_shard_arguments(parser)
 print("Hello...\nI'm step1 :-)")
 
 args = parser.parse_args()
@@ -33,25 +83,53 @@ arr = os.listdir(args.step1_input)
 print(f"files in input path: {arr}")
 
 
+# completion tokens reserved per request when estimating TPM usage
+COMPLETION_TOKENS_ESTIMATE = 256
+
+encoding = tiktoken.get_encoding("cl100k_base")
+
+# shared client reused by every request of this step
+llm = LLMClient.from_args(args)
+
+
+def estimate_tokens(messages: list) -> int:
+    """Function to estimate the TPM cost (prompt + completion) of a chat request"""
+    prompt_tokens = sum(
+        len(encoding.encode(message["content"], disallowed_special=()))
+        for message in messages
+    )
+    return prompt_tokens + COMPLETION_TOKENS_ESTIMATE
+
+
 def summarize_content(system_prompt_msg: str, md_content: str) -> str:
     try:
-        client = AzureOpenAI(
-            azure_endpoint=f"https://{args.aoai_resource}.openai.azure.com/",
-            api_key=args.aoai_apikey,
-            api_version="2024-02-01",
-        )
-        response = client.chat.completions.create(
-            model=args.aoai_model,
-            messages=[
-                {"role": "system", "content": system_prompt_msg},
-                {
-                    "role": "user",
-                    "content": f"Summarize the following Markdown data: {md_content}",
-                },
-            ],
+        return llm.complete(document_messages(system_prompt_msg, md_content))
+    except LLMError as e:
+        print(f"summarization failed: {e}")
+        return ""
+
+
+async def summarize_content_async(
+    limiter: RateLimiter, system_prompt_msg: str, md_content: str
+) -> str:
+    """
+    Function to summarize md_content with the async client once the rate limiter admits the request.
+
+    Args:
+    limiter (RateLimiter): TPM / RPM limiter shared by all in-flight requests.
+    system_prompt_msg (str): System prompt message.
+    md_content (str): Content of the Markdown file.
+
+    Returns:
+    str: The summary, or "" if the request failed.
+    """
+    messages = document_messages(system_prompt_msg, md_content)
+    try:
+        return await llm.acomplete(
+            messages, limiter=limiter, token_count=estimate_tokens(messages)
         )
-        return response.choices[0].message.content
-    except Exception as e:
+    except LLMError as e:
+        print(f"summarization failed: {e}")
         return ""
 
 
@@ -72,32 +150,79 @@ def extract_md_files(src_folder: str) -> list:
     return md_files
 
 
-def remove_text(content: str, text_to_remove: str) -> str:
+def document_hash(
+    content: str, text_to_remove: str, system_prompt_msg: str
+) -> str:
+    """function to hash everything the output of a md file depends on"""
+    # text_to_remove is the input mount path, which changes with every AML job:
+    # hash the content it leaves in the output instead of the path itself
+    written = replace_special_tokens(remove_text(content, text_to_remove))
+    return content_hash(content, written, system_prompt_msg)
+
+
+def select_changed_files(
+    md_files: list,
+    manifest: Manifest,
+    text_to_remove: str,
+    system_prompt_msg: str,
+) -> list:
     """
-    function to delete specified text from content string
+    function to keep the md files which are new or modified since the run recorded in manifest
 
     Parameters
     -----
-    - content: str
-        - targeted process string
+    - md_files: list
+        - targeted md files list
+    - manifest: Manifest
+        - manifest of the output folder
     - text_to_remove: str
         - string to delete
+    - system_prompt_msg: str
     """
-    return content.replace(text_to_remove, "")
+    changed = list()
+    for file in md_files:
+        with open(file, "r", encoding="utf-8") as f:
+            content = f.read()
+        digest = document_hash(content, text_to_remove, system_prompt_msg)
+        if not manifest.is_current(os.path.basename(file), digest):
+            changed.append(file)
+    print(f"{len(changed)} of {len(md_files)} md files are new or modified")
+    return changed
 
 
-def replace_special_tokens(text):
-    """Function to replace special token with empty String"""
-    special_tokens = {
-        "<|endofprompt|>",
-        "<|endoftext|>",
-        "<|fim_prefix|>",
-        "<|fim_suffix|>",
-        "<|fim_middle|>",
-    }
-    for token in special_tokens:
-        text = text.replace(token, "")  # 特殊トークンを空文字列に置き換える
-    return text
+def record_md_file(
+    manifest: Manifest,
+    file: str,
+    content: str,
+    summary: str,
+    text_to_remove: str,
+    system_prompt_msg: str,
+):
+    """
+    function to record a written md file in manifest, unless its summarization failed
+
+    Parameters
+    -----
+    - manifest: Manifest
+        - manifest of the output folder, or None
+    - file: str
+        - source md file path
+    - content: str
+        - content of the source md file
+    - summary: str
+        - summary of the content ("" if the request failed)
+    - text_to_remove: str
+        - string to delete
+    - system_prompt_msg: str
+    """
+    if manifest is None or not summary:
+        return
+    name = os.path.basename(file)
+    manifest.record(
+        name,
+        document_hash(content, text_to_remove, system_prompt_msg),
+        [name],
+    )
 
 
 def copy_md_files_with_info(
@@ -105,6 +230,7 @@ def copy_md_files_with_info(
     dst_folder: str,
     text_to_remove: str,
     system_prompt_msg: str,
+    manifest: Manifest = None,
 ):
     """
     function to delete specified string and add folder/file name info at header of md file, after copying md_files to dst_folder
@@ -116,25 +242,105 @@ def copy_md_files_with_info(
     - dst_folder: str
     - text_to_remove: str
         - string to delete
+    - system_prompt_msg: str
+    - manifest: Manifest
+        - optional manifest recording the written files
     """
     for file in md_files:
         with open(file, "r", encoding="utf-8") as f:
             content = f.read()
 
         print(f"==========summarizing {file}============")
-        path_info = f"PATH: {os.path.basename(file)}\n"
-        summarize_info = (
-            f"SUMMARIZE: {summarize_content(system_prompt_msg, content)}\n"
+        summary = summarize_content(system_prompt_msg, content)
+        write_md_file_with_info(
+            file, content, summary, dst_folder, text_to_remove
         )
-        new_content = path_info + summarize_info + content
-        new_content = remove_text(new_content, text_to_remove)
+        record_md_file(
+            manifest, file, content, summary, text_to_remove, system_prompt_msg
+        )
+
+
+def write_md_file_with_info(
+    file: str, content: str, summary: str, dst_folder: str, text_to_remove: str
+):
+    """
+    function to write content to dst_folder with file name and summary info added at its header
+
+    Parameters
+    -----
+    - file: str
+        - source md file path
+    - content: str
+        - content of the source md file
+    - summary: str
+        - summary of the content
+    - dst_folder: str
+    - text_to_remove: str
+        - string to delete
+    """
+    new_content = add_document_info(file, content, summary, text_to_remove)
 
-        # !delete special tokens
-        new_content = replace_special_tokens(new_content)
+    new_file_path = os.path.join(dst_folder, os.path.basename(file))
+    with open(new_file_path, "w", encoding="utf-8") as f:
+        f.write(new_content)
 
-        new_file_path = os.path.join(dst_folder, os.path.basename(file))
-        with open(new_file_path, "w", encoding="utf-8") as f:
-            f.write(new_content)
+
+async def copy_md_files_with_info_async(
+    md_files: list,
+    dst_folder: str,
+    text_to_remove: str,
+    system_prompt_msg: str,
+    concurrency: int,
+    tpm: int = 0,
+    rpm: int = 0,
+    manifest: Manifest = None,
+):
+    """
+    asyncio version of copy_md_files_with_info which keeps up to `concurrency` summaries in flight
+    and writes each file as soon as its summary completes.
+
+    Parameters
+    -----
+    - md_files: list
+        - targeted md files list
+    - dst_folder: str
+    - text_to_remove: str
+        - string to delete
+    - system_prompt_msg: str
+    - concurrency: int
+        - maximum number of chat completions in flight
+    - tpm: int
+        - tokens per minute quota (0 = no limit)
+    - rpm: int
+        - requests per minute quota (0 = no limit)
+    - manifest: Manifest
+        - optional manifest recording the written files
+    """
+    limiter = RateLimiter(tokens_per_minute=tpm, requests_per_minute=rpm)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def summarize_file(file: str):
+        async with semaphore:
+            with open(file, "r", encoding="utf-8") as f:
+                content = f.read()
+            summary = await summarize_content_async(
+                limiter, system_prompt_msg, content
+            )
+        return file, content, summary
+
+    tasks = [asyncio.create_task(summarize_file(file)) for file in md_files]
+    for done, future in enumerate(asyncio.as_completed(tasks), start=1):
+        file, content, summary = await future
+        write_md_file_with_info(
+            file, content, summary, dst_folder, text_to_remove
+        )
+        record_md_file(
+            manifest, file, content, summary, text_to_remove, system_prompt_msg
+        )
+        print(
+            f"==========summarized {file} ({done}/{len(md_files)})============"
+        )
+    await llm.aclose()
 
 
 if __name__ == "__main__":
@@ -146,25 +352,61 @@ if __name__ == "__main__":
     # extract parent directory name
     text_to_remove = os.path.dirname(args.step1_input)
 
-    # Set system prompt message
-    system_prompt_msg = """
-    You are an AI assistant designed to summarize the content of Markdown files.
-    Your task is to provide a concise summary of the provided Markdown file content in a way that is understandable to beginners, within 300 characters.
-    Extract the key points and ensure that the overall summary conveys the main idea.
-
-    ### Instructions:
-    1. Clearly state the subject and purpose of the file.
-    2. Concisely explain the main features or functionalities.
-    3. Include troubleshooting points and important considerations for the user.
-    4. Mention important links or references if necessary.
-    """
+    system_prompt_msg = DOCUMENT_SUMMARY_PROMPT
 
-    md_files = extract_md_files(src_folder)
-    copy_md_files_with_info(
-        md_files, dst_folder, text_to_remove, system_prompt_msg
+    # only the documents of this shard
+    shard = resolve_shard(args)
+    md_files = [
+        file
+        for file in extract_md_files(src_folder)
+        if in_shard(os.path.splitext(os.path.basename(file))[0], shard)
+    ]
+    print(f"shard {shard[0]} of {shard[1]}: {len(md_files)} md files")
+
+    # only new or modified files are summarized, the others keep their output
+    manifest = Manifest(
+        dst_folder,
+        shard,
+        lambda name: os.path.splitext(name)[0],
+    )
+    md_files = select_changed_files(
+        md_files,
+        manifest,
+        text_to_remove,
+        system_prompt_msg,
     )
+    batch = BatchRunner.from_args(args, llm)
+    if batch is not None:
+        requests = []
+        for file in md_files:
+            with open(file, "r", encoding="utf-8") as f:
+                requests.append(
+                    (document_messages(system_prompt_msg, f.read()), {})
+                )
+        batch.prefetch(requests)
+    if args.concurrency > 1:
+        asyncio.run(
+            copy_md_files_with_info_async(
+                md_files,
+                dst_folder,
+                text_to_remove,
+                system_prompt_msg,
+                args.concurrency,
+                args.tpm,
+                args.rpm,
+                manifest,
+            )
+        )
+    else:
+        copy_md_files_with_info(
+            md_files, dst_folder, text_to_remove, system_prompt_msg, manifest
+        )
+    manifest.remove_stale()
+    manifest.save()
     print(
         "Markdown files copied, folder/file info added, and specified text removed successfully."
     )
+    llm.close()
+    llm.report_and_check(args.max_failure_rate)
     end = time.perf_counter()
     print(f"End: {end - start:.3f} s.")
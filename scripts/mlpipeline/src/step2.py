@@ -3,28 +3,39 @@ Summary:
 This script processes Markdown (.md) files from a specified input folder, splits the content into sections with a token limit,
 and extracts summaries from the Markdown files. The processed sections are saved as individual files, and summaries are extracted and saved into a CSV file.
 
+Each document is read and split once: the `SUMMARIZE` / `PATH` header written by step1 is collected for the CSV and
+removed from the sections in the same pass, so no second split stage or read-back scan of the output is needed.
+
 The script is controlled by command-line arguments that specify the input and output directories.
 
 Key functionalities:
-- Splitting Markdown files into sections, ensuring each section has no more than 512 tokens.
-- Saving each section as a separate file in the output directory.
-- Extracting summaries and saving them in a CSV file, including file path information.
+- Splitting Markdown files into sections, ensuring each section has no more than 512 tokens
+  (`md_splitter.split_markdown`, which tokenizes each document once and ignores `#` lines inside code and HTML blocks).
+- Removing the metadata lines ("SUMMARIZE" and "# PATH:") from the sections; sections left empty are not written.
+- Saving each section as a separate file (`<source>_part_<n>.md`) in the output directory.
+- Saving the summary and path information of every document in a CSV file (`analysis_output/summaries.csv`).
+- Incremental runs: the output folder is persistent and keeps a `manifest.Manifest` with the sections and the summary
+  row of every document. Only new or modified documents are split again; the sections of deleted documents are removed.
 
 Command-line Arguments:
 - --step2_input: The input folder containing Markdown files.
 - --step2_output: The output folder to save processed files and summaries.
+- --workers: Number of processes used to split the files (0: one per core, 1: serial). The output does not depend on it.
 """
 
 import argparse
 import csv
+import functools
 import os
-import re
 
-import tiktoken
+from manifest import Manifest, content_hash
+from pipeline_stages import section_file_name, split_document
+from worker_pool import add_worker_argument, map_files
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--step2_input", type=str)
 parser.add_argument("--step2_output", type=str)
+add_worker_argument(parser)
 print("Hello...\nI'm step2 :-)")
 
 args = parser.parse_args()
@@ -32,101 +43,21 @@ arr = os.listdir(args.step2_input)
 print(f"files in input path: {arr}")
 
 
-def count_tokens(text):
-    """
-    Function to count the number of tokens in a text.
-    Uses the tiktoken library to count tokens.
-
-    Args:
-    text (str): The text to count tokens in.
-
-    Returns:
-    int: The number of tokens.
-    """
-    encoding = tiktoken.get_encoding("cl100k_base")
-    tokens = encoding.encode(text, disallowed_special=())
-    return len(tokens)
-
-
-def split_section(section, delimiter):
-    """
-    Function to split a section by a specified delimiter.
-
-    Args:
-    section (str): The section to split.
-    delimiter (str): The delimiter (e.g., '#', '##', '###').
-
-    Returns:
-    list: A list of split sections.
-    """
-    return re.split(rf"(?m)^{delimiter} ", section)
-
-
-def process_sections(sections, max_tokens=512):
-    """
-    Function to split sections so that each section contains no more than 512 tokens.
-
-    Args:
-    sections (list): A list of split sections.
-    max_tokens (int): The maximum number of tokens.
-
-    Returns:
-    list: A list of sections that meet the token count requirement.
-    """
-    processed_sections = []
-    for section in sections:
-        if count_tokens(section) <= max_tokens:
-            # If the section is within 512 tokens, add it directly
-            processed_sections.append(section)
-        else:
-            # First try to split by `##`
-            sub_sections = split_section(section, "##")
-            if all(count_tokens(sub) <= max_tokens for sub in sub_sections):
-                processed_sections.extend(sub_sections)
-            else:
-                # If still not within limit, try splitting by `###`
-                sub_sub_sections = []
-                for sub_section in sub_sections:
-                    if count_tokens(sub_section) <= max_tokens:
-                        sub_sub_sections.append(sub_section)
-                    else:
-                        deeper_sub_sections = split_section(sub_section, "###")
-                        if all(
-                            count_tokens(deep) <= max_tokens
-                            for deep in deeper_sub_sections
-                        ):
-                            sub_sub_sections.extend(deeper_sub_sections)
-                        else:
-                            # If still not within limit, add it as is
-                            sub_sub_sections.append(sub_section)
-                processed_sections.extend(sub_sub_sections)
-    return processed_sections
-
-
 def split_markdown_file(file_path, max_tokens=512):
     """
-    Function to read a Markdown file, split it into sections, and ensure each section has no more than 512 tokens.
+    Function to read a Markdown file, split it into sections of no more than 512 tokens and extract its SUMMARIZE statement.
 
     Args:
     file_path (str): The path to the Markdown file to read.
     max_tokens (int): The maximum number of tokens.
 
     Returns:
-    list: A list of split sections.
+    tuple: (list of sections without SUMMARIZE / # PATH: lines, PATH information, summary or None).
     """
     with open(file_path, "r", encoding="utf-8") as file:
         content = file.read()
-
-    # Split by the top-level header
-    sections = split_section(content, "#")
-
-    # Add the delimiter back to each section
-    sections = ["# " + section for section in sections]
-
-    # Process each section to meet the token count requirement
-    processed_sections = process_sections(sections, max_tokens)
-
-    return processed_sections
+    # Split by the top-level header, then by `##` / `###` to meet the token count requirement
+    return split_document(content, max_tokens)
 
 
 def save_sections(sections, output_dir, base_filename):
@@ -142,74 +73,106 @@ def save_sections(sections, output_dir, base_filename):
         os.makedirs(output_dir)
 
     for idx, section in enumerate(sections):
-        section_filename = f"{base_filename}_part_{idx+1}.md"
+        section_filename = section_file_name(base_filename, idx)
         section_path = os.path.join(output_dir, section_filename)
         with open(section_path, "w", encoding="utf-8") as section_file:
             section_file.write(section)
 
 
-def extract_summaries(output_dir, csv_filename):
+def write_summaries_csv(summaries, csv_filename):
     """
-    Function to extract SUMMARIZE statements from split Markdown files and save them to a CSV.
+    Function to save the SUMMARIZE statements collected while splitting to a CSV.
 
     Args:
-    output_dir (str): The directory where the split Markdown files are saved.
+    summaries (list): A list of [filename, PATH, summary] rows.
     csv_filename (str): The name of the CSV file to save the summaries.
     """
-    summaries = []
-
-    for root, _, files in os.walk(output_dir):
-        for file in files:
-            if file.endswith(".md"):
-                file_path = os.path.join(root, file)
-                with open(file_path, "r", encoding="utf-8") as f:
-                    content = f.read()
-                    # Extract PATH information
-                    path_match = re.search(
-                        r"^# PATH: (.*)$", content, re.MULTILINE
-                    )
-                    path_info = (
-                        path_match.group(1).strip()
-                        if path_match
-                        else "No PATH info"
-                    )
-
-                    # Extract SUMMARIZE statement
-                    summary_match = re.search(
-                        r"^SUMMARIZE: (.*)$", content, re.MULTILINE
-                    )
-                    if summary_match:
-                        summary = summary_match.group(1).strip()
-                        base_filename = re.sub(r"_part_\d+\.md$", "", file)
-                        summaries.append([base_filename, path_info, summary])
-
     with open(csv_filename, "w", newline="", encoding="utf-8") as csvfile:
         writer = csv.writer(csvfile)
         writer.writerow(["Filename", "PATH", "Summary"])
         writer.writerows(summaries)
 
 
+def document_hash(file_path, max_tokens=512):
+    """Function to hash the content of a Markdown file together with the split limit"""
+    with open(file_path, "r", encoding="utf-8") as file:
+        return content_hash(file.read(), str(max_tokens))
+
+
 def process_markdown_folder(
-    src_folder, dst_folder, csv_filename, max_tokens=512
+    src_folder,
+    dst_folder,
+    csv_filename,
+    max_tokens=512,
+    workers=1,
+    manifest=None,
 ):
     """
-    Function to process each Markdown file in the source folder, split and save them, and extract SUMMARIZE statements to a CSV.
+    Function to process each Markdown file in the source folder, split and save them, and save their SUMMARIZE statements to a CSV.
 
     Args:
     src_folder (str): The path to the source folder containing Markdown files.
     dst_folder (str): The path to the destination folder to save split files.
     csv_filename (str): The name of the CSV file to save the summaries.
     max_tokens (int): The maximum number of tokens.
+    workers (int): Number of worker processes used to split the files.
+    manifest (Manifest): Optional manifest of dst_folder; only new or modified files are split and the CSV
+        covers every document recorded in it.
     """
-    for root, _, files in os.walk(src_folder):
-        for file in files:
-            if file.endswith(".md"):
-                file_path = os.path.join(root, file)
-                sections = split_markdown_file(file_path, max_tokens)
-                base_filename = os.path.splitext(file)[0]
-                save_sections(sections, dst_folder, base_filename)
-
-    extract_summaries(dst_folder, csv_filename)
+    file_paths = sorted(
+        os.path.join(root, file)
+        for root, _, files in os.walk(src_folder)
+        for file in files
+        if file.endswith(".md")
+    )
+    digests = {}
+    if manifest is not None:
+        for file_path in file_paths:
+            digest = document_hash(file_path, max_tokens)
+            if not manifest.is_current(os.path.basename(file_path), digest):
+                digests[file_path] = digest
+        print(f"{len(digests)} of {len(file_paths)} files are new or modified")
+        file_paths = list(digests)
+    summaries = []
+    # sections are computed on the workers, files are written here in input order
+    for file_path, (sections, path_info, summary) in zip(
+        file_paths,
+        map_files(
+            functools.partial(split_markdown_file, max_tokens=max_tokens),
+            file_paths,
+            workers,
+        ),
+    ):
+        base_filename = os.path.splitext(os.path.basename(file_path))[0]
+        row = (
+            [base_filename, path_info, summary]
+            if summary is not None
+            else None
+        )
+        if manifest is not None:
+            # the document may now have fewer sections than before
+            manifest.discard(os.path.basename(file_path))
+            manifest.record(
+                os.path.basename(file_path),
+                digests[file_path],
+                [
+                    section_file_name(base_filename, idx)
+                    for idx in range(len(sections))
+                ],
+                summary=row,
+            )
+        save_sections(sections, dst_folder, base_filename)
+        if row is not None:
+            summaries.append(row)
+
+    if manifest is not None:
+        manifest.remove_stale()
+        summaries = [
+            entry["summary"]
+            for _, entry in sorted(manifest.entries.items())
+            if entry.get("summary")
+        ]
+    write_summaries_csv(summaries, csv_filename)
 
 
 if __name__ == "__main__":
@@ -221,5 +184,13 @@ if __name__ == "__main__":
     os.makedirs(analysis_output_folder, exist_ok=True)
 
     csv_filename = f"{analysis_output_folder}/summaries.csv"  # the CSV file to save summaries
-    process_markdown_folder(src_folder, dst_folder, csv_filename)
+    manifest = Manifest(dst_folder)
+    process_markdown_folder(
+        src_folder,
+        dst_folder,
+        csv_filename,
+        workers=args.workers,
+        manifest=manifest,
+    )
+    manifest.save()
     print("Markdown files have been split and summaries have been extracted.")
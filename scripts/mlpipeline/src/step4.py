@@ -5,9 +5,15 @@ It takes as input a CSV file containing existing summaries and paths to original
 
 Key functionalities:
 - **Integration with Azure OpenAI**: It connects to an Azure OpenAI resource to generate new summaries for Markdown content.
-- **CSV Handling**: The script reads summaries and paths from a CSV file and uses them to associate with the corresponding Markdown files.
+- **CSV Handling**: The script reads summaries and paths from a CSV file and joins each section file to the summary of its source document by exact key (`section_index.index_sections`), so every section is processed once.
 - **Markdown File Processing**: It reads each Markdown file, uses the existing summary as a prompt, generates a new summary, and saves it along with the original content.
 - **New File Generation**: The re-summarized content is appended to the original Markdown file and saved as a new file in the output directory.
+- **Shared Client**: Requests go through `llm_client.LLMClient`, which reuses one connection pool, retries throttled requests and fails the step when too many requests fail.
+- **Sharding**: With `--shard_index` / `--num_shards` (or the rank of a multi-node job), only the sections of the documents of one shard are processed (`sharding`).
+- **Incremental Runs**: The output folder is persistent and keeps a `manifest.Manifest`. A section is only re-summarized when its content, the summary of its document or the prompt changed; outputs of deleted sections are removed and sections whose request failed are retried on the next run.
+- **Batch API**: With `--batch_mode True`, the requests are sent as one job of the Azure OpenAI Batch API before the sections are processed (`batch_api`); an interrupted job is resumed on the next run.
+- **Local Summaries**: With `--extractive_max_tokens` / `--extractive_min_prose`, small sections and sections with little prose (tables, link lists) are summarized by their heading and lead sentence on the CPU instead of by a request (`extractive_summary`).
+- **Batched Requests**: With `--batch_sections N` (N > 1), up to N sections of the same document (at most `--batch_max_tokens` tokens of content) are re-summarized by one request answering in JSON (`section_batches`). Sections missing from a response or with an invalid answer fall back to a single-section request.
 
 Command-line Arguments:
 - --aoai_resource: The Azure OpenAI resource name.
@@ -16,6 +22,12 @@ Command-line Arguments:
 - --step2_output: The output folder from Step 2, containing the CSV file with summaries.
 - --step4_input: The input folder containing Markdown files to process.
 - --step4_output: The folder where processed Markdown files will be saved.
+- --max_retries / --request_timeout / --max_failure_rate: Retry, timeout and failure threshold settings of the shared client.
+- --llm_backend / --llm_base_url: Backend of the requests: Azure OpenAI, an OpenAI-compatible server or a stub (`llm_backends`).
+- --batch_sections: Sections of one document re-summarized per request (1: one request per section).
+- --batch_max_tokens: Token budget of the section contents of a batched request.
+- --extractive_max_tokens / --extractive_min_prose: Thresholds of the sections summarized locally (`extractive_summary`).
+- --batch_mode / --batch_dir / --batch_poll_seconds / --batch_base_url / --batch_api_version: Batch API settings (`batch_api`).
 
 Azure OpenAI API is used to ensure that each file receives a concise, single-sentence summary in English.
 """
@@ -25,7 +37,31 @@ import csv
 import glob
 import os
 
-from openai import AzureOpenAI
+from batch_api import BatchRunner, add_batch_arguments
+from extractive_summary import ExtractiveSummarizer, add_extractive_arguments
+from llm_client import LLMClient, LLMError, add_llm_arguments
+from manifest import Manifest, content_hash
+from pipeline_stages import (
+    RESUMMARY_PARAMS,
+    SECTION_SUMMARY_PROMPT,
+    count_tokens,
+    resummary_messages,
+    section_output,
+    summarized_file_name,
+)
+from section_batches import (
+    BATCH_SECTION_SUMMARY_PROMPT,
+    batch_params,
+    batch_resummary_messages,
+    pack_batches,
+    parse_batch_summaries,
+)
+from section_index import index_sections, section_source_key
+from sharding import (
+    add_shard_arguments,
+    in_shard,
+    resolve_shard,
+)
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--aoai_resource", type=str)
@@ -34,16 +70,35 @@ parser.add_argument("--aoai_model", type=str)
 parser.add_argument("--step2_output", type=str)
 parser.add_argument("--step4_input", type=str)
 parser.add_argument("--step4_output", type=str)
+parser.add_argument(
+    "--batch_sections",
+    type=int,
+    default=1,
+    help="sections of one document re-summarized per request (1 = one request per section)",
+)
+parser.add_argument(
+    "--batch_max_tokens",
+    type=int,
+    default=2048,
+    help="token budget of the section contents of a batched request",
+)
+add_llm_arguments(parser)
+add_extractive_arguments(parser)
+add_batch_arguments(parser)
+add_shard_arguments(parser)
 print("Hello...\nI'm step4 :-)")
 
 args = parser.parse_args()
 arr = os.listdir(args.step4_input)
 print(f"files in input path: {arr}")
 
+# shared client reused by every request of this step
+llm = LLMClient.from_args(args)
+
 
 def summarize_content(
     system_prompt_msg: str, md_content: str, summary: str
-) -> str:
+) -> tuple:
     """
     Function to re-summarize the content of a Markdown file using Azure OpenAI.
 
@@ -53,33 +108,83 @@ def summarize_content(
     summary (str): Summary of the original document from which md_content was extracted.
 
     Returns:
-    str: The re-summarized content.
+    tuple: (re-summarized content, True), or (summary, False) if the request failed.
     """
     try:
-        client = AzureOpenAI(
-            azure_endpoint=f"https://{args.aoai_resource}.openai.azure.com/",
-            api_key=args.aoai_apikey,
-            api_version="2024-02-01",
+        return (
+            llm.complete(
+                resummary_messages(system_prompt_msg, md_content, summary),
+                **RESUMMARY_PARAMS,
+            ),
+            True,
         )
+    except LLMError as e:
+        print(f"re-summarization failed, keeping original summary: {e}")
+        return summary, False
+
 
-        user_msg = f"""
-        // Original Summary: {summary}
+def section_request(
+    system_prompt_msg: str, md_contents: list, summary: str
+) -> tuple:
+    """
+    Function to build the request re-summarizing one or several sections of one document.
 
-        // Provided Markdown Content: {md_content}
-        """
+    Args:
+    system_prompt_msg (str): System prompt message of a single-section request.
+    md_contents (list): Contents of the sections.
+    summary (str): Summary of the original document from which the sections were extracted.
 
-        response = client.chat.completions.create(
-            model=args.aoai_model,
-            messages=[
-                {"role": "system", "content": system_prompt_msg},
-                {"role": "user", "content": user_msg},
-            ],
-            temperature=0,
-            max_tokens=100,
+    Returns:
+    tuple: (messages, decoding parameters).
+    """
+    if len(md_contents) == 1:
+        return (
+            resummary_messages(system_prompt_msg, md_contents[0], summary),
+            RESUMMARY_PARAMS,
         )
-        return response.choices[0].message.content
-    except Exception as e:
-        return summary
+    return (
+        batch_resummary_messages(
+            BATCH_SECTION_SUMMARY_PROMPT, md_contents, summary
+        ),
+        batch_params(len(md_contents)),
+    )
+
+
+def summarize_batch(
+    system_prompt_msg: str, md_contents: list, summary: str
+) -> list:
+    """
+    Function to re-summarize several sections of one document, with one request if there are more than one.
+
+    Args:
+    system_prompt_msg (str): System prompt message of a single-section request.
+    md_contents (list): Contents of the sections.
+    summary (str): Summary of the original document from which the sections were extracted.
+
+    Returns:
+    list: (re-summarized content, False if its request failed) per section.
+    """
+    if len(md_contents) == 1:
+        return [summarize_content(system_prompt_msg, md_contents[0], summary)]
+
+    messages, params = section_request(system_prompt_msg, md_contents, summary)
+    try:
+        summaries = parse_batch_summaries(
+            llm.complete(messages, **params), len(md_contents)
+        )
+    except LLMError as e:
+        print(f"batched re-summarization failed: {e}")
+        summaries = [None] * len(md_contents)
+    results = []
+    for md_content, section_summary in zip(md_contents, summaries):
+        if section_summary is None:
+            # no valid answer for this section: ask for it alone
+            results += summarize_batch(
+                system_prompt_msg, [md_content], summary
+            )
+        else:
+            results.append((section_summary, True))
+    return results
 
 
 def read_summaries_csv(csv_file: str) -> dict:
@@ -104,7 +209,16 @@ def read_summaries_csv(csv_file: str) -> dict:
 
 
 def process_md_files_with_summaries(
-    src_folder: str, summaries: dict, dst_folder: str, system_prompt_msg: str
+    src_folder: str,
+    summaries: dict,
+    dst_folder: str,
+    system_prompt_msg: str,
+    manifest: Manifest = None,
+    shard: tuple = (0, 1),
+    batch_sections: int = 1,
+    batch_max_tokens: int = 2048,
+    batch_runner: BatchRunner = None,
+    extractive: ExtractiveSummarizer = None,
 ):
     """
     Function to process Markdown files with summaries and save them as new Markdown files.
@@ -114,35 +228,101 @@ def process_md_files_with_summaries(
     summaries (dict): A dictionary where filenames are keys and summaries are values.
     dst_folder (str): The path of the folder to save the new Markdown files.
     system_prompt_msg (str): System prompt message.
+    manifest (Manifest): Optional manifest of dst_folder; sections recorded with the same hash are skipped.
+    shard (tuple): (shard index, number of shards); only the sections of the documents of this shard are processed.
+    batch_sections (int): Maximum number of sections of one document re-summarized by one request.
+    batch_max_tokens (int): Token budget of the section contents of a batched request.
+    batch_runner (BatchRunner): Optional Batch API runner; the requests are then sent as one batch job first.
+    extractive (ExtractiveSummarizer): Optional local summarizer; the sections it accepts are not sent to the model.
     """
-    for filename, summary in summaries.items():
-        for file_name in os.listdir(src_folder):
-            if (file_name.endswith(".md")) and (filename in file_name):
-                print(f"processing <{file_name}> ・・・")
+    if extractive is None:
+        extractive = ExtractiveSummarizer()
 
-                file_path = os.path.join(src_folder, file_name)
-                with open(file_path, "r", encoding="utf-8") as f:
-                    md_content = f.read()
+    def pending_sections():
+        # one directory listing, exact lookup of each section's source document
+        for file_name, summary in index_sections(
+            src_folder, summaries
+        ).items():
+            if not in_shard(section_source_key(file_name), shard):
+                continue
+            file_path = os.path.join(src_folder, file_name)
+            with open(file_path, "r", encoding="utf-8") as f:
+                md_content = f.read()
 
-                summarized_content = summarize_content(
-                    system_prompt_msg, md_content, summary[1]
-                )
+            digest = content_hash(
+                system_prompt_msg,
+                md_content,
+                summary[0],
+                summary[1],
+                *extractive.hash_parts(),
+            )
+            if manifest is not None and manifest.is_current(file_name, digest):
+                continue
+            yield file_name, md_content, summary, digest
 
-                new_file_path = os.path.join(
-                    dst_folder,
-                    os.path.splitext(file_name)[0] + "_summarized.md",
+    def write_section(item, summarized_content: str, succeeded: bool):
+        file_name, md_content, summary, digest = item
+        new_file_name = summarized_file_name(file_name)
+        new_file_path = os.path.join(dst_folder, new_file_name)
+        # a failed request keeps the original summary: retry it next run
+        if manifest is not None and succeeded:
+            manifest.record(file_name, digest, [new_file_name])
+        with open(new_file_path, "w", encoding="utf-8") as f:
+            f.write(section_output(summarized_content, md_content, summary[0]))
+
+    def model_sections():
+        # trivial sections are summarized here and never reach a request
+        for item in pending_sections():
+            local_summary = extractive.summarize(item[1], item[2][1])
+            if local_summary is None:
+                yield item
+                continue
+            print(f"processing <{item[0]}> locally ・・・")
+            llm.stats.count(local_summaries=1)
+            write_section(item, local_summary, True)
+
+    batches = pack_batches(
+        model_sections(),
+        lambda item: section_source_key(item[0]),
+        lambda item: count_tokens(item[1]),
+        batch_sections,
+        batch_max_tokens,
+    )
+    if batch_runner is not None:
+        batches = list(batches)
+        batch_runner.prefetch(
+            [
+                section_request(
+                    system_prompt_msg,
+                    [item[1] for item in batch],
+                    batch[0][2][1],
                 )
-                with open(new_file_path, "w", encoding="utf-8") as f:
-                    if "# PATH:" in md_content:
-                        f.write(summarized_content + "\n\n" + md_content)
-                    else:
-                        f.write(
-                            summarized_content
-                            + "\n\n"
-                            + f"# PATH: {summary[0]}"
-                            + "\n\n"
-                            + md_content
-                        )
+                for batch in batches
+            ]
+        )
+
+    def answered():
+        stats = llm.stats
+        return stats.requests + stats.cache_hits + stats.batch_hits
+
+    sections = requests = 0
+    for batch in batches:
+        print(f"processing <{', '.join(item[0] for item in batch)}> ・・・")
+        requests_before = answered()
+        results = summarize_batch(
+            system_prompt_msg, [item[1] for item in batch], batch[0][2][1]
+        )
+        sections += len(batch)
+        requests += answered() - requests_before
+
+        for item, (summarized_content, succeeded) in zip(batch, results):
+            write_section(item, summarized_content, succeeded)
+    print(f"Re-summarized {sections} sections with {requests} requests.")
+    if extractive.enabled:
+        print(
+            f"Summarized {llm.stats.local_summaries} sections locally: "
+            f"{llm.stats.local_summaries} LLM calls saved."
+        )
 
 
 if __name__ == "__main__":
@@ -171,14 +351,25 @@ if __name__ == "__main__":
     dst_folder = args.step4_output
     os.makedirs(dst_folder, exist_ok=True)
 
-    system_prompt_msg = """
-    Summarize the content of the provided Markdown file.
-    Based on the Original Summary, explain in English what the provided Markdown is describing.
-    Ensure that the Response is concise and contains only one sentence!
-    """
+    system_prompt_msg = SECTION_SUMMARY_PROMPT
 
     summaries = read_summaries_csv(csv_file)
+    shard = resolve_shard(args)
+    manifest = Manifest(dst_folder, shard, section_source_key)
     process_md_files_with_summaries(
-        src_folder, summaries, dst_folder, system_prompt_msg
+        src_folder,
+        summaries,
+        dst_folder,
+        system_prompt_msg,
+        manifest,
+        shard,
+        args.batch_sections,
+        args.batch_max_tokens,
+        BatchRunner.from_args(args, llm),
+        ExtractiveSummarizer.from_args(args),
     )
+    manifest.remove_stale()
+    manifest.save()
     print("New Markdown files have been generated.")
+    llm.close()
+    llm.report_and_check(args.max_failure_rate)
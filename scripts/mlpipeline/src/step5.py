@@ -6,14 +6,20 @@ The new summaries are appended to the original content, and the processed files
 A temporary folder is used to handle split files, which is deleted after processing.
 
 Key functionalities:
-- **Text Splitting**: If a Markdown file exceeds a token limit (1000 tokens), it is split into smaller chunks based on tokens, preserving code blocks and list items.
-- **Integration with Azure OpenAI**: Similar to `step4.py`, this script uses Azure OpenAI to generate summaries for the Markdown files.
+- **Text Splitting**: If a Markdown file exceeds a token limit (1000 tokens), it is split into chunks of at most 512 tokens with `md_chunker`, which tokenizes each file once and cuts at paragraph, sentence, list item and code block breaks. Chunks are exact substrings of the file and can overlap by `--chunk_overlap` tokens. With `--workers N`, files are chunked on N processes (`worker_pool`).
+- **Integration with Azure OpenAI**: Similar to `step4.py`, this script uses Azure OpenAI (through the shared `llm_client.LLMClient`) to generate summaries for the Markdown files.
 - **Temporary Directory Management**: Temporary files are created for split Markdown files and deleted after processing.
-- **CSV Handling**: The script reads summaries and paths from a CSV file and associates them with the corresponding Markdown files.
+- **CSV Handling**: The script reads summaries and paths from a CSV file and joins each chunk to the summary of its source document by exact key (`section_index.index_sections`).
 - **New File Generation**: The resummarized content is appended to the original Markdown and saved in a new directory. Temporary files are deleted afterward.
+- **Skipping Unused Calls**: Chunks that already contain a `# PATH:` header are written unchanged, so no summary is requested for them; the number of avoided calls is reported.
+- **Local Summaries**: With `--extractive_max_tokens` / `--extractive_min_prose`, small chunks and chunks with little prose (tables, link lists) are summarized by their heading and lead sentence on the CPU instead of by a request (`extractive_summary`); the number of saved calls is reported.
+- **Backends**: With `--llm_backend openai --llm_base_url URL`, the chunks are summarized by an OpenAI-compatible server (e.g. llama.cpp or vLLM on the cluster); `--llm_backend stub` answers locally, to benchmark the step without an external service (`llm_backends`).
+- **Batch API**: With `--batch_mode True`, the chunk summaries are requested with one job of the Azure OpenAI Batch API once the files are chunked (`batch_api`); an interrupted job is resumed on the next run.
+- **Sharding**: With `--shard_index` / `--num_shards` (or the rank of a multi-node job), only the files of the documents of one shard are processed (`sharding`); every shard uses its own temporary folder.
+- **Incremental Runs**: The output folder is persistent and keeps a `manifest.Manifest`. Only files whose content, document summary, overlap or prompt changed are chunked and re-summarized; the chunks of deleted files are removed and files with a failed request are retried on the next run.
 
 Differences from `step4.py`:
-1. **Token Counting and Splitting**: `step5.py` includes functionality to count tokens in the Markdown content and splits the files into smaller parts if they exceed 1000 tokens. This is handled using the `tiktoken` library, which is absent in `step4.py`.
+1. **Token Counting and Splitting**: `step5.py` includes functionality to count tokens in the Markdown content and splits the files into smaller parts if they exceed 1000 tokens. This is handled by `md_chunker` (using the `tiktoken` library), which is absent in `step4.py`.
 2. **Temporary File Handling**: `step5.py` creates and uses a temporary directory (`temp_output_path`) for storing split Markdown files, which is removed after processing. This mechanism is not present in `step4.py`.
 3. **Larger File Processing**: `step5.py` processes larger files that may require splitting, whereas `step4.py` assumes that all files fit within a single API request and handles them as whole documents.
 4. **Cleanup Process**: After processing, `step5.py` deletes temporary files, adding a cleanup step that `step4.py` does not include.
@@ -25,8 +31,27 @@ import glob
 import os
 import shutil
 
-import tiktoken
-from openai import AzureOpenAI
+from batch_api import BatchRunner, add_batch_arguments
+from extractive_summary import ExtractiveSummarizer, add_extractive_arguments
+from llm_client import LLMClient, LLMError, add_llm_arguments
+from manifest import Manifest, content_hash
+from pipeline_stages import (
+    CHUNK_SUMMARY_PROMPT,
+    RESUMMARY_PARAMS,
+    chunk_document,
+    chunk_file_name,
+    chunk_output,
+    resummary_messages,
+    summarized_file_name,
+)
+from section_index import index_sections, section_source_key
+from sharding import (
+    add_shard_arguments,
+    in_shard,
+    resolve_shard,
+    shard_file_name,
+)
+from worker_pool import add_worker_argument, map_files
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--aoai_resource", type=str)
@@ -35,91 +60,20 @@ parser.add_argument("--aoai_model", type=str)
 parser.add_argument("--step2_output", type=str)
 parser.add_argument("--step5_input", type=str)
 parser.add_argument("--step5_output", type=str)
+parser.add_argument("--chunk_overlap", type=int, default=0)
+add_llm_arguments(parser)
+add_extractive_arguments(parser)
+add_batch_arguments(parser)
+add_worker_argument(parser)
+add_shard_arguments(parser)
 print("Hello...\nI'm step5 :-)")
 
 args = parser.parse_args()
 arr = os.listdir(args.step5_input)
 print(f"files in input path: {arr}")
 
-
-def count_tokens(text, encoding_name="cl100k_base"):
-    """Function to count tokens."""
-    encoding = tiktoken.get_encoding(encoding_name)
-    tokens = encoding.encode(text, disallowed_special=())
-    return len(tokens), tokens
-
-
-def split_text_by_tokens(text, max_tokens=512, encoding_name="cl100k_base"):
-    """Function to split text based on token count."""
-    encoding = tiktoken.get_encoding(encoding_name)
-
-    # Split by paragraphs considering code blocks and list items
-    paragraphs = text.split("\n\n")
-    chunks = []
-    current_chunk = ""
-    current_chunk_tokens = 0
-
-    for paragraph in paragraphs:
-        paragraph_tokens = len(
-            encoding.encode(paragraph, disallowed_special=())
-        )
-        # Treat code blocks and list items as one chunk
-        if paragraph.startswith("```") or paragraph.lstrip().startswith(
-            (
-                "-",
-                "*",
-                "+",
-                "1.",
-                "2.",
-                "3.",
-                "4.",
-                "5.",
-                "6.",
-                "7.",
-                "8.",
-                "9.",
-                "0.",
-            )
-        ):
-            if (
-                current_chunk_tokens
-                + paragraph_tokens
-                + len(encoding.encode("\n\n", disallowed_special=()))
-                > max_tokens
-            ):
-                chunks.append(current_chunk.strip())
-                current_chunk = paragraph + "\n\n"
-                current_chunk_tokens = paragraph_tokens + len(
-                    encoding.encode("\n\n", disallowed_special=())
-                )
-            else:
-                current_chunk += paragraph + "\n\n"
-                current_chunk_tokens += paragraph_tokens + len(
-                    encoding.encode("\n\n", disallowed_special=())
-                )
-        else:
-            sentences = paragraph.split(". ")
-            for sentence in sentences:
-                sentence_tokens = len(
-                    encoding.encode(sentence, disallowed_special=())
-                )
-                if current_chunk_tokens + sentence_tokens > max_tokens:
-                    chunks.append(current_chunk.strip())
-                    current_chunk = sentence
-                    current_chunk_tokens = sentence_tokens
-                else:
-                    current_chunk += sentence
-                    current_chunk_tokens += sentence_tokens
-
-            current_chunk += "\n\n"  # Add newline at the end of paragraph
-            current_chunk_tokens += len(
-                encoding.encode("\n\n", disallowed_special=())
-            )
-
-    if current_chunk:
-        chunks.append(current_chunk.strip())
-
-    return chunks
+# shared client reused by every request of this step
+llm = LLMClient.from_args(args)
 
 
 def summarize_content(
@@ -137,99 +91,170 @@ def summarize_content(
     str: Summarized content.
     """
     try:
-        client = AzureOpenAI(
-            azure_endpoint=f"https://{args.aoai_resource}.openai.azure.com/",
-            api_key=args.aoai_apikey,
-            api_version="2024-02-01",
+        return llm.complete(
+            resummary_messages(system_prompt_msg, md_content, summary),
+            **RESUMMARY_PARAMS,
         )
+    except LLMError as e:
+        print(f"re-summarization failed, keeping original summary: {e}")
+        return summary
 
-        user_msg = f"""
-        // Original Summary: {summary}
 
-        // Provided Markdown Content: {md_content}
-        """
+def source_of(filename: str):
+    """Function to get the source document key of a section file, the way index_sections joins chunks to it"""
+    return section_source_key(f"{os.path.splitext(filename)[0]}_part1.md")
 
-        response = client.chat.completions.create(
-            model=args.aoai_model,
-            messages=[
-                {"role": "system", "content": system_prompt_msg},
-                {"role": "user", "content": user_msg},
-            ],
-            temperature=0,
-            max_tokens=100,
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        return summary
+
+def chunk_markdown_file(file_path: str) -> list:
+    """
+    Function to read a Markdown file and chunk it if it exceeds `pipeline_stages.SPLIT_THRESHOLD_TOKENS`.
+
+    Args:
+    file_path (str): The path of the Markdown file.
+
+    Returns:
+    list: The chunks, or an empty list if the file does not need splitting.
+    """
+    with open(file_path, "r", encoding="utf-8") as file:
+        content = file.read()
+    return chunk_document(content, args.chunk_overlap)
 
 
 def process_markdown_files(
-    summaries: dict, folder_path, temp_output_path, resummarize_output_path
+    summaries: dict,
+    folder_path,
+    temp_output_path,
+    resummarize_output_path,
+    workers=1,
+    manifest: Manifest = None,
+    shard: tuple = (0, 1),
+    batch_runner: BatchRunner = None,
+    extractive: ExtractiveSummarizer = None,
 ):
     """Function to process Markdown files in a folder and split if necessary."""
-    for filename in os.listdir(folder_path):
-        if filename.endswith(".md"):
-            file_path = os.path.join(folder_path, filename)
-            with open(file_path, "r", encoding="utf-8") as file:
-                content = file.read()
-                token_count, _ = count_tokens(content)
-
-                if token_count > 1000:
-                    chunks = split_text_by_tokens(content)
-                    base_name, ext = os.path.splitext(filename)
-
-                    for i, chunk in enumerate(chunks):
-                        new_file_path = os.path.join(
-                            temp_output_path, f"{base_name}_part{i+1}{ext}"
-                        )
-                        with open(
-                            new_file_path, "w", encoding="utf-8"
-                        ) as new_file:
-                            new_file.write(chunk)
-                else:
-                    pass
-                    # print(f"{filename} does not need splitting.")
-
-    for filename, summary in summaries.items():
-        # List up md file names in the reading source folder
-        for file_name in os.listdir(temp_output_path):
-            # If each Summary's content is included in the file name,
-            if (file_name.endswith(".md")) and (filename in file_name):
-                print(f"processing <{file_name}> ・・・")
-
-                file_path = os.path.join(temp_output_path, file_name)
-                with open(file_path, "r", encoding="utf-8") as f:
-                    md_content = f.read()
-
-                # Set system prompt message
-                system_prompt_msg = """
-                Summarize the content of the provided Markdown file.
-                Based on the Original Summary, explain in English what the provided Markdown is describing.
-                Ensure that the Response is concise and contains only one sentence!
-                """
-
-                # Summarize
-                summarized_content = summarize_content(
-                    system_prompt_msg, md_content, summary[1]
+    system_prompt_msg = CHUNK_SUMMARY_PROMPT
+    if extractive is None:
+        extractive = ExtractiveSummarizer()
+
+    filenames = sorted(
+        filename
+        for filename in os.listdir(folder_path)
+        if filename.endswith(".md") and in_shard(source_of(filename), shard)
+    )
+    digests = {}
+    if manifest is not None:
+        for filename in filenames:
+            with open(
+                os.path.join(folder_path, filename), "r", encoding="utf-8"
+            ) as f:
+                content = f.read()
+            summary = summaries.get(source_of(filename), ["", ""])
+            digests[filename] = content_hash(
+                content,
+                summary[0],
+                summary[1],
+                str(args.chunk_overlap),
+                system_prompt_msg,
+                *extractive.hash_parts(),
+            )
+        filenames = [
+            filename
+            for filename in filenames
+            if not manifest.is_current(filename, digests[filename])
+        ]
+        print(f"{len(filenames)} of {len(digests)} files are new or modified")
+
+    file_paths = [os.path.join(folder_path, name) for name in filenames]
+    chunk_sources = {}
+    for filename, chunks in zip(
+        filenames, map_files(chunk_markdown_file, file_paths, workers)
+    ):
+        if manifest is not None:
+            # the file may now have fewer chunks than before
+            manifest.discard(filename)
+        base_name = os.path.splitext(filename)[0]
+        for i, chunk in enumerate(chunks):
+            chunk_name = chunk_file_name(base_name, i)
+            chunk_sources[chunk_name] = filename
+            new_file_path = os.path.join(temp_output_path, chunk_name)
+            with open(new_file_path, "w", encoding="utf-8") as new_file:
+                new_file.write(chunk)
+
+    # one directory listing, exact lookup of each chunk's source document
+    chunk_summaries = index_sections(temp_output_path, summaries)
+    if batch_runner is not None:
+        requests = []
+        for file_name, summary in chunk_summaries.items():
+            with open(
+                os.path.join(temp_output_path, file_name),
+                "r",
+                encoding="utf-8",
+            ) as f:
+                md_content = f.read()
+            if (
+                "# PATH:" not in md_content
+                and extractive.summarize(md_content, summary[1]) is None
+            ):
+                requests.append(
+                    (
+                        resummary_messages(
+                            system_prompt_msg, md_content, summary[1]
+                        ),
+                        RESUMMARY_PARAMS,
+                    )
                 )
+        batch_runner.prefetch(requests)
+
+    skipped_calls = 0
+    outputs = {filename: [] for filename in filenames}
+    failed = set()
+    for file_name, summary in chunk_summaries.items():
+        print(f"processing <{file_name}> ・・・")
+
+        file_path = os.path.join(temp_output_path, file_name)
+        with open(file_path, "r", encoding="utf-8") as f:
+            md_content = f.read()
+
+        # Save as a new Markdown file
+        new_file_name = summarized_file_name(file_name)
+        new_file_path = os.path.join(resummarize_output_path, new_file_name)
+        outputs[chunk_sources[file_name]].append(new_file_name)
+
+        # Chunks that already carry a PATH header are written as they are,
+        # so their summary would be discarded: don't request it.
+        if "# PATH:" in md_content:
+            skipped_calls += 1
+            with open(new_file_path, "w", encoding="utf-8") as f:
+                f.write(md_content)
+            continue
+
+        # Summarize, locally if the chunk is trivial
+        summarized_content = extractive.summarize(md_content, summary[1])
+        if summarized_content is not None:
+            llm.stats.count(local_summaries=1)
+        else:
+            failures = llm.stats.failures
+            summarized_content = summarize_content(
+                system_prompt_msg, md_content, summary[1]
+            )
+            if llm.stats.failures != failures:
+                failed.add(chunk_sources[file_name])
 
-                # Save as a new Markdown file
-                new_file_path = os.path.join(
-                    resummarize_output_path,
-                    os.path.splitext(file_name)[0] + "_summarized.md",
-                )
-                with open(new_file_path, "w", encoding="utf-8") as f:
-                    print("# PATH:" in md_content)
-                    if "# PATH:" in md_content:
-                        f.write(md_content)
-                    else:
-                        f.write(
-                            summarized_content
-                            + "\n\n"
-                            + f"# PATH: {summary[0]}"
-                            + "\n\n"
-                            + md_content
-                        )
+        with open(new_file_path, "w", encoding="utf-8") as f:
+            f.write(chunk_output(summarized_content, md_content, summary[0]))
+    print(
+        f"Skipped {skipped_calls} LLM calls for chunks that already have a PATH header."
+    )
+    if extractive.enabled:
+        print(
+            f"Summarized {llm.stats.local_summaries} chunks locally: "
+            f"{llm.stats.local_summaries} LLM calls saved."
+        )
+    if manifest is not None:
+        # a failed request keeps the original summary: retry the file next run
+        for filename in filenames:
+            if filename not in failed:
+                manifest.record(filename, digests[filename], outputs[filename])
     # 処理完了後に temp_output_path を削除
     if os.path.exists(temp_output_path):
         shutil.rmtree(temp_output_path)
@@ -264,8 +289,14 @@ if __name__ == "__main__":
     start_path = args.step2_output
     target_file = "summaries.csv"
     dst_folder = args.step5_output
-    temp_output_path = f"{dst_folder}/temp_5th_processed"
+    shard = resolve_shard(args)
+    # shards share dst_folder: one temporary folder each
+    temp_output_path = (
+        f"{dst_folder}/{shard_file_name('temp_5th_processed', shard)}"
+    )
 
+    # the output folder is persistent: drop chunks left by an interrupted run
+    shutil.rmtree(temp_output_path, ignore_errors=True)
     os.makedirs(temp_output_path, exist_ok=True)
     os.makedirs(dst_folder, exist_ok=True)
 
@@ -289,4 +320,19 @@ if __name__ == "__main__":
 
     # Read summaries and filenames from the CSV file
     summaries = read_summaries_csv(csv_file)
-    process_markdown_files(summaries, src_folder, temp_output_path, dst_folder)
+    manifest = Manifest(dst_folder, shard, source_of)
+    process_markdown_files(
+        summaries,
+        src_folder,
+        temp_output_path,
+        dst_folder,
+        args.workers,
+        manifest,
+        shard,
+        BatchRunner.from_args(args, llm),
+        ExtractiveSummarizer.from_args(args),
+    )
+    manifest.remove_stale()
+    manifest.save()
+    llm.close()
+    llm.report_and_check(args.max_failure_rate)
@@ -11,6 +11,9 @@ Key functionalities:
 
 2. **Azure Blob Storage Integration**:
 - The script connects to an Azure Blob Storage account using the provided connection string and uploads the remaining Markdown files to a specified container.
+- Files are uploaded concurrently on `--max_workers` threads sharing one pooled client (`blob_transfer.upload_files`), with progress in MB/s.
+- With `--skip_upload True`, the upload is left to a separate job (the pipeline publishes `step6_output` with the step9
+  component in parallel with indexing), so step8 can start as soon as the files are filtered.
 - The container is created if it doesn’t exist.
 
 3. **Token Counting**:
@@ -26,9 +29,17 @@ ensuring that only files that meet the token criteria are uploaded to Azure Blob
 import argparse
 import os
 import shutil
-
-import tiktoken
-from azure.storage.blob import BlobServiceClient
+import sys
+
+from blob_transfer import (
+    DEFAULT_MAX_WORKERS,
+    connection_string,
+    create_container_client,
+    ensure_container,
+    list_folder,
+    upload_files,
+)
+from pipeline_stages import MAX_INDEX_TOKENS, MIN_INDEX_TOKENS, count_tokens
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--target_storage_account_input", type=str)
@@ -37,6 +48,8 @@ parser.add_argument("--target_storage_container_input", type=str)
 parser.add_argument("--step6_input", type=str)
 parser.add_argument("--step4_output", type=str)
 parser.add_argument("--step6_output", type=str)
+parser.add_argument("--max_workers", type=int, default=DEFAULT_MAX_WORKERS)
+parser.add_argument("--skip_upload", type=str, default="False")
 print("Hello...\nI'm step6 :-)")
 
 args = parser.parse_args()
@@ -44,13 +57,6 @@ arr = os.listdir(args.step6_input)
 print(f"files in input path: {arr}")
 
 
-def count_tokens(text, encoding_name="cl100k_base"):
-    """Function to count tokens."""
-    encoding = tiktoken.get_encoding(encoding_name)
-    tokens = encoding.encode(text, disallowed_special=())
-    return len(tokens)
-
-
 def copy_files(source_folder, dest_folder):
     """Function to copy Markdown files from source to destination folder."""
     for filename in os.listdir(source_folder):
@@ -73,12 +79,12 @@ def process_markdown_files(past_folder, temp_output_path, dst_folder):
                 content = file.read()
                 token_count = count_tokens(content)
 
-            if token_count > 1000:
+            if token_count > MAX_INDEX_TOKENS:
                 os.remove(file_path)  # Delete files with more than 1000 tokens
                 print(f"Deleted {filename}.")
 
             # Delete files with token count less than 40 as they are likely noise
-            if token_count < 40:
+            if token_count < MIN_INDEX_TOKENS:
                 print(
                     f"{filename} has less than 40 tokens. Deleting the file."
                 )
@@ -89,26 +95,18 @@ def process_markdown_files(past_folder, temp_output_path, dst_folder):
     # copy_files(past_folder, dst_folder)
 
 
-def upload_files_to_blob(storage_account_name, container_name, folder_path):
-    """Function to upload files from a folder to a specific Azure Blob container."""
-    blob_service_client = BlobServiceClient.from_connection_string(
-        AZURE_STORAGE_CONNECTION_STRING
+def upload_files_to_blob(conn_str, container_name, folder_path, max_workers):
+    """Function to upload the Markdown files of a folder to a specific Azure Blob container."""
+    container_client = create_container_client(
+        conn_str, container_name, max_workers
     )
-    container_client = blob_service_client.get_container_client(container_name)
-
     # Create the container if it doesn't exist
-    try:
-        container_client.create_container()
-    except Exception as e:
-        print(f"Container already exists or couldn't be created: {e}")
-
-    for filename in os.listdir(folder_path):
-        if filename.endswith(".md"):
-            file_path = os.path.join(folder_path, filename)
-            blob_client = container_client.get_blob_client(filename)
-            with open(file_path, "rb") as data:
-                blob_client.upload_blob(data, overwrite=True)
-            print(f"Uploaded {filename} to Azure Blob Storage.")
+    ensure_container(container_client)
+    upload_files(
+        container_client,
+        list_folder(folder_path, suffix=".md", recursive=False),
+        max_workers,
+    )
 
 
 if __name__ == "__main__":
@@ -118,9 +116,20 @@ if __name__ == "__main__":
     # NOTE: final result should be in the step4 output dst older
     process_markdown_files(past_folder, src_folder, dst_folder)
 
+    # In the pipeline, step8 reads step6_output directly and a separate job
+    # publishes it, so the upload is off the critical path
+    if args.skip_upload.lower() == "true":
+        print("Skipping the upload to Azure Blob Storage.")
+        sys.exit(0)
+
     # Upload the files to Azure Blob Storage
-    AZURE_STORAGE_CONNECTION_STRING = f"DefaultEndpointsProtocol=https;AccountName={args.target_storage_account_input};AccountKey={args.target_storage_api_key_input}"
+    AZURE_STORAGE_CONNECTION_STRING = connection_string(
+        args.target_storage_account_input, args.target_storage_api_key_input
+    )
     CONTAINER_NAME = f"{args.target_storage_container_input}"
     upload_files_to_blob(
-        AZURE_STORAGE_CONNECTION_STRING, CONTAINER_NAME, dst_folder
+        AZURE_STORAGE_CONNECTION_STRING,
+        CONTAINER_NAME,
+        dst_folder,
+        args.max_workers,
     )
@@ -27,11 +27,10 @@ Key functionalities:
 """
 
 import argparse
-import csv
 import os
 
-import matplotlib.pyplot as plt
-import tiktoken
+from pipeline_stages import count_tokens
+from token_report import plot_boxplot, plot_histogram, save_to_csv
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--step7_input", type=str)
@@ -43,14 +42,6 @@ arr = os.listdir(args.step7_input)
 print(f"files in input path: {arr}")
 
 
-def count_tokens(text, encoding_name="cl100k_base"):
-    """Function to count tokens in the text."""
-    # Logic to count tokens goes here
-    encoding = tiktoken.get_encoding(encoding_name)
-    tokens = encoding.encode(text, disallowed_special=())
-    return len(tokens)
-
-
 def process_markdown_files(folder_path):
     """Process Markdown files in the folder and return token counts as a list."""
     data = []
@@ -70,44 +61,6 @@ def process_markdown_files(folder_path):
     return data
 
 
-def save_to_csv(data, output_csv):
-    """Save token count data to CSV."""
-    # Sort data by token count in descending order
-    sorted_data = sorted(data, key=lambda x: x[1], reverse=True)
-
-    with open(output_csv, "w", newline="", encoding="utf-8") as csvfile:
-        csvwriter = csv.writer(csvfile)
-        csvwriter.writerow(["File Name", "Token Count"])
-        csvwriter.writerows(sorted_data)
-
-
-def plot_histogram(token_counts, hist_output_png):
-    """Plot a histogram of token counts."""
-    min_token = min(token_counts)
-    max_token = max(token_counts)
-    print(min_token, max_token)
-    num_bins = 20  # Set the number of bins
-    plt.figure(figsize=(10, 6))
-    plt.hist(
-        token_counts, bins=num_bins, range=(min_token, 1000), edgecolor="black"
-    )
-    plt.title("Token Count Histogram")
-    plt.xlabel("Token Count")
-    plt.ylabel("Frequency")
-    plt.grid(True)
-    plt.savefig(hist_output_png)
-
-
-def plot_boxplot(token_counts, boxplot_output_png):
-    """Plot a boxplot of token counts."""
-    plt.figure(figsize=(10, 6))
-    plt.boxplot(token_counts, vert=False)
-    plt.title("Token Count Boxplot")
-    plt.xlabel("Token Count")
-    plt.grid(True)
-    plt.savefig(boxplot_output_png)
-
-
 if __name__ == "__main__":
     # ===========================================
     # NOTE: Final Result is "Step6 Output"
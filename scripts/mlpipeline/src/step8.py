@@ -1,33 +1,42 @@
 """
 Summary:
-This script downloads all `.md` (Markdown) files from an Azure Blob Storage container and renames them to `.txt` files.
+This script collects all `.md` (Markdown) files produced by step6 and saves them as `.txt` files, the input of GraphRAG indexing.
+
+With `--step8_input` (the mounted `step6_output` folder), the files are converted from the mount directly into
+`--step8_output` (the GraphRAG input folder) and no blob round-trip or local copy is needed. Without it, the files are downloaded from the Azure Blob Storage container step6 published them to.
 The script connects to the specified Azure Blob Storage account using the provided credentials, retrieves the list of blobs in the specified container,
-and downloads files with the `.md` extension. After downloading, it renames these files to `.txt` format, preparing them for further processing,
-such as indexing by tools like GraphRAG.
+and downloads files with the `.md` extension concurrently (`blob_transfer.download_blobs`), writing them under their `.txt` names directly,
+preparing them for further processing, such as indexing by tools like GraphRAG.
 
 Key functionalities:
 1. **Azure Blob Storage Connection**:
     - The script connects to Azure Blob Storage using the provided account name and API key.
 2. **File Download**:
-    - It lists all blobs in the specified container and downloads those that have the `.md` extension into a local directory.
+    - It lists the blobs in the specified container once (optionally only those under `--name_starts_with`) and downloads those that have the `.md` extension
+      into `--step8_output` on `--max_workers` threads sharing one connection pool. Each blob is streamed to disk instead of being loaded into memory.
 3. **File Renaming**:
-    - Once downloaded, the script renames all `.md` files to `.txt` format, which is suitable for applications like GraphRAG that may require `.txt` inputs.
+    - Files are written as `.txt` right away, which is suitable for applications like GraphRAG that may require `.txt` inputs; no rename pass is needed.
 
 ### Steps:
 1. **Connection to Blob Storage**:
     - The script first establishes a connection to the Azure Blob Storage using `BlobServiceClient` and the provided account information.
 2. **Listing and Downloading `.md` Files**:
-    - It iterates over all blobs in the specified container, downloading any file that ends with `.md` into a local directory (`./test`). The directory is created if it doesn't already exist.
-3. **Renaming Files**:
-    - After downloading, the script renames each `.md` file to a `.txt` file by changing the file extension. This is typically done to support other processing tools that might require `.txt` files instead of `.md`.
+    - It lists the blobs in the specified container and downloads every file that ends with `.md` into `--step8_output`, under its `.txt` name.
+      This is done to support other processing tools that might require `.txt` files instead of `.md`.
 
 ### Usage:
-- The script requires three command-line arguments:
+- `--step8_output`: Folder the `.txt` files are written to (e.g. `<graphrag root>/input`), `./test` by default.
+- `--step8_input`: Folder containing the step6 `.md` files (e.g. the mounted `step6_output`). When given, the storage
+  arguments are not used.
+- Otherwise, the script requires three command-line arguments:
     - `--storage_account_name`: Name of the Azure storage account.
     - `--storage_apikey`: The API key for accessing the storage account.
     - `--storage_container_name`: The name of the container from which the `.md` files are to be downloaded.
+- Optional arguments:
+    - `--name_starts_with`: Only download blobs whose name starts with this prefix.
+    - `--max_workers`: Number of concurrent downloads / copies (default 16).
 
-- After execution, all `.md` files from the specified container will be downloaded and renamed to `.txt`.
+- After execution, all `.md` files from the specified container will be downloaded as `.txt` files.
 
 ### Difference from step7.py and step6.py:
 - **Focus on File Download and Conversion**:
@@ -37,52 +46,89 @@ Key functionalities:
 
 import argparse
 import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 
-from azure.storage.blob import BlobServiceClient
+from blob_transfer import (
+    DEFAULT_MAX_WORKERS,
+    connection_string,
+    create_container_client,
+    download_blobs,
+)
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--storage_account_name", type=str)
 parser.add_argument("--storage_apikey", type=str)
 parser.add_argument("--storage_container_name", type=str)
+parser.add_argument("--step8_input", type=str, default=None)
+parser.add_argument("--step8_output", type=str, default="./test")
+parser.add_argument("--name_starts_with", type=str, default=None)
+parser.add_argument("--max_workers", type=int, default=DEFAULT_MAX_WORKERS)
 print("Hello...\nI'm step8 :-)")
 args = parser.parse_args()
+if not args.step8_input and not args.storage_account_name:
+    parser.error(
+        "either --step8_input or the --storage_* arguments are needed"
+    )
 
-# storage acccount info
-storage_account_connection_string = f"DefaultEndpointsProtocol=https;AccountName={args.storage_account_name};AccountKey={args.storage_apikey};EndpointSuffix=core.windows.net"
-container_name = f"{args.storage_container_name}"
-local_download_path = "./test"
 
-# create BlobServiceClient instance
-blob_service_client = BlobServiceClient.from_connection_string(
-    storage_account_connection_string
-)
-# get container client
-container_client = blob_service_client.get_container_client(container_name)
-# list all blobs in specified containers
-blobs_list = container_client.list_blobs()
-# download blob
-for blob in blobs_list:
-    if blob.name.endswith(".md"):
-        blob_client = container_client.get_blob_client(blob)
-        download_file_path = os.path.join(local_download_path, blob.name)
-        # create new dir if no dir
-        os.makedirs(os.path.dirname(download_file_path), exist_ok=True)
-        print(f"Downloading {blob.name} to {download_file_path}...")
-        # download file and save it to local
-        with open(download_file_path, "wb") as download_file:
-            download_data = blob_client.download_blob()
-            download_file.write(download_data.readall())
-        print(f"Downloaded {blob.name} to {download_file_path}.")
-print("All .md files have been downloaded.")
-
-# search files in local dirs
-for root, dirs, files in os.walk(local_download_path):
-    for file in files:
-        if file.endswith(".md"):
-            md_file_path = os.path.join(root, file)
-            txt_file_path = os.path.join(
-                root, file[:-3] + ".txt"
-            )  # change .md to .txt for supporting graphrag index
-            os.rename(md_file_path, txt_file_path)
-            print(f"Renamed {md_file_path} to {txt_file_path}")
-print("All .md files have been renamed to .txt.")
+def copy_md_files_as_txt(src_folder, dst_folder, max_workers):
+    """
+    Function to copy the .md files of a folder to dst_folder, renamed to .txt.
+
+    Args:
+    src_folder (str): The folder containing the .md files (e.g. the mounted step6 output).
+    dst_folder (str): The folder to copy the .txt files to.
+    max_workers (int): Number of concurrent copies (reads from a mount are latency-bound).
+
+    Returns:
+    int: The number of copied files.
+    """
+    os.makedirs(dst_folder, exist_ok=True)
+    file_names = [
+        file_name
+        for file_name in os.listdir(src_folder)
+        if file_name.endswith(".md")
+    ]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        list(
+            pool.map(
+                lambda file_name: shutil.copyfile(
+                    os.path.join(src_folder, file_name),
+                    os.path.join(dst_folder, file_name[:-3] + ".txt"),
+                ),
+                file_names,
+            )
+        )
+    return len(file_names)
+
+
+if args.step8_input:
+    # convert the step6 output from the mounted folder straight into the GraphRAG input folder
+    copied = copy_md_files_as_txt(
+        args.step8_input, args.step8_output, args.max_workers
+    )
+    print(
+        f"Copied {copied} .md files from {args.step8_input} to {args.step8_output} as .txt."
+    )
+else:
+    # storage acccount info
+    storage_account_connection_string = connection_string(
+        args.storage_account_name, args.storage_apikey
+    )
+    container_name = f"{args.storage_container_name}"
+
+    # one container client whose connection pool is shared by the download threads
+    container_client = create_container_client(
+        storage_account_connection_string, container_name, args.max_workers
+    )
+    # download .md blobs straight to .txt files for supporting graphrag index
+    download_blobs(
+        container_client,
+        args.step8_output,
+        suffix=".md",
+        new_suffix=".txt",
+        name_starts_with=args.name_starts_with,
+        max_workers=args.max_workers,
+    )
+    print("All .md files have been downloaded as .txt.")
@@ -11,6 +11,12 @@ Here's a breakdown of the script's key functionality:
     - `target_storage_container_name`: The container within the storage account where files will be uploaded.
     - `step9_input`: Local directory containing files to be uploaded.
     - `step9_output`: Not explicitly used in the script but is accepted as an argument.
+    - `max_workers`: Number of concurrent uploads (default 16).
+    - `delete_stale`: "True" to delete the blobs that no longer exist in the input directory (default "False").
+    - `source_status` / `source_state`: Optional. Once the files are published, the source described by the gitpull
+      stage (`source_status/source.json`) is recorded as indexed in the persistent `source_state` folder, so the next
+      run can be skipped when the source did not change (`source_state.record_indexed_source`).
+    - `record_source`: "False" to publish without recording the source (publishes that are not the final index).
 
 2. **File Listing and Preparation**:
     - The script lists and displays all files in the specified input directory, showing which files are going to be uploaded to the Azure Blob Storage container.
@@ -18,7 +24,10 @@ Here's a breakdown of the script's key functionality:
 3. **Azure Blob Storage Interaction**:
     - The script constructs the connection string for the Azure Blob Storage service using the provided storage account name and API key.
     - It attempts to create the specified container if it doesn’t already exist.
-    - Files are uploaded to the Azure Blob Storage container while preserving their relative paths. Each file’s progress is logged as it is successfully uploaded.
+    - Files are uploaded to the Azure Blob Storage container while preserving their relative paths, concurrently on one pooled client (`blob_transfer.upload_files`).
+      Large files (e.g. parquet artifacts) are uploaded in 8 MB blocks, several blocks at a time. Progress is logged in MB/s.
+    - Only new or changed files are uploaded: the MD5 of each local file is compared with the `content_md5` of the blob
+      (`blob_transfer.sync_files`), so publish time and egress scale with what changed since the last run.
 
 4. **Error Handling**:
     - In case the container already exists or cannot be created, an exception is handled gracefully with an informative message.
@@ -39,7 +48,15 @@ Here's a breakdown of the script's key functionality:
 import argparse
 import os
 
-from azure.storage.blob import BlobServiceClient
+from blob_transfer import (
+    DEFAULT_MAX_WORKERS,
+    connection_string,
+    create_container_client,
+    ensure_container,
+    list_folder,
+    sync_files,
+)
+from source_state import record_indexed_source
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--target_storage_account_name", type=str)
@@ -47,6 +64,11 @@ parser.add_argument("--target_storage_api_key", type=str)
 parser.add_argument("--target_storage_container_name", type=str)
 parser.add_argument("--step9_input", type=str)
 parser.add_argument("--step9_output", type=str)
+parser.add_argument("--max_workers", type=int, default=DEFAULT_MAX_WORKERS)
+parser.add_argument("--delete_stale", type=str, default="False")
+parser.add_argument("--source_status", type=str, default=None)
+parser.add_argument("--source_state", type=str, default=None)
+parser.add_argument("--record_source", type=str, default="True")
 print("Hello...\nI'm step9 :-)")
 
 args = parser.parse_args()
@@ -61,43 +83,47 @@ print(
 )
 
 
-def upload_files_to_blob(storage_account_name, container_name, folder_path):
-    """Function to upload files from a folder to a specific Azure Blob container."""
-    blob_service_client = BlobServiceClient.from_connection_string(
-        storage_account_name
+def upload_files_to_blob(
+    conn_str, container_name, folder_path, max_workers, delete_stale=False
+):
+    """Function to upload the new or changed files of a folder to a specific Azure Blob container."""
+    container_client = create_container_client(
+        conn_str, container_name, max_workers
     )
-    container_client = blob_service_client.get_container_client(container_name)
-
     # Create the container if it doesn't exist
-    try:
-        container_client.create_container()
-    except Exception as e:
-        print(f"Container already exists or couldn't be created: {e}")
-
-    # Walk through all files in the directory
-    for root, _, files in os.walk(folder_path):
-        for filename in files:
-            file_path = os.path.join(root, filename)
-            print(file_path)
-            # Create a relative path for the blob
-            relative_path = os.path.relpath(file_path, folder_path).replace(
-                "\\", "/"
-            )
-            # Create a blob client
-            blob_client = container_client.get_blob_client(relative_path)
-            # Upload the file
-            with open(file_path, "rb") as data:
-                blob_client.upload_blob(data, overwrite=True)
-            print(f"Uploaded {relative_path} to Azure Blob Storage.")
+    ensure_container(container_client)
+    # Walk through all files in the directory, keeping their relative paths as blob names,
+    # and skip the files whose content is already in the container
+    result = sync_files(
+        container_client, list_folder(folder_path), max_workers, delete_stale
+    )
+    print(
+        f"uploaded {result['uploaded']} files, skipped {result['unchanged']} unchanged files, "
+        f"deleted {result['deleted']} stale blobs."
+    )
 
 
 if __name__ == "__main__":
     src_folder = args.step9_input
     # Upload the files to Azure Blob Storage
-    AZURE_STORAGE_CONNECTION_STRING = f"DefaultEndpointsProtocol=https;AccountName={args.target_storage_account_name};AccountKey={args.target_storage_api_key}"
+    AZURE_STORAGE_CONNECTION_STRING = connection_string(
+        args.target_storage_account_name, args.target_storage_api_key
+    )
     CONTAINER_NAME = f"{args.target_storage_container_name}"
-    print(f"connection_string: {AZURE_STORAGE_CONNECTION_STRING}")
+    # the connection string holds the account key: only the account is logged
+    print(f"storage_account: {args.target_storage_account_name}")
     print(f"container_name: {CONTAINER_NAME}")
     upload_files_to_blob(
-        AZURE_STORAGE_CONNECTION_STRING, CONTAINER_NAME, src_folder
+        AZURE_STORAGE_CONNECTION_STRING,
+        CONTAINER_NAME,
+        src_folder,
+        args.max_workers,
+        args.delete_stale.lower() == "true",
     )
+    # the index is published: the next run can skip this source
+    if (
+        args.source_status
+        and args.source_state
+        and args.record_source.lower() == "true"
+    ):
+        record_indexed_source(args.source_status, args.source_state)
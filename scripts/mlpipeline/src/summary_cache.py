@@ -0,0 +1,226 @@
+"""
+Summary:
+This module provides a content-addressed, disk-backed cache of LLM summaries so that re-runs of the
+summarization steps (step1, step4 and step5) only pay for documents that changed since the last run.
+
+Entries are keyed by a SHA-256 hash of the model, the chat messages (system prompt and user message) and the
+decoding parameters, so any change in the prompt, the document or the settings produces a new key.
+
+Key functionalities:
+- **SQLite Storage**: Entries live in a single SQLite file (`llm_cache.sqlite`) inside `--cache_dir`.
+- **Blob-synced Folder**: SQLite locking does not work on blobfuse mounts, so the file is copied to local disk
+  when the cache is opened and copied back (atomically) when it is closed.
+- **Size-based Eviction**: When the stored summaries exceed `max_bytes`, the least recently used entries are
+  deleted until the cache is back under 90% of the limit.
+- **Shards**: Each shard of a step keeps its own file (`sharding.shard_file_name`). A shard without a file yet (the
+  number of shards changed) is seeded with the entries of the files of the previous layout, which are deleted once
+  every shard has written its own.
+- **Thread Safety**: The connection is shared by the threads of a process and every access holds a lock.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+from sharding import (
+    previous_layout_files,
+    remove_previous_layouts,
+    shard_file_name,
+)
+
+CACHE_FILENAME = "llm_cache.sqlite"
+
+
+def cache_key(model: str, messages: list, params: dict) -> str:
+    """
+    Function to compute the cache key of a chat completion request.
+
+    Args:
+    model (str): The deployment / model name.
+    messages (list): Chat messages (system prompt and user message).
+    params (dict): Decoding parameters (temperature, max_tokens, ...).
+
+    Returns:
+    str: Hex SHA-256 digest identifying the request.
+    """
+    payload = json.dumps(
+        {"model": model, "messages": messages, "params": params},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SummaryCache:
+    """
+    SQLite cache of chat completion results with LRU eviction by total size.
+
+    Args:
+    cache_dir (str): Folder (e.g. a blob-synced datastore mount) holding `llm_cache.sqlite`.
+    max_bytes (int): Upper bound of the total size of cached summaries.
+    shard (tuple): (shard index, number of shards) of the step; shards share cache_dir with one file each.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_bytes: int = 1024 * 1024 * 1024,
+        shard: tuple = (0, 1),
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.shard = shard
+        file_name = shard_file_name(CACHE_FILENAME, shard)
+        self.file_name = file_name
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.local_dir = tempfile.mkdtemp(prefix="llm_cache_")
+        self.local_path = os.path.join(self.local_dir, file_name)
+        remote_path = os.path.join(cache_dir, file_name)
+        seed_paths = []
+        if os.path.exists(remote_path):
+            shutil.copyfile(remote_path, self.local_path)
+        else:
+            seed_paths = previous_layout_files(
+                cache_dir, CACHE_FILENAME, shard
+            )
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            self.local_path, isolation_level=None, check_same_thread=False
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        for seed_path in seed_paths:
+            self.seed(seed_path)
+        self.total_bytes = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM summaries"
+        ).fetchone()[0]
+        if self.total_bytes > self.max_bytes:
+            self.evict(int(self.max_bytes * 0.9))
+        print(
+            f"LLM cache opened from {remote_path}: "
+            f"{self.total_bytes / 1024 / 1024:.1f} MB"
+        )
+
+    def seed(self, seed_path: str):
+        """
+        Function to copy the entries of the cache file of a previous number of shards into this cache.
+
+        Args:
+        seed_path (str): The other cache file, in cache_dir.
+        """
+        local_seed = os.path.join(self.local_dir, "seed.sqlite")
+        try:
+            shutil.copyfile(seed_path, local_seed)
+        except FileNotFoundError:
+            # removed by another shard
+            return
+        self.conn.execute("ATTACH DATABASE ? AS seed", (local_seed,))
+        added = self.conn.execute(
+            "INSERT OR IGNORE INTO summaries SELECT key, value, size, last_used "
+            "FROM seed.summaries"
+        ).rowcount
+        self.conn.execute("DETACH DATABASE seed")
+        os.remove(local_seed)
+        print(f"LLM cache seeded from {seed_path}: {added} entries")
+
+    def get(self, key: str):
+        """
+        Function to look up a cached result and mark it as recently used.
+
+        Args:
+        key (str): Key computed by `cache_key`.
+
+        Returns:
+        str | None: The cached result, or None on a miss.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value FROM summaries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute(
+                "UPDATE summaries SET last_used = ? WHERE key = ?",
+                (time.time(), key),
+            )
+            return row[0]
+
+    def __contains__(self, key: str) -> bool:
+        """Function to check for an entry without counting a hit or a miss"""
+        with self.lock:
+            return (
+                self.conn.execute(
+                    "SELECT 1 FROM summaries WHERE key = ?", (key,)
+                ).fetchone()
+                is not None
+            )
+
+    def put(self, key: str, value: str):
+        """
+        Function to store a result and evict old entries if the cache grew over its size limit.
+
+        Args:
+        key (str): Key computed by `cache_key`.
+        value (str): The result to cache.
+        """
+        size = len(value.encode("utf-8"))
+        with self.lock:
+            previous = self.conn.execute(
+                "SELECT size FROM summaries WHERE key = ?", (key,)
+            ).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO summaries (key, value, size, last_used) "
+                "VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time()),
+            )
+            self.total_bytes += size - (previous[0] if previous else 0)
+            if self.total_bytes > self.max_bytes:
+                self.evict(int(self.max_bytes * 0.9))
+
+    def evict(self, target_bytes: int):
+        """
+        Function to delete least recently used entries until the cache holds at most target_bytes.
+        Called by `put` with the lock held.
+
+        Args:
+        target_bytes (int): Size to shrink the cache to.
+        """
+        rows = self.conn.execute(
+            "SELECT key, size FROM summaries ORDER BY last_used"
+        ).fetchall()
+        evicted = []
+        for key, size in rows:
+            if self.total_bytes <= target_bytes:
+                break
+            evicted.append((key,))
+            self.total_bytes -= size
+        self.conn.executemany("DELETE FROM summaries WHERE key = ?", evicted)
+        print(f"LLM cache: evicted {len(evicted)} entries")
+
+    def close(self):
+        """Function to close the database and copy it back to cache_dir"""
+        with self.lock:
+            self.conn.close()
+        remote_path = os.path.join(self.cache_dir, self.file_name)
+        tmp_path = remote_path + ".tmp"
+        shutil.copyfile(self.local_path, tmp_path)
+        os.replace(tmp_path, remote_path)
+        remove_previous_layouts(self.cache_dir, CACHE_FILENAME, self.shard)
+        shutil.rmtree(self.local_dir, ignore_errors=True)
+        print(
+            f"LLM cache saved to {remote_path}: hits={self.hits} misses={self.misses}"
+        )
@@ -0,0 +1,51 @@
+"""
+Summary:
+This module writes the token analysis of the indexed files (step7 and the fused runner): a CSV of the token count
+of every file, a histogram and a boxplot of the counts.
+
+Key functionalities:
+- **CSV Report**: `save_to_csv` writes `(file name, token count)` rows, largest first.
+- **Plots**: `plot_histogram` and `plot_boxplot` save the distribution of the token counts as PNG files.
+"""
+
+import csv
+
+import matplotlib.pyplot as plt
+
+
+def save_to_csv(data, output_csv):
+    """Save token count data to CSV."""
+    # Sort data by token count in descending order
+    sorted_data = sorted(data, key=lambda x: x[1], reverse=True)
+
+    with open(output_csv, "w", newline="", encoding="utf-8") as csvfile:
+        csvwriter = csv.writer(csvfile)
+        csvwriter.writerow(["File Name", "Token Count"])
+        csvwriter.writerows(sorted_data)
+
+
+def plot_histogram(token_counts, hist_output_png):
+    """Plot a histogram of token counts."""
+    min_token = min(token_counts)
+    max_token = max(token_counts)
+    print(min_token, max_token)
+    num_bins = 20  # Set the number of bins
+    plt.figure(figsize=(10, 6))
+    plt.hist(
+        token_counts, bins=num_bins, range=(min_token, 1000), edgecolor="black"
+    )
+    plt.title("Token Count Histogram")
+    plt.xlabel("Token Count")
+    plt.ylabel("Frequency")
+    plt.grid(True)
+    plt.savefig(hist_output_png)
+
+
+def plot_boxplot(token_counts, boxplot_output_png):
+    """Plot a boxplot of token counts."""
+    plt.figure(figsize=(10, 6))
+    plt.boxplot(token_counts, vert=False)
+    plt.title("Token Count Boxplot")
+    plt.xlabel("Token Count")
+    plt.grid(True)
+    plt.savefig(boxplot_output_png)
@@ -0,0 +1,58 @@
+"""
+Summary:
+This module spreads the CPU-bound splitting of step2 and step5 (tiktoken encoding and Markdown scanning)
+over a pool of worker processes.
+
+Key functionalities:
+- **Process Pool**: `--workers N` splits the files on N processes; 0 uses every core of the node and 1 keeps
+  the serial loop in the main process.
+- **Deterministic Output**: Results are returned in input order and the files are written by the main process,
+  so the output folder is the same for any number of workers.
+- **Forked Workers**: The step scripts parse their arguments at import time, so workers are forked (they inherit
+  the parsed arguments and the functions of the script) instead of spawned.
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+def add_worker_argument(parser, default: int = 1):
+    """
+    Function to add the `--workers` argument to a step's argument parser.
+
+    Args:
+    parser (argparse.ArgumentParser): The step's argument parser.
+    default (int): Default number of worker processes.
+    """
+    parser.add_argument("--workers", type=int, default=default)
+
+
+def resolve_workers(workers: int) -> int:
+    """Function to turn `--workers` into a process count (0 or less means one per core)"""
+    return workers if workers > 0 else os.cpu_count() or 1
+
+
+def map_files(function, items: list, workers: int = 1):
+    """
+    Function to apply function to every item, on a process pool if more than one worker is requested.
+
+    Args:
+    function (callable): A module-level function taking one item.
+    items (list): The items (e.g. file paths) to process.
+    workers (int): Number of worker processes (see `resolve_workers`).
+
+    Returns:
+    iterator: The results, in the order of items.
+    """
+    workers = min(resolve_workers(workers), len(items))
+    if workers <= 1:
+        yield from map(function, items)
+        return
+    print(f"splitting {len(items)} files on {workers} worker processes")
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("fork")
+    ) as pool:
+        yield from pool.map(
+            function, items, chunksize=max(1, len(items) // (workers * 4))
+        )
@@ -0,0 +1,12 @@
+"""
+Summary:
+Shared setup of the tests of the pipeline scripts: the scripts import each other as top-level modules (they run
+from `src` in the AML jobs), so `src` is put on the import path.
+"""
+
+import os
+import sys
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
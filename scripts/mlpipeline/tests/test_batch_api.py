@@ -0,0 +1,169 @@
+"""
+Summary:
+Tests of `batch_api.BatchRunner` against `tools/fake_openai_server.py`, through an `LLMClient` created from the
+arguments of a step with `--llm_backend openai`: results are mapped back to the requests by `custom_id`, requests
+the batch did not answer are sent synchronously, a saved batch is resumed and a batch that no longer exists is
+dropped.
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from batch_api import BatchRunner, add_batch_arguments
+from llm_client import LLMClient, add_llm_arguments
+from sharding import add_shard_arguments
+from summary_cache import cache_key
+
+SERVER = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..",
+    "tools",
+    "fake_openai_server.py",
+)
+FAIL_SUBSTR = "FAIL"
+PARAMS = {"temperature": 0}
+# contents of distinct lengths: the fake answers with the length
+CONTENTS = [
+    "Short section.",
+    "A somewhat longer section of a document.",
+    "The longest section of the document, with several more words in it.",
+    f"A section the batch can't answer: {FAIL_SUBSTR}.",
+]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def base_url():
+    port = free_port()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            SERVER,
+            "--port",
+            str(port),
+            "--polls",
+            "2",
+            "--fail_substr",
+            FAIL_SUBSTR,
+        ],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), 0.1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+        yield f"http://127.0.0.1:{port}/v1"
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def step_args(base_url: str, batch_dir: str):
+    """Function to parse the arguments of a step running in batch mode against the fake server"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--aoai_resource", type=str)
+    parser.add_argument("--aoai_apikey", type=str)
+    parser.add_argument("--aoai_model", type=str)
+    add_llm_arguments(parser)
+    add_batch_arguments(parser)
+    add_shard_arguments(parser)
+    return parser.parse_args(
+        [
+            "--aoai_model",
+            "m",
+            "--llm_backend",
+            "openai",
+            "--llm_base_url",
+            base_url,
+            "--max_retries",
+            "0",
+            "--batch_mode",
+            "True",
+            "--batch_dir",
+            batch_dir,
+            "--batch_poll_seconds",
+            "0.01",
+        ]
+    )
+
+
+def create_runner(base_url: str, batch_dir: str) -> tuple:
+    """Function to create the client and the batch runner of a step, as a new job does"""
+    args = step_args(base_url, batch_dir)
+    llm = LLMClient.from_args(args)
+    return llm, BatchRunner.from_args(args, llm)
+
+
+def requests(contents: list = CONTENTS) -> list:
+    return [([{"role": "user", "content": c}], PARAMS) for c in contents]
+
+
+def answer(content: str) -> str:
+    return f"Fake summary of {len(content)} characters."
+
+
+def test_results_are_mapped_back_and_failures_sent_synchronously(
+    base_url, tmp_path, capsys
+):
+    llm, runner = create_runner(base_url, str(tmp_path))
+    runner.prefetch(requests())
+    assert "completed (3/4 done, 1 failed)" in capsys.readouterr().out
+    assert sorted(llm.prefetched.values()) == sorted(
+        answer(c) for c in CONTENTS if FAIL_SUBSTR not in c
+    )
+    for (messages, params), content in zip(requests(), CONTENTS):
+        assert llm.complete(messages, **params) == answer(content)
+    assert llm.stats.batch_hits == 3
+    assert llm.stats.requests == 1
+    assert not os.path.exists(runner.state_path)
+
+
+def test_saved_batch_is_resumed(base_url, tmp_path, capsys):
+    contents = [c for c in CONTENTS if FAIL_SUBSTR not in c]
+    llm, runner = create_runner(base_url, str(tmp_path))
+    wanted = {
+        cache_key(llm.cache_model, messages, params): (messages, params)
+        for messages, params in requests(contents)
+    }
+    # the job is interrupted once the batch is submitted
+    batch_id = runner.submit(list(wanted), wanted)
+    assert runner.read_state()["batch_id"] == batch_id
+
+    llm, runner = create_runner(base_url, str(tmp_path))
+    runner.prefetch(requests(contents))
+    output = capsys.readouterr().out
+    assert f"resuming batch {batch_id}" in output
+    assert "0 to submit" in output
+    assert not os.path.exists(runner.state_path)
+    for (messages, params), content in zip(requests(contents), contents):
+        assert llm.complete(messages, **params) == answer(content)
+    assert llm.stats.batch_hits == len(contents)
+    assert llm.stats.requests == 0
+
+
+def test_missing_batch_drops_the_state(base_url, tmp_path):
+    llm, runner = create_runner(base_url, str(tmp_path))
+    runner.write_state({"batch_id": "batch-gone", "requests": 4})
+    runner.prefetch(requests())
+    assert not os.path.exists(runner.state_path)
+    for (messages, params), content in zip(requests(), CONTENTS):
+        assert llm.complete(messages, **params) == answer(content)
+    assert llm.stats.batch_hits == 0
+    assert llm.stats.requests == len(CONTENTS)
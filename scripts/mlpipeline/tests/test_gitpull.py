@@ -0,0 +1,172 @@
+"""
+Summary:
+Tests of `gitpull.pull_source` against a local bare repository served over `file://` (so `git fetch` goes through
+upload-pack and honors `--filter=blob:none`, as with a remote). Every run uses fresh work and output folders, as a
+new AML job does; only the `source_state` folder persists between runs.
+"""
+
+import os
+import subprocess
+
+import pytest
+
+from gitpull import pull_source
+from source_state import (
+    CHANGED_FILES_FILENAME,
+    INDEXED_SOURCE_FILENAME,
+    SOURCE_FILENAME,
+    UNCHANGED_MARKER,
+    read_source,
+    record_indexed_source,
+)
+
+FOLDER = "docs"
+BRANCH = "main"
+GIT_ENV = {
+    "GIT_AUTHOR_NAME": "test",
+    "GIT_AUTHOR_EMAIL": "test@example.com",
+    "GIT_COMMITTER_NAME": "test",
+    "GIT_COMMITTER_EMAIL": "test@example.com",
+}
+
+
+def run_git(*git_args, cwd=None) -> str:
+    return subprocess.run(
+        ["git", *git_args],
+        cwd=cwd,
+        check=True,
+        stdout=subprocess.PIPE,
+        text=True,
+        env={**os.environ, **GIT_ENV},
+    ).stdout.strip()
+
+
+class Remote:
+    """A bare repository and a clone to push commits to it"""
+
+    def __init__(self, root: str):
+        self.bare = os.path.join(root, "remote.git")
+        self.url = "file://" + self.bare
+        self.clone = os.path.join(root, "author")
+        run_git("init", "--bare", "-b", BRANCH, self.bare)
+        run_git("config", "uploadpack.allowFilter", "true", cwd=self.bare)
+        run_git(
+            "config",
+            "uploadpack.allowReachableSHA1InWant",
+            "true",
+            cwd=self.bare,
+        )
+        run_git("init", "-b", BRANCH, self.clone)
+        run_git("remote", "add", "origin", self.url, cwd=self.clone)
+
+    def commit(self, files: dict, deleted: list = ()) -> str:
+        """Function to commit files (path -> content) and deletions, and push them"""
+        for path, content in files.items():
+            file_path = os.path.join(self.clone, path)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, "w", encoding="utf-8") as f:
+                f.write(content)
+        for path in deleted:
+            os.remove(os.path.join(self.clone, path))
+        run_git("add", "-A", cwd=self.clone)
+        run_git("commit", "-m", "update", cwd=self.clone)
+        run_git("push", "origin", BRANCH, cwd=self.clone)
+        return run_git("rev-parse", "HEAD", cwd=self.clone)
+
+
+@pytest.fixture
+def remote(tmp_path):
+    remote = Remote(str(tmp_path))
+    remote.commit(
+        {
+            "docs/a.md": "# A\n",
+            "docs/b.md": "# B\n",
+            "docs/sub/c.md": "# C\n",
+            "other/x.md": "# X\n",
+        }
+    )
+    return remote
+
+
+def pull(remote: Remote, tmp_path, run: int) -> str:
+    """Function to run gitpull as a new job, returning its source_status folder"""
+    run_dir = os.path.join(str(tmp_path), f"run{run}")
+    status_dir = os.path.join(run_dir, "source_status")
+    pull_source(
+        remote.url,
+        FOLDER,
+        BRANCH,
+        os.path.join(run_dir, "work"),
+        os.path.join(str(tmp_path), "source_state"),
+        os.path.join(run_dir, "output"),
+        status_dir,
+    )
+    return status_dir
+
+
+def read_changes(status_dir: str) -> set:
+    with open(
+        os.path.join(status_dir, CHANGED_FILES_FILENAME), encoding="utf-8"
+    ) as f:
+        return {tuple(line.rstrip("\n").split("\t")) for line in f}
+
+
+def publish(tmp_path, status_dir: str):
+    """Function to record the source as indexed, as step9 does after publishing"""
+    record_indexed_source(
+        status_dir, os.path.join(str(tmp_path), "source_state")
+    )
+
+
+def test_first_run_lists_every_file_as_added(remote, tmp_path):
+    status_dir = pull(remote, tmp_path, 1)
+    assert read_changes(status_dir) == {
+        ("A", "docs/a.md"),
+        ("A", "docs/b.md"),
+        ("A", "docs/sub/c.md"),
+    }
+    assert not os.path.exists(os.path.join(status_dir, UNCHANGED_MARKER))
+    output = os.path.join(str(tmp_path), "run1", "output", FOLDER)
+    assert sorted(os.listdir(output)) == ["a.md", "b.md", "sub"]
+
+
+def test_unchanged_head_stops_at_ls_remote(remote, tmp_path):
+    publish(tmp_path, pull(remote, tmp_path, 1))
+    status_dir = pull(remote, tmp_path, 2)
+    assert os.path.exists(os.path.join(status_dir, UNCHANGED_MARKER))
+    assert os.path.exists(os.path.join(status_dir, SOURCE_FILENAME))
+    # nothing was fetched nor checked out
+    assert not os.path.exists(os.path.join(str(tmp_path), "run2", "work"))
+
+
+def test_commit_outside_the_folder_moves_the_indexed_source(remote, tmp_path):
+    publish(tmp_path, pull(remote, tmp_path, 1))
+    state_path = os.path.join(
+        str(tmp_path), "source_state", INDEXED_SOURCE_FILENAME
+    )
+    indexed = read_source(state_path)
+    head = remote.commit({"other/y.md": "# Y\n"})
+    status_dir = pull(remote, tmp_path, 2)
+    assert os.path.exists(os.path.join(status_dir, UNCHANGED_MARKER))
+    moved = read_source(state_path)
+    assert moved["commit"] == head != indexed["commit"]
+    assert moved["tree"] == indexed["tree"]
+    # the next run stops at ls-remote
+    status_dir = pull(remote, tmp_path, 3)
+    assert os.path.exists(os.path.join(status_dir, UNCHANGED_MARKER))
+    assert not os.path.exists(os.path.join(str(tmp_path), "run3", "work"))
+
+
+def test_changes_in_the_folder_are_listed(remote, tmp_path):
+    publish(tmp_path, pull(remote, tmp_path, 1))
+    remote.commit(
+        {"docs/new.md": "# New\n", "docs/b.md": "# B, modified\n"},
+        deleted=["docs/sub/c.md"],
+    )
+    status_dir = pull(remote, tmp_path, 2)
+    assert read_changes(status_dir) == {
+        ("A", "docs/new.md"),
+        ("M", "docs/b.md"),
+        ("D", "docs/sub/c.md"),
+    }
+    assert not os.path.exists(os.path.join(status_dir, UNCHANGED_MARKER))
@@ -0,0 +1,64 @@
+"""
+Summary:
+Regression tests of `md_chunker.chunk_text`: every chunk must be an exact substring of the document and fit in
+`max_tokens` tokens, with and without overlap, whatever the break points of the document (paragraphs, sentences,
+list items, code blocks, lines longer than a chunk).
+"""
+
+import pytest
+
+from md_chunker import chunk_text
+from md_splitter import count_tokens
+
+FIXTURES = {
+    "prose": (
+        "# Title\n\n"
+        + "This is a sentence of the first paragraph. " * 20
+        + "\n\n"
+        + "Another paragraph! It has questions? And several sentences. " * 10
+        + "\n"
+    ),
+    "lists_and_code": (
+        "## Steps\n\n"
+        + "".join(f"- item number {i} of the list\n" for i in range(30))
+        + "\n```python\n"
+        + "".join(f"value_{i} = compute({i})\n" for i in range(40))
+        + "```\n\n"
+        + "1. first\n2. second\n3. third\n"
+    ),
+    "long_line": "word" * 400 + "\n\n" + "Short tail paragraph.\n",
+    "html_and_table": (
+        "<div>\n" + "<p>html content</p>\n" * 30 + "</div>\n\n"
+        "| a | b |\n|---|---|\n"
+        + "".join(f"| {i} | cell {i} |\n" for i in range(30))
+    ),
+    "japanese": "日本語の文章です。" * 60
+    + "\n\n"
+    + "次の段落です。" * 30
+    + "\n",
+}
+
+
+@pytest.mark.parametrize("overlap_tokens", [0, 8, 24])
+@pytest.mark.parametrize("max_tokens", [32, 64, 200])
+@pytest.mark.parametrize("name", sorted(FIXTURES))
+def test_chunks_are_substrings_within_limit(name, max_tokens, overlap_tokens):
+    text = FIXTURES[name]
+    chunks = chunk_text(text, max_tokens, overlap_tokens)
+    assert chunks
+    for chunk in chunks:
+        assert chunk in text
+        assert count_tokens(chunk) <= max_tokens
+
+
+@pytest.mark.parametrize("max_tokens", [32, 64, 200])
+@pytest.mark.parametrize("name", sorted(FIXTURES))
+def test_chunks_without_overlap_cover_the_document(name, max_tokens):
+    text = FIXTURES[name]
+    position = 0
+    for chunk in chunk_text(text, max_tokens):
+        start = text.index(chunk, position)
+        # only whitespace between two chunks
+        assert not text[position:start].strip()
+        position = start + len(chunk)
+    assert not text[position:].strip()
@@ -0,0 +1,126 @@
+"""
+Summary:
+Regression tests of `md_splitter.split_markdown`: splitting with a single tokenization of the document must give
+the same sections as the original `process_sections` of step2, which re-encoded every candidate section.
+
+The reference below is that original code, with one change: headings are split with `md_parser`, as in the
+current splitter, so `#` lines inside code and HTML blocks are not headings. On documents without code and HTML
+blocks, the reference with the original regular expression split is compared too.
+"""
+
+import re
+
+import pytest
+
+from md_parser import heading_starts, scan_lines
+from md_splitter import count_tokens, split_markdown
+
+FIXTURES = {
+    "plain": (
+        "# Title\n\nIntro paragraph with a few words in it.\n\n"
+        "## First\n\n" + "Words of the first part. " * 30 + "\n\n"
+        "## Second\n\nShort second part.\n\n"
+        "# Other title\n\nAnother top-level section.\n"
+    ),
+    "deep_headings": (
+        "Preamble before any heading.\n\n"
+        "# Guide\n\n"
+        "## Setup\n\n"
+        "### Install\n\n" + "Run the installer and wait. " * 20 + "\n\n"
+        "### Configure\n\n" + "Edit the configuration file. " * 20 + "\n\n"
+        "#### Options\n\n- a\n- b\n\n"
+        "## Usage\n\n" + "Use the tool every day. " * 12 + "\n\n"
+        "###### Deep\n\nDeepest heading.\n"
+    ),
+    "oversized": (
+        "# Huge\n\n" + "No heading can split this paragraph. " * 60 + "\n\n"
+        "## Also huge\n\n" + "Still a very long paragraph. " * 60 + "\n"
+    ),
+    "code_fences": (
+        "# Code\n\nSome text before the code.\n\n"
+        "```bash\n# not a heading\n## not a heading either\necho hi\n```\n\n"
+        "## Real\n\n" + "Text after the fence. " * 25 + "\n\n"
+        "~~~\n### inside a tilde fence\n~~~\n\n"
+        "    # indented code, not a heading\n\n"
+        "## Last\n\nThe end.\n"
+    ),
+    "html_blocks": (
+        "# Page\n\n<div>\n# not a heading in HTML\n</div>\n\n"
+        "## Table\n\n<table>\n<tr><td>## cell</td></tr>\n</table>\n\n"
+        + "Paragraph after the table. " * 25
+        + "\n\n## End\n\n<!--\n### commented out\n-->\nDone.\n"
+    ),
+}
+
+MAX_TOKENS = [16, 40, 120, 512, 4096]
+
+
+def parser_split(section: str, delimiter: str) -> list:
+    """Function to split a section at its headings of one level, found by md_parser"""
+    starts = heading_starts(scan_lines(section), len(delimiter))
+    pieces = []
+    previous = 0
+    for start in starts:
+        pieces.append(section[previous:start])
+        previous = start + len(delimiter) + 1
+    pieces.append(section[previous:])
+    return pieces
+
+
+def regex_split(section: str, delimiter: str) -> list:
+    """Function to split a section the way the original step2 did"""
+    return re.split(rf"(?m)^{delimiter} ", section)
+
+
+def reference_split(content: str, max_tokens: int, split_section) -> list:
+    """Function to split a document with the original process_sections, re-encoding every section"""
+    sections = ["# " + section for section in split_section(content, "#")]
+    processed_sections = []
+    for section in sections:
+        if count_tokens(section) <= max_tokens:
+            processed_sections.append(section)
+        else:
+            sub_sections = split_section(section, "##")
+            if all(count_tokens(sub) <= max_tokens for sub in sub_sections):
+                processed_sections.extend(sub_sections)
+            else:
+                for sub_section in sub_sections:
+                    if count_tokens(sub_section) <= max_tokens:
+                        processed_sections.append(sub_section)
+                    else:
+                        deeper_sub_sections = split_section(sub_section, "###")
+                        if all(
+                            count_tokens(deep) <= max_tokens
+                            for deep in deeper_sub_sections
+                        ):
+                            processed_sections.extend(deeper_sub_sections)
+                        else:
+                            processed_sections.append(sub_section)
+    return processed_sections
+
+
+@pytest.mark.parametrize("max_tokens", MAX_TOKENS)
+@pytest.mark.parametrize("name", sorted(FIXTURES))
+def test_same_sections_as_process_sections(name, max_tokens):
+    content = FIXTURES[name]
+    assert split_markdown(content, max_tokens) == reference_split(
+        content, max_tokens, parser_split
+    )
+
+
+@pytest.mark.parametrize("max_tokens", MAX_TOKENS)
+@pytest.mark.parametrize("name", ["plain", "deep_headings", "oversized"])
+def test_same_sections_as_regex_split(name, max_tokens):
+    content = FIXTURES[name]
+    assert split_markdown(content, max_tokens) == reference_split(
+        content, max_tokens, regex_split
+    )
+
+
+def test_headings_in_code_and_html_are_kept():
+    sections = split_markdown(FIXTURES["code_fences"], 16)
+    assert any(
+        "# not a heading\n## not a heading either" in s for s in sections
+    )
+    sections = split_markdown(FIXTURES["html_blocks"], 16)
+    assert any("<div>\n# not a heading in HTML\n</div>" in s for s in sections)
@@ -0,0 +1,243 @@
+"""
+Summary:
+This script runs a local fake of the OpenAI chat completions, files and batches APIs, to test the summarization
+steps without an external service: `--llm_backend openai --llm_base_url http://127.0.0.1:<port>/v1` for the
+synchronous requests, `--batch_mode True --batch_base_url http://127.0.0.1:<port>/v1` for the Batch API mode
+(`batch_api`).
+
+Key functionalities:
+- **Deterministic Answers**: Every request is answered with "Fake summary of <n> characters." where n is the
+  length of its last message, synchronously or in a batch, so the outputs of both modes can be compared.
+- **Batch Jobs**: Uploaded JSONL files are kept in memory. A batch stays "in_progress" for `--polls` status checks,
+  then completes with one output line per request.
+- **Failures**: Batch requests whose last message contains `--fail_substr` are answered with an error (the step
+  sends them synchronously). With `--batch_models`, batches for other models are rejected with a 400 error, as
+  Azure OpenAI rejects deployments that are not Global-Batch deployments.
+
+Command-line Arguments:
+- --port: Port to listen on (127.0.0.1).
+- --polls: Status checks before a batch completes.
+- --fail_substr: Batch requests containing this text fail.
+- --batch_models: Comma-separated models accepted for batch jobs (any if omitted).
+
+Example:
+    python tools/fake_openai_server.py --port 8765 &
+    cd src && python step1.py --llm_backend openai --llm_base_url http://127.0.0.1:8765/v1 --aoai_model m \
+        --step1_input <docs> --step1_output <out> --batch_mode True --cache_dir <cache>
+"""
+
+import argparse
+import itertools
+import json
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--port", type=int, default=8765)
+parser.add_argument("--polls", type=int, default=2)
+parser.add_argument("--fail_substr", type=str, default="")
+parser.add_argument("--batch_models", type=str, default=None)
+
+FILES = {}
+BATCHES = {}
+ids = itertools.count(1)
+
+
+def fake_answer(messages: list) -> str:
+    """Function to build the answer of a request"""
+    return f"Fake summary of {len(messages[-1]['content'])} characters."
+
+
+def completion(model: str, messages: list) -> dict:
+    """Function to build a chat completion body"""
+    return {
+        "id": f"chatcmpl-{next(ids)}",
+        "object": "chat.completion",
+        "created": 0,
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {
+                    "role": "assistant",
+                    "content": fake_answer(messages),
+                },
+            }
+        ],
+        "usage": {
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "total_tokens": 0,
+        },
+    }
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """Request handler of the fake API"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, body, status: int = 200, text: str = None):
+        data = text.encode() if text is not None else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header(
+            "Content-Type",
+            (
+                "application/octet-stream"
+                if text is not None
+                else "application/json"
+            ),
+        )
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def batch(self, batch_id: str) -> dict:
+        batch = BATCHES[batch_id]
+        total = len(FILES[batch["input_file_id"]].splitlines())
+        done = batch["output_file_id"] is not None
+        return {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": batch["endpoint"],
+            "input_file_id": batch["input_file_id"],
+            "completion_window": "24h",
+            "status": "completed" if done else "in_progress",
+            "created_at": 0,
+            "output_file_id": batch["output_file_id"],
+            "request_counts": {
+                "total": total,
+                "completed": total - batch["failed"] if done else 0,
+                "failed": batch["failed"],
+            },
+        }
+
+    def upload(self, data: bytes):
+        boundary = re.search(
+            r"boundary=(.+)", self.headers["Content-Type"]
+        ).group(1)
+        part = [
+            part
+            for part in data.split(b"--" + boundary.encode())
+            if b'name="file"' in part
+        ][0]
+        content = part.split(b"\r\n\r\n", 1)[1].rsplit(b"\r\n", 1)[0]
+        file_id = f"file-{next(ids)}"
+        FILES[file_id] = content.decode("utf-8")
+        print(f"uploaded {file_id}: {len(FILES[file_id].splitlines())} lines")
+        self.send(
+            {
+                "id": file_id,
+                "object": "file",
+                "bytes": len(content),
+                "created_at": 0,
+                "filename": "batch.jsonl",
+                "purpose": "batch",
+                "status": "uploaded",
+            }
+        )
+
+    def create_batch(self, request: dict):
+        models = {
+            json.loads(line)["body"]["model"]
+            for line in FILES[request["input_file_id"]].splitlines()
+        }
+        if args.batch_models and not models <= set(
+            args.batch_models.split(",")
+        ):
+            print(f"rejected batch for {sorted(models)}")
+            return self.send(
+                {
+                    "error": {
+                        "message": "The deployment is not a Global-Batch deployment.",
+                        "type": "invalid_request_error",
+                        "code": "invalidDeploymentType",
+                    }
+                },
+                status=400,
+            )
+        batch_id = f"batch-{next(ids)}"
+        BATCHES[batch_id] = {
+            **request,
+            "output_file_id": None,
+            "polls": 0,
+            "failed": 0,
+        }
+        print(f"created {batch_id} for {sorted(models)}")
+        self.send(self.batch(batch_id))
+
+    def poll_batch(self, batch_id: str):
+        if batch_id not in BATCHES:
+            return self.send({"error": {"message": "not found"}}, status=404)
+        batch = BATCHES[batch_id]
+        batch["polls"] += 1
+        if batch["output_file_id"] is None and batch["polls"] >= args.polls:
+            lines = []
+            for line in FILES[batch["input_file_id"]].splitlines():
+                request = json.loads(line)
+                messages = request["body"]["messages"]
+                if (
+                    args.fail_substr
+                    and args.fail_substr in messages[-1]["content"]
+                ):
+                    response = {"status_code": 500, "body": {}}
+                    batch["failed"] += 1
+                else:
+                    response = {
+                        "status_code": 200,
+                        "body": completion(request["body"]["model"], messages),
+                    }
+                lines.append(
+                    json.dumps(
+                        {
+                            "custom_id": request["custom_id"],
+                            "response": response,
+                        }
+                    )
+                )
+            file_id = f"file-{next(ids)}"
+            FILES[file_id] = "\n".join(lines)
+            batch["output_file_id"] = file_id
+        self.send(self.batch(batch_id))
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path == "/v1/chat/completions":
+            request = json.loads(data)
+            return self.send(completion(request["model"], request["messages"]))
+        if self.path == "/v1/files":
+            return self.upload(data)
+        if self.path == "/v1/batches":
+            return self.create_batch(json.loads(data))
+        self.send({"error": {"message": "not found"}}, status=404)
+
+    def do_GET(self):
+        match = re.match(r"^/v1/files/([^/]+)(/content)?$", self.path)
+        if match and match.group(1) in FILES:
+            if match.group(2):
+                return self.send(None, text=FILES[match.group(1)])
+            return self.send(
+                {
+                    "id": match.group(1),
+                    "object": "file",
+                    "bytes": len(FILES[match.group(1)]),
+                    "created_at": 0,
+                    "filename": "batch.jsonl",
+                    "purpose": "batch",
+                    "status": "processed",
+                }
+            )
+        match = re.match(r"^/v1/batches/([^/]+)$", self.path)
+        if match:
+            return self.poll_batch(match.group(1))
+        self.send({"error": {"message": "not found"}}, status=404)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    print(f"fake OpenAI API on http://127.0.0.1:{args.port}/v1")
+    ThreadingHTTPServer(
+        ("127.0.0.1", args.port), FakeOpenAIHandler
+    ).serve_forever()